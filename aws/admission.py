@@ -0,0 +1,102 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Each user has a token bucket per endpoint, and test submissions have their
+# own. Limits are (tokens per second, bucket size), and can be overridden with
+# ADMISSION_<BUCKET>_RATE and ADMISSION_<BUCKET>_BURST.
+DEFAULT_LIMITS = {
+    "submit": (1 / 60, 30),
+    "submit_test": (1 / 10, 60),
+    "status": (10, 100)
+}
+
+
+def bucket_limit(bucket):
+    """The rate and burst of a bucket, from the environment or the defaults."""
+    rate, burst = DEFAULT_LIMITS[bucket]
+    return (float(os.environ.get("ADMISSION_{}_RATE".format(bucket.upper()), rate)),
+            float(os.environ.get("ADMISSION_{}_BURST".format(bucket.upper()), burst)))
+
+
+class LocalBuckets:
+    """Token buckets in process memory, for local runs and tests.
+
+    Each bucket is kept as the time it will next be full, as
+    DynamoManager.take_rate_tokens keeps them.
+    """
+    def __init__(self):
+        self.full_at = {}
+        self.lock = threading.Lock()
+
+    def take_rate_tokens(self, key, now, interval, burst, cost=1):
+        with self.lock:
+            full_at = max(self.full_at.get(key, now), now) + interval * cost
+            wait = full_at - now - interval * burst
+            if wait > 0:
+                return wait
+            self.full_at[key] = full_at
+            return 0
+
+
+local_buckets = LocalBuckets()
+
+
+def admit(event, dynamo_manager, bucket, cost=1):
+    """Take cost tokens from the requesting user's bucket.
+
+    ADMISSION_MODE chooses where buckets are kept:
+        dynamo: The admission table, shared by every Lambda instance
+        local: This process
+        off: Nowhere, everything is admitted (default)
+    If the buckets can't be reached, the request is admitted.
+
+    Arguments:
+    event (dict): The API Gateway event.
+    dynamo_manager (DynamoManager): The handler's manager.
+    bucket (str): The bucket's name, one of DEFAULT_LIMITS.
+    cost (int): Tokens to take. Default 1.
+
+    Returns:
+    dict: None if the request is admitted, otherwise a 429 response, or a 413
+          if cost is more than the bucket holds, so waiting would never help.
+    """
+    mode = os.environ.get("ADMISSION_MODE", "off")
+    if mode == "off" or cost <= 0:
+        return None
+
+    rate, burst = bucket_limit(bucket)
+    if cost > burst:
+        return {
+            'statusCode': 413,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": "A batch of {} is larger than the limit of {:g} at once".format(
+                        cost, burst)
+                })
+        }
+    key = "{}:{}".format(bucket, event['requestContext']['authorizer']['user_id'])
+    buckets = local_buckets if mode == "local" else dynamo_manager
+    try:
+        wait = buckets.take_rate_tokens(key, time.time(), 1 / rate, burst, cost)
+    except Exception as e:
+        logger.warning("Unable to check the {} bucket, admitting: {}".format(key, repr(e)))
+        return None
+    if not wait:
+        return None
+
+    return {
+        'statusCode': 429,
+        'headers': {'Retry-After': str(int(math.ceil(wait)))},
+        'body': json.dumps(
+            {
+                "success": False,
+                "error": "Too many requests, please retry later"
+            })
+    }
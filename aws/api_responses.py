@@ -0,0 +1,198 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Lambda refuses responses over 6MB, measured on the whole response document.
+# Leave room for the headers and the rest of the envelope.
+MAX_RESPONSE_BYTES = 6 * 1024 * 1024 - 64 * 1024
+
+
+def json_default(obj):
+    """Encode the types Dynamo hands back that JSON does not know about."""
+    if isinstance(obj, Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError("Object of type {} is not JSON serializable".format(
+        type(obj).__name__))
+
+
+def dumps(obj):
+    """Serialize obj to JSON bytes, with orjson when it is installed.
+
+    Decimals from Dynamo become ints or floats, and sets become lists.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=json_default)
+    return json.dumps(obj, default=json_default, separators=(",", ":")).encode("utf-8")
+
+
+def request_header(event, name):
+    """Look up a request header, ignoring the case of its name."""
+    headers = (event or {}).get("headers") or {}
+    return next((value for header, value in headers.items()
+                 if header.lower() == name), None)
+
+
+def entity_tag(*parts):
+    """A weak ETag over the parts a response is built from.
+
+    Weak, because the same content is sent with different Content-Encodings.
+    """
+    # Keys are sorted, as Dynamo does not return attributes in a fixed order
+    encoded = json.dumps(parts, default=json_default, sort_keys=True).encode("utf-8")
+    return 'W/"{}"'.format(hashlib.blake2b(encoded, digest_size=16).hexdigest())
+
+
+def not_modified(event, tag, if_none_match=None):
+    """Build a 304 response if the client's If-None-Match already has tag.
+
+    Arguments:
+    event (dict): The API Gateway event, for the If-None-Match header.
+    tag (str): The ETag of the current response.
+    if_none_match (str): Tags to compare against instead of the header's.
+                         Default None.
+
+    Returns:
+    dict: The 304 response, or None if the client needs the full response.
+    """
+    if_none_match = if_none_match or request_header(event, "if-none-match")
+    if not if_none_match:
+        return None
+    # Comparison is weak, so W/ prefixes don't matter
+    current = tag[2:] if tag.startswith("W/") else tag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate in ("*", current):
+            return {
+                'statusCode': 304,
+                'headers': {"etag": tag},
+                'body': ""
+            }
+    return None
+
+
+DATABASE_BUSY = "The status database is busy, please retry"
+FLOWS_UNAVAILABLE = "Globus Flows is unavailable, please retry"
+
+
+def busy_response(e, message=DATABASE_BUSY):
+    """Build a 503 response for a call that ran out of retries.
+
+    Arguments:
+    e (RetriesExhausted): The error, whose retry_after becomes Retry-After.
+    message (str): The error to report. Default DATABASE_BUSY.
+
+    Returns:
+    dict: The response.
+    """
+    return {
+        'statusCode': 503,
+        'headers': {'Retry-After': str(e.retry_after)},
+        'body': json.dumps(
+            {
+                "success": False,
+                "error": message
+            })
+    }
+
+
+def accepted_encodings(event):
+    """The content codings the client accepts, from its Accept-Encoding header."""
+    accept = request_header(event, "accept-encoding") or ""
+    encodings = set()
+    for part in accept.split(","):
+        coding, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if coding and params not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+def encode_body(body, encodings):
+    """Compress a JSON body with the best coding the client accepts.
+
+    Returns:
+    tuple: The (possibly base64 encoded) body, and its Content-Encoding or None.
+    """
+    min_bytes = int(os.environ.get("RESPONSE_COMPRESSION_MIN_BYTES", 1024))
+    if len(body) >= min_bytes:
+        if brotli is not None and "br" in encodings:
+            return base64.b64encode(brotli.compress(body, quality=5)).decode("ascii"), "br"
+        if "gzip" in encodings or "*" in encodings:
+            return base64.b64encode(gzip.compress(body, compresslevel=6, mtime=0)) \
+                       .decode("ascii"), "gzip"
+    return body.decode("utf-8"), None
+
+
+def json_response(event, status_code, body, headers=None, page_key=None, offset=0):
+    """Build an API Gateway response with a JSON body.
+
+    The body is compressed when the client sends Accept-Encoding. If it would
+    still be over the Lambda response limit, the list under page_key is cut
+    down until it fits, and the body is marked with "truncated": True and the
+    "next_offset" to request next.
+
+    Arguments:
+    event (dict): The API Gateway event, for the request headers.
+    status_code (int): The HTTP status code.
+    body (dict): The response body.
+    headers (dict): Extra response headers. Default None.
+    page_key (str): The key of the list in body that may be truncated. Default None.
+    offset (int): Position of the first item of that list in the full result.
+                  Default 0.
+
+    Returns:
+    dict: The response.
+    """
+    encodings = accepted_encodings(event)
+    encoded, encoding = encode_body(dumps(body), encodings)
+
+    if len(encoded) > MAX_RESPONSE_BYTES and page_key and body.get(page_key):
+        items = body[page_key]
+        keep = len(items)
+        while len(encoded) > MAX_RESPONSE_BYTES and keep > 1:
+            # Shrink in proportion to the overshoot, so large pages fit in a few tries
+            keep = max(1, min(keep - 1, int(keep * MAX_RESPONSE_BYTES / len(encoded) * 0.9)))
+            body = dict(body, **{page_key: items[:keep],
+                                 "truncated": True,
+                                 "next_offset": offset + keep})
+            encoded, encoding = encode_body(dumps(body), encodings)
+
+    if len(encoded) > MAX_RESPONSE_BYTES:
+        return {
+            'statusCode': 500,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": "Response is too large to return"
+                })
+        }
+
+    response_headers = {"content-type": "application/json"}
+    response_headers.update(headers or {})
+    response = {
+        'statusCode': status_code,
+        'headers': response_headers,
+        'body': encoded
+    }
+    if encoding:
+        response_headers["content-encoding"] = encoding
+        response_headers["vary"] = "Accept-Encoding"
+        response['isBase64Encoded'] = True
+    return response
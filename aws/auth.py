@@ -1,9 +1,12 @@
+import logging
 import os
 
 import globus_sdk
-import json
+from request_logging import log_payload, start_request
 from utils import get_secret
 
+logger = logging.getLogger(__name__)
+
 
 def generate_policy(principalId, effect, resource, message="", name=None, identities=[],
                     user_id=None, dependent_token=None, user_email=None,
@@ -28,18 +31,19 @@ def generate_policy(principalId, effect, resource, message="", name=None, identi
         "message": message,
         "group_info": str(group_info),
     }
-    print("AuthResponse", authResponse)
+    log_payload(logger, "AuthResponse", authResponse)
     return authResponse
 
 
 def lambda_handler(event, context):
+    start_request()
     globus_secrets = get_secret(
         secret_name=os.environ["MDF_SECRETS_NAME"],
         region_name=os.environ["MDF_AWS_REGION"],
     )
 
     # Have to log the event to see why methodArn isn't appearing
-    print(json.dumps(event))
+    log_payload(logger, "Authorizer event", event)
 
     auth_client = globus_sdk.ConfidentialAppAuthClient(
         globus_secrets["API_CLIENT_ID"], globus_secrets["API_CLIENT_SECRET"]
@@ -52,12 +56,12 @@ def lambda_handler(event, context):
         dependent_token = auth_client.oauth2_get_dependent_tokens(
             token
         ).by_resource_server
-        print("Dependent tokens ", dependent_token)
+        log_payload(logger, "Dependent tokens", dependent_token)
 
         groups_client = globus_sdk.GroupsClient(authorizer=globus_sdk.AccessTokenAuthorizer(dependent_token['groups.api.globus.org']["access_token"]))
         groups = groups_client.get_my_groups()
         group_info = {group["id"]: {"name": group["name"], "description": group["description"]} for group in groups}
-        print("Group info ", group_info)
+        log_payload(logger, "Group info", group_info)
 
         if not auth_res:
             return generate_policy(None, "Deny", event["routeArn"],
@@ -67,7 +71,7 @@ def lambda_handler(event, context):
             return generate_policy(None, "Deny", event["routeArn"],
                                    message="User account not active")
 
-        print("auth_res", auth_res)
+        log_payload(logger, "auth_res", auth_res.data)
         user_email = auth_res.get("email", "nobody@nowhere.com")
 
         return generate_policy(
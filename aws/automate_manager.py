@@ -1,4 +1,8 @@
+import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from urllib import parse
 
@@ -6,29 +10,44 @@ import globus_sdk
 from globus_automate_client import FlowsClient
 from urllib.parse import urlparse
 
-from globus_sdk import ClientCredentialsAuthorizer, AccessTokenAuthorizer
+from globus_sdk import (ClientCredentialsAuthorizer, AccessTokenAuthorizer, GlobusAPIError,
+                        GlobusTimeoutError)
 
 from globus_automate_flow import GlobusAutomateFlow
+from request_logging import log_payload
+from retry import RetriesExhausted
 
-globus_secrets = None
-mdf_flow = None
-tokens = None
+logger = logging.getLogger(__name__)
 
-def authorizer_callback(*args, **kwargs):
-    auth = AccessTokenAuthorizer(
-        tokens.by_resource_server[mdf_flow.flow_id]['access_token']
-    )
-    return auth
+
+def is_timeout(e):
+    """Did a status lookup fail by running out of time?"""
+    if isinstance(e, RetriesExhausted):
+        e = e.__cause__
+    return isinstance(e, (TimeoutError, GlobusTimeoutError))
+
+
+def unknown_flow_status(description):
+    return {
+        "status": "UNKNOWN",
+        "details": {
+            "description": description
+        }
+    }
 
 
 class AutomateManager:
+    """Starts and looks up MDF flow runs.
 
-    def __init__(self, secrets: dict, is_test: bool=False):
-        # Globals needed for the authorizer_callback
-        global tokens, mdf_flow
+    A manager can be shared by threads. Each has its own flow and FlowsClient,
+    and the tokens its client runs the flow with are kept on the manager,
+    behind a lock, so authenticating again doesn't disturb runs in progress.
+    """
 
-        tokens = None
-        mdf_flow = None
+    def __init__(self, secrets: dict, is_test: bool=False):
+        # Tokens by resource server, from the last authenticate()
+        self.tokens = None
+        self.tokens_lock = threading.Lock()
 
         # See if there is a json file with the flow info
         if os.path.exists("mdf_flow_info.json"):
@@ -36,7 +55,6 @@ class AutomateManager:
         else:
             self.flow = GlobusAutomateFlow.from_existing_flow(flow_id=os.environ['FLOW_ID'],
                                                                 flow_scope=os.environ['FLOW_SCOPE'])
-        mdf_flow = self.flow
 
         self.flows_client = None
         self.email_access_key = secrets['SES_ACCESS_KEY']
@@ -49,13 +67,13 @@ class AutomateManager:
             self.datacite_username = secrets['DATACITE_USERNAME_PROD']
             self.datacite_password = secrets['DATACITE_PASSWORD_PROD']
             self.datacite_prefix = secrets['DATACITE_PREFIX_PROD']
-            print(f"Using PROD Datacite prefix {self.datacite_prefix}, username {self.datacite_username}")
+            logger.debug("Using PROD Datacite prefix %s", self.datacite_prefix)
 
         else:
             self.datacite_username = secrets['DATACITE_USERNAME_TEST']
             self.datacite_password = secrets['DATACITE_PASSWORD_TEST']
             self.datacite_prefix = secrets['DATACITE_PREFIX_TEST']
-            print(f"Using Test Datacite prefix {self.datacite_prefix}, username {self.datacite_username}")
+            logger.debug("Using Test Datacite prefix %s", self.datacite_prefix)
 
 
 
@@ -68,7 +86,6 @@ class AutomateManager:
         # test_data_destination = urlparse('globus://e38ee745-6d04-11e5-ba46-22000b92c6ec/MDF/mdf_connect/test_files/deleteme_contents/')
 
     def authenticate(self):
-        global tokens
         conf_client = globus_sdk.ConfidentialAppAuthClient(
             self.api_client_id, self.api_client_secret)
 
@@ -77,14 +94,15 @@ class AutomateManager:
             "https://auth.globus.org/scopes/eec9b274-0c81-4334-bdc2-54e90e689b9a/view_flows",
             "https://auth.globus.org/scopes/eec9b274-0c81-4334-bdc2-54e90e689b9a/run",
             "https://auth.globus.org/scopes/eec9b274-0c81-4334-bdc2-54e90e689b9a/run_status",
-            mdf_flow.flow_scope
+            self.flow.flow_scope
         ]
 
         tokens = conf_client.oauth2_client_credentials_tokens(
             requested_scopes=requested_scopes)
 
-        print("---->", tokens)
-
+        log_payload(logger, "Client credentials tokens", tokens.by_resource_server)
+        with self.tokens_lock:
+            self.tokens = tokens.by_resource_server
 
         cca = ClientCredentialsAuthorizer(
             conf_client,
@@ -95,11 +113,26 @@ class AutomateManager:
 
         self.flows_client = FlowsClient.new_client(
             client_id=self.api_client_id,
-            authorizer_callback=authorizer_callback,
+            authorizer_callback=self.authorizer_callback,
             authorizer=cca)
+        # Status lookups have a client of their own, whose requests time out
+        # after FLOW_STATUS_TIMEOUT. Retries are left to GlobusAutomateFlow,
+        # which bounds them by the caller's deadline.
+        status_client = FlowsClient.new_client(
+            client_id=self.api_client_id,
+            authorizer_callback=self.authorizer_callback,
+            authorizer=cca,
+            http_timeout=float(os.environ.get("FLOW_STATUS_TIMEOUT", 5)))
+        status_client.transport.max_retries = 0
+
+        logger.debug("Flows client %s", self.flows_client)
+        self.flow.set_client(self.flows_client, status_client=status_client)
 
-        print(self.flows_client)
-        self.flow.set_client(self.flows_client)
+    def authorizer_callback(self, *args, **kwargs):
+        """The authorizer the FlowsClient runs this manager's flow with."""
+        with self.tokens_lock:
+            tokens = self.tokens
+        return AccessTokenAuthorizer(tokens[self.flow.flow_id]['access_token'])
 
     def create_data_entry_for_search(self, user_transfer_inputs):
         return {
@@ -111,7 +144,7 @@ class AutomateManager:
                submitting_user_token, submitting_user_id, submitting_user_email,
                monitor_by_id,
                search_index_uuid,
-               data_sources, is_test=False, update_metadata_only=False):
+               data_sources, is_test=False, update_metadata_only=False, deadline=None):
         # Needs to turn to loop to make as many copies as required by organization
         destination_parsed = urlparse(organization.data_destinations[0])
         assert destination_parsed.scheme == 'globus'
@@ -159,13 +192,18 @@ class AutomateManager:
             .isoformat() \
             .replace("+00:00", "Z")
 
-        print("Flow is ", self.flow)
-        print("Automate_rec is ", automate_rec)
+        logger.debug("Flow %s", self.flow)
+        log_payload(logger, "Flow input", automate_rec)
         flow_run = self.flow.run_flow(automate_rec,
                                       monitor_by=monitor_by_id,
-                                      label=f'MDF Submission {mdf_rec["mdf"]["source_id"]}')
-        print("Result is ", flow_run.action_id)
-        print("Status is ", flow_run.get_status())
+                                      label=f'MDF Submission {mdf_rec["mdf"]["source_id"]}',
+                                      tags=[f'source_id:{mdf_rec["mdf"]["source_id"]}',
+                                            f'version:{mdf_rec["mdf"]["version"]}'],
+                                      deadline=deadline)
+        logger.info("Started flow run %s", flow_run.action_id)
+        # Looking up the status is another call to Globus
+        if logger.isEnabledFor(logging.DEBUG):
+            log_payload(logger, "Flow run status", flow_run.get_status())
         return flow_run.action_id
 
     def create_transfer_items(self, data_sources, organization,
@@ -226,8 +264,86 @@ class AutomateManager:
 
         return user_transfer_inputs
 
-    def get_status(self, action_id: str):
-        return self.flow.get_status(action_id)
+    def get_status(self, action_id: str, deadline: float = None):
+        return self.flow.get_status(action_id, deadline=deadline)
+
+    def get_statuses(self, action_ids: list, deadline: float = None):
+        """Fetch the status of many flow runs on a bounded pool of workers that
+        share this manager's FlowsClient. Batches of at least
+        FLOW_RUN_LISTING_THRESHOLD runs first take in-progress states from the
+        flow's run listing, a page at a time.
+
+        Arguments:
+        action_ids (list of str): The flow runs to look up.
+        deadline (float): time.monotonic() value to stop waiting at. Default None.
+
+        Returns:
+        dict: The flow status for each action_id. Lookups that failed or did not
+              finish in time get an UNKNOWN status saying why.
+        """
+        if not action_ids:
+            return {}
+        statuses = {}
+
+        # For a large batch, list the flow's in-progress runs in a few pages first.
+        # Only runs missing from that list need a status call of their own.
+        if len(action_ids) >= int(os.environ.get("FLOW_RUN_LISTING_THRESHOLD", 20)):
+            try:
+                listed = self.flow.list_runs(
+                    statuses=["ACTIVE", "INACTIVE"],
+                    max_pages=int(os.environ.get("FLOW_RUN_LISTING_MAX_PAGES", 5)))
+                statuses = {action_id: listed[action_id]
+                            for action_id in action_ids if action_id in listed}
+                action_ids = [action_id for action_id in action_ids
+                              if action_id not in statuses]
+            except (GlobusAPIError, RetriesExhausted) as e:
+                logger.warning("Unable to list flow runs: {}".format(e))
+            if not action_ids:
+                return statuses
+
+        workers = int(os.environ.get("FLOW_STATUS_WORKERS", 8))
+        call_timeout = float(os.environ.get("FLOW_STATUS_TIMEOUT", 5))
+
+        def lookup(action_id):
+            # Each request times out after call_timeout, with the status
+            # client's HTTP timeout, and retries stop call_timeout after the
+            # lookup starts. Neither the first request nor a retry is started
+            # unless it would end by the deadline.
+            started = time.monotonic()
+            retry_deadline = started + call_timeout
+            if deadline is not None:
+                if deadline - started < call_timeout:
+                    raise TimeoutError("No time left to look up {}".format(action_id))
+                retry_deadline = min(retry_deadline, deadline - call_timeout)
+            return self.get_status(action_id, deadline=retry_deadline)
+
+        # Every lookup ends by the deadline, so the pool is waited for, and no
+        # thread is left calling Globus once the response is sent
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {action_id: pool.submit(lookup, action_id) for action_id in action_ids}
+
+        timed_out = 0
+        for action_id, future in futures.items():
+            error = future.exception()
+            if is_timeout(error):
+                timed_out += 1
+                statuses[action_id] = unknown_flow_status("Flow status timed out")
+            elif isinstance(error, GlobusAPIError):
+                statuses[action_id] = unknown_flow_status("Flow not found")
+            elif error:
+                logger.error("Flow status for {} failed: {}".format(action_id, error))
+                statuses[action_id] = unknown_flow_status("Flow status unavailable")
+            else:
+                statuses[action_id] = future.result()
+        if timed_out:
+            logger.warning("{} of {} flow status lookups timed out"
+                           .format(timed_out, len(action_ids)))
+        return statuses
 
     def get_log(self, action_id: str):
         return self.flow.get_flow_logs(action_id)
+
+    def get_new_log_entries(self, action_id: str, position: dict):
+        """The entries added to a run's log since position, which is updated to
+        where reading stopped."""
+        return list(self.flow.iter_new_flow_logs(action_id, position))
@@ -1,13 +1,23 @@
-
 # DynamoDB setup
+import base64
 import json
 import logging
+import math
 import os
+import time
+from decimal import Decimal
 
 import boto3
 import jsonschema
 from boto3.dynamodb.conditions import Attr
 from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from dynamo_metrics import DynamoMetrics
+from retry import (RetriesExhausted, RetryPolicy, TokenBucket, deadline_from_context,
+                   error_code)
 
 logger = logging.getLogger(__name__)
 
@@ -41,13 +51,60 @@ class DynamoManager:
         ("ingest_mrr", "Materials Resource Registration"),
         ("ingest_cleanup", "Post-processing cleanup")
     )
+    # Read consistency for each call site. Strongly consistent reads cost twice
+    # the RCUs of eventually consistent ones, so they are reserved for places that
+    # need read-after-write freshness. Override per environment with
+    # DYNAMO_READ_CONSISTENCY, e.g. "status=eventual,export=strong", or a bare
+    # "strong"/"eventual" to set every call site.
+    READ_CONSISTENCY = {
+        "submit": "strong",
+        "status": "strong",
+        "listing": "eventual",
+        "dashboard": "eventual",
+        "export": "eventual",
+        "notify": "eventual",
+        "reconcile": "eventual",
+        # Read from an index, which only supports eventual reads
+        "history": "eventual"
+    }
+    # Fields returned for each version by get_version_history
+    HISTORY_FIELDS = ("source_id", "version", "previous_version", "previous_versions",
+                      "submission_time", "title", "submitter", "test", "action_id")
+    # Versions of each dataset, ordered numerically by their version_order key.
+    # It projects HISTORY_FIELDS and the flow's final state, so a page of
+    # history is one Query.
+    VERSION_ORDER_INDEX = os.environ.get("DYNAMO_VERSION_ORDER_INDEX", "version-order-index")
+    VERSION_SUMMARY_FIELDS = HISTORY_FIELDS + ("flow_state", "flow_description")
+    # Records whose flow run the reconciler still follows, by submission_time.
+    # Only those records have an active_run attribute, so the index holds just
+    # them and reading it costs nothing for the rest of the table.
+    ACTIVE_RUN_INDEX = os.environ.get("DYNAMO_ACTIVE_RUN_INDEX", "active-run-index")
+    ACTIVE_RUN = "1"
+    # Webhook subscriptions by the user who made them, so listing a user's
+    # subscriptions is a Query however many others there are
+    SUBSCRIPTION_USER_INDEX = os.environ.get("DYNAMO_SUBSCRIPTION_USER_INDEX",
+                                             "subscription-user-index")
+    # The most items one TransactWriteItems call may write, and the most bytes
+    # it may send, with room left for the rest of the request
+    TRANSACTION_MAX_ITEMS = 100
+    TRANSACTION_MAX_BYTES = 4 * 1024 * 1024 - 64 * 1024
+    serializer = TypeSerializer()
+    deserializer = TypeDeserializer()
+    # Shared by every manager in the process, so what it learns from throttles
+    # carries over between invocations of a warm Lambda
+    rate_limiter = TokenBucket(float(os.environ.get("DYNAMO_MAX_REQUEST_RATE", 50)))
 
-    def __init__(self):
-        self.dmo_client = boto3.resource('dynamodb', region_name="us-east-1")
+    def __init__(self, handler="local", context=None):
+        # Retries are handled by retry_policy, so botocore should not retry as well
+        self.dmo_client = boto3.resource('dynamodb', region_name="us-east-1",
+                                         config=Config(retries={"total_max_attempts": 1}))
         self.status_table = self.dmo_client.Table(os.environ["DYNAMO_STATUS_TABLE"])
 
         self.dmo_tables = {
-            "status": os.environ["DYNAMO_STATUS_TABLE"]
+            "status": os.environ["DYNAMO_STATUS_TABLE"],
+            "subscriptions": os.environ.get("DYNAMO_SUBSCRIPTIONS_TABLE"),
+            "idempotency": os.environ.get("DYNAMO_IDEMPOTENCY_TABLE"),
+            "admission": os.environ.get("DYNAMO_ADMISSION_TABLE")
         }
 
         # Load status schema
@@ -57,22 +114,150 @@ class DynamoManager:
 
         self.resolver = jsonschema.RefResolver(base_uri="file://{}/{}/".format(os.getcwd(), schema_path), referrer=self.schema)
 
-    def get_current_version(self, source_id):
+        self.read_consistency = self.load_read_consistency(
+            os.environ.get("DYNAMO_READ_CONSISTENCY"))
+        self.metrics = DynamoMetrics(handler)
+        self.retry_policy = RetryPolicy(
+            max_attempts=int(os.environ.get("DYNAMO_MAX_ATTEMPTS", 6)),
+            deadline=deadline_from_context(context),
+            rate_limiter=self.rate_limiter)
+
+    @classmethod
+    def load_read_consistency(cls, overrides):
+        """Build the read consistency policy from the defaults and an override string.
+
+        Arguments:
+        overrides (str): Comma-separated "call_site=level" pairs, or a single level
+                         to apply to every call site. Levels are "strong" or "eventual".
+
+        Returns:
+        dict: The consistency level for each call site.
+        """
+        policy = dict(cls.READ_CONSISTENCY)
+        if not overrides:
+            return policy
+
+        for override in overrides.split(","):
+            override = override.strip()
+            if not override:
+                continue
+            if "=" in override:
+                call_site, level = [x.strip() for x in override.split("=", 1)]
+            else:
+                call_site, level = None, override
+            if level not in ("strong", "eventual"):
+                raise ValueError("Invalid read consistency '{}'".format(override))
+            if call_site:
+                policy[call_site] = level
+            else:
+                policy = {site: level for site in policy}
+        return policy
+
+    def consistent_read(self, call_site):
+        """Should reads from this call site be strongly consistent?
+        Unknown call sites get strong reads."""
+        return self.read_consistency.get(call_site, "strong") == "strong"
+
+    def _call(self, operation, method, call_site=None, **kwargs):
+        """Make a table call, recording its consumed capacity and latency.
+        Throttled and transient failures are retried according to retry_policy.
+
+        Arguments:
+        operation (str): The Dynamo operation name, for metrics.
+        method (callable): The boto3 method to call.
+        call_site (str): For reads, the caller, used to pick the read consistency.
+                         Default None, for calls that are not reads.
+        kwargs: Arguments for the call.
+
+        Returns:
+        dict: The response from Dynamo.
+
+        Raises:
+        RetriesExhausted: If the call was still throttled when the retries or the
+                          invocation's time ran out.
+        """
+        consistent = True
+        if call_site is not None:
+            consistent = self.consistent_read(call_site)
+            # BatchGetItem takes ConsistentRead per table, in RequestItems, and
+            # indexes can't be read consistently
+            if operation != "batch_get_item" and "IndexName" not in kwargs:
+                kwargs["ConsistentRead"] = consistent
+        kwargs["ReturnConsumedCapacity"] = "TOTAL"
+
+        def on_retry(e, attempt, delay):
+            self.metrics.record_retry(operation)
+            logger.warning("Dynamo {} retry {} in {:.2f}s: {}".format(operation, attempt,
+                                                                      delay, e))
+
+        start = time.perf_counter()
+        try:
+            response = self.retry_policy.call(method, on_retry=on_retry, **kwargs)
+        except RetriesExhausted:
+            self.metrics.record_give_up(operation)
+            raise
+        self.metrics.record(operation, time.perf_counter() - start,
+                            response=response, consistent=consistent)
+        return response
+
+    @property
+    def eventual_read_capacity(self):
+        # A strongly consistent read of the same items would have cost twice as
+        # much, so this is also the capacity saved by the consistency policy.
+        return self.metrics.eventual_read_capacity
+
+    def capacity_report(self):
+        """Summarize the read capacity saved by the consistency policy."""
+        logger.info("Eventually consistent reads saved {} RCUs"
+                    .format(self.eventual_read_capacity))
+        return {
+            "read_consistency": self.read_consistency,
+            "eventual_read_capacity": self.eventual_read_capacity,
+            "read_capacity_saved": self.eventual_read_capacity
+        }
+
+    def emit_metrics(self):
+        """Write the capacity and latency metrics for this invocation."""
+        self.metrics.emit()
+
+    @staticmethod
+    def projection(fields):
+        """Build the arguments to read only some attributes of a record.
+
+        Arguments:
+        fields (list of str): The attributes to read, or None for all of them.
+
+        Returns:
+        dict: ProjectionExpression and ExpressionAttributeNames, or nothing if
+              fields is None. Every name is aliased, so reserved words are safe.
+        """
+        if not fields:
+            return {}
+        return {
+            "ProjectionExpression": ", ".join("#" + f for f in fields),
+            "ExpressionAttributeNames": {"#" + f: f for f in fields}
+        }
+
+    def get_current_version(self, source_id, call_site="submit", fields=None):
         done = False
         start_key = None
+        # Only the version numbers are needed to find the latest one, so don't
+        # pay to read every version's full record
         scan_kwargs = {
-            'KeyConditionExpression': Key('source_id').eq(source_id)
+            'KeyConditionExpression': Key('source_id').eq(source_id),
+            'ProjectionExpression': '#v',
+            'ExpressionAttributeNames': {'#v': 'version'}
         }
 
-        versions = {}
+        versions = set()
 
         while not done:
             if start_key:
                 scan_kwargs['ExclusiveStartKey'] = start_key
-            response = self.status_table.query(**scan_kwargs)
+            response = self._call("query", self.status_table.query, call_site=call_site,
+                                  **scan_kwargs)
 
-            # Make a dict of versions
-            versions.update({str(x['version']): x for x in response['Items']})
+            versions.update(str(x['version']) for x in response['Items'])
 
             start_key = response.get('LastEvaluatedKey', None)
             done = start_key is None
@@ -80,12 +265,171 @@ class DynamoManager:
         if not versions:
             return None
 
-        version_numbers = sorted(versions.keys(),
-                                 key=lambda x: [int(i) if i.isdigit() else i for i in
-                                                x.split('.')])
+        latest = max(versions, key=self.version_sort_key)
+        return self._call("get_item", self.status_table.get_item, call_site=call_site,
+                          Key={"source_id": source_id, "version": latest},
+                          **self.projection(fields)).get("Item")
+
+    @staticmethod
+    def version_sort_key(version):
+        return [int(i) if i.isdigit() else i for i in version.split('.')]
+
+    @staticmethod
+    def version_order(version):
+        """A key that sorts versions numerically as strings, so "1.10" comes
+        after "1.9" in the version order index."""
+        return ".".join(part.zfill(8) if part.isdigit() else part
+                        for part in version.split("."))
 
-        latest = version_numbers[-1]
-        return versions[latest]
+    @staticmethod
+    def encode_cursor(cursor):
+        return base64.urlsafe_b64encode(json.dumps(cursor).encode("utf-8")).decode("ascii")
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Read a cursor given out by query_version_history.
+
+        Raises:
+        ValueError: If the cursor is not one of ours.
+        """
+        try:
+            decoded = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except Exception:
+            raise ValueError("Invalid cursor")
+        if not isinstance(decoded, dict) or not ({"key", "version"} & set(decoded)):
+            raise ValueError("Invalid cursor")
+        return decoded
+
+    @staticmethod
+    def parent_version(status):
+        """The version a status record was submitted as an update to, if any.
+
+        Records store their parent as previous_version. Older records carry the
+        whole lineage in previous_versions, as "{source_id}-{version}" strings.
+        """
+        if status.get("previous_version"):
+            return status["previous_version"]
+        if status.get("previous_versions"):
+            return status["previous_versions"][-1].rsplit("-", 1)[-1]
+        return None
+
+    def get_version_history(self, source_id, start_version=None, limit=10,
+                            call_site="status"):
+        """Page through the versions of a dataset, newest first, by following
+        each version's parent pointer.
+
+        Arguments:
+        source_id (str): The dataset to get the history of.
+        start_version (str): The version to start from, usually the next_version
+                             of a previous page. Default None, for the latest version.
+        limit (int): The most versions to return. Default 10.
+        call_site (str): The caller, used to pick the read consistency.
+
+        Returns:
+        dict:
+            success (bool): True on success.
+            versions (list of dict): Summaries of the versions, newest first.
+            next_version (str): The version to start the next page from,
+                                or None if the history is complete.
+        """
+        version = start_version
+        if not version:
+            latest = self.get_current_version(source_id, call_site=call_site)
+            version = latest["version"] if latest else None
+
+        history = []
+        while version and len(history) < limit:
+            entry = self._call("get_item", self.status_table.get_item, call_site=call_site,
+                               Key={"source_id": source_id, "version": version},
+                               **self.projection(self.HISTORY_FIELDS)).get("Item")
+            if not entry:
+                break
+            parent = self.parent_version(entry)
+            entry.pop("previous_versions", None)
+            entry["previous_version"] = parent
+            history.append(entry)
+            version = parent
+
+        return {
+            "success": True,
+            "versions": history,
+            "next_version": version
+        }
+
+    def query_version_history(self, source_id, limit=10, cursor=None, call_site="history"):
+        """Page through the versions of a dataset, newest first, with one Query
+        of the version order index per page.
+
+        Records written before the index existed have no version_order, so when
+        the index runs out the rest of the history is followed through parent
+        pointers, as get_version_history does.
+
+        Arguments:
+        source_id (str): The dataset to get the history of.
+        limit (int): The most versions to return. Default 10.
+        cursor (str): The next_cursor of a previous page. Default None, for the
+                      latest versions.
+        call_site (str): The caller, used to pick the read consistency.
+
+        Returns:
+        dict:
+            success (bool): True on success.
+            versions (list of dict): Summaries of the versions, newest first.
+            next_cursor (str): The cursor for the next page, or None if the
+                               history is complete.
+
+        Raises:
+        ValueError: If the cursor is invalid.
+        """
+        position = self.decode_cursor(cursor) if cursor else {"key": None}
+        history = []
+        # The parent of the last version read, where the history goes on
+        parent = position.get("parent")
+        if "key" in position:
+            query_kwargs = {
+                "IndexName": self.VERSION_ORDER_INDEX,
+                "KeyConditionExpression": Key("source_id").eq(source_id),
+                "ScanIndexForward": False,
+                "Limit": limit
+            }
+            query_kwargs.update(self.projection(self.VERSION_SUMMARY_FIELDS))
+            if position["key"]:
+                query_kwargs["ExclusiveStartKey"] = position["key"]
+            response = self._call("query", self.status_table.query, call_site=call_site,
+                                  **query_kwargs)
+            for entry in response["Items"]:
+                parent = self.parent_version(entry)
+                entry.pop("previous_versions", None)
+                entry["previous_version"] = parent
+                history.append(entry)
+            if response.get("LastEvaluatedKey"):
+                return {
+                    "success": True,
+                    "versions": history,
+                    "next_cursor": self.encode_cursor({"key": response["LastEvaluatedKey"],
+                                                       "parent": parent})
+                }
+            if not position["key"] and not history:
+                # Nothing indexed, so the whole history predates the index
+                latest = self.get_current_version(source_id, call_site=call_site,
+                                                  fields=["version"])
+                parent = latest["version"] if latest else None
+        else:
+            parent = position["version"]
+
+        older = {"versions": [], "next_version": None}
+        if parent and len(history) < limit:
+            older = self.get_version_history(source_id, start_version=parent,
+                                             limit=limit - len(history), call_site=call_site)
+        elif parent:
+            older["next_version"] = parent
+        history.extend(older["versions"])
+        return {
+            "success": True,
+            "versions": history,
+            "next_cursor": (self.encode_cursor({"version": older["next_version"]})
+                            if older["next_version"] else None)
+        }
 
     @staticmethod
     def increment_record_version(current_version):
@@ -110,7 +454,9 @@ class DynamoManager:
             }
         try:
             table = self.dmo_client.Table(table_key)
+            start = time.perf_counter()
             dmo_status = table.table_status
+            self.metrics.record("describe_table", time.perf_counter() - start)
             if dmo_status != "ACTIVE":
                 raise ValueError("Table not active")
         except Exception as e:
@@ -124,7 +470,7 @@ class DynamoManager:
                 "table": table
                 }
 
-    def scan_table(self, table_name, fields=None, filters=None):
+    def scan_table(self, table_name, fields=None, filters=None, call_site="listing"):
         """Scan the status or curation databases..
 
         Arguments:
@@ -148,6 +494,8 @@ class DynamoManager:
                                          in: Is one of the values (requires a list of values)
                                              This operator effectively allows OR-ing '=='
                                value: The value of the field.
+        call_site (str): The caller, used to pick the read consistency.
+                         Default "listing", which reads eventually consistent.
 
         Returns:
         dict: The results of the scan.
@@ -157,7 +505,7 @@ class DynamoManager:
         """
         # Get Dynamo status table
         tbl_res = self.get_dmo_table(table_name)
-        print("Table", tbl_res)
+        logger.debug("Table %s", tbl_res)
 
         if not tbl_res["success"]:
             return tbl_res
@@ -167,7 +515,7 @@ class DynamoManager:
         if isinstance(fields, str) or fields is None:
             proj_exp = fields
         elif isinstance(fields, list):
-            proj_exp = ",".join(fields)
+            proj_exp = self.projection(fields)
         else:
             return {
                 "success": False,
@@ -244,10 +592,10 @@ class DynamoManager:
             }
 
         # Make scan arguments
-        scan_args = {
-            "ConsistentRead": True
-        }
-        if proj_exp is not None:
+        scan_args = {}
+        if isinstance(proj_exp, dict):
+            scan_args.update(proj_exp)
+        elif proj_exp is not None:
             scan_args["ProjectionExpression"] = proj_exp
         if filter_exps is not None:
             # Create valid FilterExpression
@@ -259,9 +607,9 @@ class DynamoManager:
 
         # Make scan call, paging through if too many entries are scanned
         result_entries = []
-        print("Scan ", scan_args)
+        logger.debug("Scan %s", scan_args)
         while True:
-            scan_res = table.scan(**scan_args)
+            scan_res = self._call("scan", table.scan, call_site=call_site, **scan_args)
             # Check for success
             if scan_res["ResponseMetadata"]["HTTPStatusCode"] >= 300:
                 return {
@@ -325,24 +673,235 @@ class DynamoManager:
                 "success": True
             }
 
-    def read_status_record(self, source_id, version):
+    def read_status_record(self, source_id, version, call_site="status", fields=None):
         # Compatibility for legacy utils in this file
         tbl_res = self.get_dmo_table("status")
         if not tbl_res["success"]:
             return tbl_res
         table = tbl_res["table"]
 
-        entry = table.get_item(Key={"source_id": source_id, 'version': version},
-                               ConsistentRead=True).get("Item")
+        entry = self._call("get_item", table.get_item, call_site=call_site,
+                           Key={"source_id": source_id, 'version': version},
+                           **self.projection(fields)).get("Item")
         return entry
 
-    def create_status(self, status):
-        tbl_res = self.get_dmo_table("status")
-        if not tbl_res["success"]:
-            return tbl_res
-        table = tbl_res["table"]
+    def batch_read_status_records(self, keys, call_site="status", fields=None):
+        """Read many status records with BatchGetItem.
 
-        # Add defaults
+        Arguments:
+        keys (list of tuples): The (source_id, version) pairs to read.
+        call_site (str): The caller, used to pick the read consistency.
+        fields (list of str): The attributes to read. Must include source_id and
+                              version. Default None, to read whole records.
+
+        Returns:
+        dict: The records found, keyed by (source_id, version).
+              Keys with no record are left out.
+
+        Raises:
+        RetriesExhausted: If Dynamo keeps leaving keys unprocessed until the
+                          retries or the invocation's time run out.
+        """
+        table_name = self.dmo_tables["status"]
+        consistent = self.consistent_read(call_site)
+        # Duplicate keys are an error in BatchGetItem
+        keys = list(dict.fromkeys(keys))
+
+        records = {}
+        # BatchGetItem reads at most 100 keys per request
+        for i in range(0, len(keys), 100):
+            request = {
+                table_name: {
+                    "Keys": [{"source_id": source_id, "version": version}
+                             for source_id, version in keys[i:i + 100]],
+                    "ConsistentRead": consistent,
+                    **self.projection(fields)
+                }
+            }
+            attempt = 0
+            while request:
+                response = self._call("batch_get_item", self.dmo_client.batch_get_item,
+                                      call_site=call_site, RequestItems=request)
+                for item in response.get("Responses", {}).get(table_name, []):
+                    records[(item["source_id"], item["version"])] = item
+
+                # Keys left over when the table is throttled or the response is too
+                # large come back as UnprocessedKeys, and need to be asked for again
+                request = response.get("UnprocessedKeys")
+                if request:
+                    attempt += 1
+                    delay = self.retry_policy.backoff(attempt)
+                    if self.retry_policy.exhausted(attempt, delay):
+                        self.metrics.record_give_up("batch_get_item")
+                        raise RetriesExhausted("Unprocessed keys left after {} attempts"
+                                               .format(attempt),
+                                               retry_after=self.retry_policy.retry_after(delay))
+                    self.metrics.record_retry("batch_get_item")
+                    time.sleep(delay)
+        return records
+
+    def set_flow_state(self, source_id, version, flow_status):
+        """Cache a finished flow's final state on its status record, so listings
+        don't have to ask Globus about it again.
+
+        Arguments:
+        source_id (str): The submission's source_id.
+        version (str): The submission's version.
+        flow_status (dict): The flow status from Globus.
+        """
+        try:
+            self._call("update_item", self.status_table.update_item,
+                       Key={"source_id": source_id, "version": version},
+                       UpdateExpression="SET flow_state = :state, flow_description = :desc",
+                       ExpressionAttributeValues={
+                           ":state": flow_status["status"],
+                           ":desc": flow_status.get("details", {}).get("description", "")
+                       })
+        except Exception as e:
+            # Only a cache, the next listing will ask Globus again
+            logger.warning("Unable to cache flow state for {}-{}: {}"
+                           .format(source_id, version, repr(e)))
+
+    def claim_launch(self, source_id, version):
+        """Claim the flow launch of a queued submission, so that only one
+        delivery of its job starts a run.
+
+        Claiming and finding the record's state are one conditional write.
+
+        Returns:
+        dict: None if the launch was claimed. Otherwise the record's action_id,
+              flow_state and launching_since, whichever it has, or an empty
+              dict if there is no record.
+        """
+        try:
+            self._call("update_item", self.status_table.update_item,
+                       Key={"source_id": source_id, "version": version},
+                       UpdateExpression="SET launching_since = :now",
+                       ConditionExpression=(Attr("source_id").exists()
+                                            & Attr("action_id").not_exists()
+                                            & Attr("flow_state").not_exists()
+                                            & Attr("launching_since").not_exists()),
+                       ExpressionAttributeValues={":now": int(time.time())},
+                       ReturnValuesOnConditionCheckFailure="ALL_OLD")
+        except ClientError as e:
+            if error_code(e) != "ConditionalCheckFailedException":
+                raise
+            item = e.response.get("Item", {})
+            return {k: self.deserializer.deserialize(item[k])
+                    for k in ("action_id", "flow_state", "launching_since") if k in item}
+        return None
+
+    def release_launch(self, source_id, version):
+        """Give up a claimed flow launch that did not start a run, so the job's
+        next delivery can claim it."""
+        self._call("update_item", self.status_table.update_item,
+                   Key={"source_id": source_id, "version": version},
+                   UpdateExpression="REMOVE launching_since")
+
+    def set_action_id(self, source_id, version, action_id):
+        """Record the flow run started for a queued submission.
+
+        Only the first run is recorded, so a job delivered twice can't replace
+        the run its status record already follows.
+
+        Returns:
+        dict:
+            success (bool): True if the run was recorded.
+            error (str): If success is False, why not.
+        """
+        try:
+            self._call("update_item", self.status_table.update_item,
+                       Key={"source_id": source_id, "version": version},
+                       UpdateExpression="SET action_id = :action_id, active_run = :active "
+                                        "REMOVE queued, launching_since",
+                       ConditionExpression="attribute_not_exists(action_id)",
+                       ExpressionAttributeValues={":action_id": action_id,
+                                                  ":active": self.ACTIVE_RUN})
+        except ClientError as e:
+            if error_code(e) != "ConditionalCheckFailedException":
+                raise
+            return {
+                "success": False,
+                "error": "{}-{} already has a flow run".format(source_id, version)
+            }
+        return {
+            "success": True
+        }
+
+    def query_active_runs(self, fields=None, call_site="reconcile"):
+        """The records whose flow runs are still followed, oldest first.
+
+        Arguments:
+        fields (list of str): The attributes to read. The index projects the
+                              ones the reconciler uses. Default None, for all
+                              projected attributes.
+        call_site (str): The caller, used to pick the read consistency.
+
+        Returns:
+        list of dict: The records.
+        """
+        query_args = {
+            "IndexName": self.ACTIVE_RUN_INDEX,
+            "KeyConditionExpression": Key("active_run").eq(self.ACTIVE_RUN)
+        }
+        query_args.update(self.projection(fields))
+        records = []
+        while True:
+            response = self._call("query", self.status_table.query, call_site=call_site,
+                                  **query_args)
+            records.extend(response["Items"])
+            if not response.get("LastEvaluatedKey"):
+                return records
+            query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def update_progress(self, source_id, version, code, messages, log_position,
+                        flow_status=None, finished=False):
+        """Record a flow's progress through the status steps, in one write.
+
+        Arguments:
+        source_id (str): The submission's source_id.
+        version (str): The submission's version.
+        code (str): The status code, one character per status step.
+        messages (list of str): The message for each status step.
+        log_position (dict): Where reading the flow's log stopped, so the next
+                             update only reads new entries.
+        flow_status (dict): The flow's final status from Globus, to cache as
+                            set_flow_state does. Default None.
+        finished (bool): True if the flow has finished and its whole log has
+                         been read, so the record leaves the active run index.
+                         Default False.
+        """
+        # Aliased, as some of these names are reserved words in Dynamo
+        update = "SET #code = :code, #messages = :messages, #position = :position"
+        names = {
+            "#code": "code",
+            "#messages": "messages",
+            "#position": "log_position"
+        }
+        values = {
+            ":code": code,
+            ":messages": messages,
+            ":position": log_position
+        }
+        if flow_status:
+            update += ", flow_state = :state, flow_description = :desc"
+            values[":state"] = flow_status["status"]
+            values[":desc"] = flow_status.get("details", {}).get("description", "")
+        if finished:
+            update += " REMOVE active_run"
+        try:
+            self._call("update_item", self.status_table.update_item,
+                       Key={"source_id": source_id, "version": version},
+                       UpdateExpression=update,
+                       ExpressionAttributeNames=names,
+                       ExpressionAttributeValues=values)
+        except Exception as e:
+            # The next reconciler run picks up from the last recorded position
+            logger.warning("Unable to record progress for {}-{}: {}"
+                           .format(source_id, version, repr(e)))
+
+    def prepare_new_status(self, status):
+        """Add the defaults of a new status record, and validate it."""
         status["messages"] = ["No message available"] * len(self.STATUS_STEPS)
         status["active"] = True
         status["cancelled"] = False
@@ -353,17 +912,33 @@ class DynamoManager:
         status["updates"] = []
 
         status_valid = self.validate_status(status, new_status=True)
+        if status_valid["success"]:
+            # The sort key of the version order index, derived from the version
+            status["version_order"] = self.version_order(status["version"])
+            if status.get("action_id"):
+                status["active_run"] = self.ACTIVE_RUN
+        return status_valid
+
+    def create_status(self, status):
+        tbl_res = self.get_dmo_table("status")
+        if not tbl_res["success"]:
+            return tbl_res
+        table = tbl_res["table"]
+
+        status_valid = self.prepare_new_status(status)
         if not status_valid["success"]:
             return status_valid
 
         # Check that status does not already exist
-        if self.read_status_record(status["source_id"], status['version']):
+        if self.read_status_record(status["source_id"], status['version'],
+                                   call_site="submit"):
             return {
                 "success": False,
                 "error": "ID {} already exists in status database".format(status["source_id"])
             }
         try:
-            table.put_item(Item=status, ConditionExpression=Attr("source_id").not_exists())
+            self._call("put_item", table.put_item, Item=status,
+                       ConditionExpression=Attr("source_id").not_exists())
         except Exception as e:
             return {
                 "success": False,
@@ -376,11 +951,274 @@ class DynamoManager:
                 "status": status
             }
 
-    def for_source_id(self, source_id):
+    def create_statuses(self, statuses):
+        """Create many new status records, with one TransactWriteItems call per
+        TRANSACTION_MAX_ITEMS records, or fewer if they would be over
+        TRANSACTION_MAX_BYTES.
+
+        A record whose version already exists cancels its transaction. It is
+        left out, and the rest are written again, so one conflict doesn't fail
+        the others.
+
+        Arguments:
+        statuses (list of dict): The new statuses.
+
+        Returns:
+        list of dict: The result for each status, in order, as from create_status.
+
+        Raises:
+        RetriesExhausted: If the writes were still throttled when the retries or
+                          the invocation's time ran out.
+        """
+        client = self.dmo_client.meta.client
+        table_name = self.dmo_tables["status"]
+        results = [None] * len(statuses)
+        items = {}
+        for i, status in enumerate(statuses):
+            status_valid = self.prepare_new_status(status)
+            if status_valid["success"]:
+                items[i] = {k: self.serializer.serialize(v) for k, v in status.items()}
+            else:
+                results[i] = status_valid
+
+        # Records carry the original submission, so a few large ones fill a
+        # transaction long before it has TRANSACTION_MAX_ITEMS of them
+        batches = [[]]
+        batch_bytes = 0
+        for i, item in items.items():
+            item_bytes = len(json.dumps(item))
+            if batches[-1] and (len(batches[-1]) == self.TRANSACTION_MAX_ITEMS
+                                or batch_bytes + item_bytes > self.TRANSACTION_MAX_BYTES):
+                batches.append([])
+                batch_bytes = 0
+            batches[-1].append(i)
+            batch_bytes += item_bytes
+
+        for batch in batches:
+            while batch:
+                try:
+                    self._call("transact_write_items", client.transact_write_items,
+                               TransactItems=[{
+                                   "Put": {
+                                       "TableName": table_name,
+                                       "Item": items[i],
+                                       "ConditionExpression": "attribute_not_exists(source_id)"
+                                   }
+                               } for i in batch])
+                except ClientError as e:
+                    if error_code(e) != "TransactionCanceledException":
+                        raise
+                    # One reason per item, in order
+                    reasons = e.response.get("CancellationReasons") or []
+                    conflicts = [i for i, reason in zip(batch, reasons)
+                                 if reason.get("Code") == "ConditionalCheckFailed"]
+                    if not conflicts:
+                        raise
+                    for i in conflicts:
+                        results[i] = {
+                            "success": False,
+                            "error": "ID {} already exists in status database".format(
+                                statuses[i]["source_id"])
+                        }
+                    batch = [i for i in batch if i not in conflicts]
+                else:
+                    for i in batch:
+                        logger.info("Status for {}: Created".format(statuses[i]["source_id"]))
+                        results[i] = {
+                            "success": True,
+                            "status": statuses[i]
+                        }
+                    batch = []
+        return results
+
+    def for_source_id(self, source_id, call_site="status"):
         table = self.get_dmo_table("status")
-        response = table['table'].query(
-            KeyConditionExpression=Key('source_id').eq(source_id))
+        response = self._call("query", table['table'].query, call_site=call_site,
+                              KeyConditionExpression=Key('source_id').eq(source_id))
         assert "Items" in response
         assert len(response['Items']) == 1
 
         return response['Items'][0]
+
+    def create_subscription(self, subscription):
+        """Store a webhook subscription, replacing any to the same URL and topic.
+
+        Arguments:
+        subscription (dict): The subscription, with topic, url, user_id and secret.
+        """
+        table = self.dmo_client.Table(self.dmo_tables["subscriptions"])
+        self._call("put_item", table.put_item, Item=subscription)
+        return {
+            "success": True,
+            "subscription": subscription
+        }
+
+    def delete_subscription(self, topic, url, user_id):
+        """Remove a subscription, if it belongs to user_id."""
+        table = self.dmo_client.Table(self.dmo_tables["subscriptions"])
+        try:
+            self._call("delete_item", table.delete_item, Key={"topic": topic, "url": url},
+                       ConditionExpression=Attr("user_id").eq(user_id))
+        except ClientError as e:
+            if error_code(e) != "ConditionalCheckFailedException":
+                raise
+            return {
+                "success": False,
+                "error": "Subscription not found"
+            }
+        return {
+            "success": True
+        }
+
+    def get_subscriptions(self, topics, call_site="notify"):
+        """All the subscriptions to any of the topics."""
+        table = self.dmo_client.Table(self.dmo_tables["subscriptions"])
+        subscriptions = []
+        for topic in topics:
+            query_args = {"KeyConditionExpression": Key("topic").eq(topic)}
+            while True:
+                response = self._call("query", table.query, call_site=call_site, **query_args)
+                subscriptions.extend(response["Items"])
+                if not response.get("LastEvaluatedKey"):
+                    break
+                query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        return subscriptions
+
+    def list_subscriptions(self, user_id, call_site="notify"):
+        """The subscriptions a user has made, without their secrets.
+
+        Returns:
+        dict:
+            success (bool): True on success.
+            results (list of dict): The subscriptions.
+        """
+        table = self.dmo_client.Table(self.dmo_tables["subscriptions"])
+        # The index doesn't project secrets
+        query_args = {
+            "IndexName": self.SUBSCRIPTION_USER_INDEX,
+            "KeyConditionExpression": Key("user_id").eq(user_id)
+        }
+        query_args.update(self.projection(["topic", "url", "user_id", "created"]))
+        subscriptions = []
+        while True:
+            response = self._call("query", table.query, call_site=call_site, **query_args)
+            subscriptions.extend(response["Items"])
+            if not response.get("LastEvaluatedKey"):
+                break
+            query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        return {
+            "success": True,
+            "results": subscriptions
+        }
+
+    def claim_idempotency_key(self, key, request_hash, ttl):
+        """Claim an idempotency key for a request, unless a request used it in
+        the last ttl seconds.
+
+        Claiming and finding the earlier request are one conditional write.
+        Dynamo's TTL deletes expired keys late, so they are checked here too.
+
+        Arguments:
+        key (str): The idempotency key.
+        request_hash (str): The hash of the request's body.
+        ttl (int): How many seconds the key is kept for.
+
+        Returns:
+        dict: None if the key was claimed. Otherwise the earlier request's
+              record, with its request_hash, and its response once it finished.
+        """
+        table = self.dmo_client.Table(self.dmo_tables["idempotency"])
+        now = int(time.time())
+        try:
+            self._call("put_item", table.put_item,
+                       Item={
+                           "idempotency_key": key,
+                           "request_hash": request_hash,
+                           "expires": now + ttl
+                       },
+                       ConditionExpression=(Attr("idempotency_key").not_exists()
+                                            | Attr("expires").lt(now)),
+                       ReturnValuesOnConditionCheckFailure="ALL_OLD")
+        except ClientError as e:
+            if error_code(e) != "ConditionalCheckFailedException":
+                raise
+            return {k: self.deserializer.deserialize(v)
+                    for k, v in e.response.get("Item", {}).items()}
+        return None
+
+    def save_idempotent_response(self, key, response):
+        """Store the response to the request that claimed an idempotency key."""
+        table = self.dmo_client.Table(self.dmo_tables["idempotency"])
+        self._call("update_item", table.update_item,
+                   Key={"idempotency_key": key},
+                   UpdateExpression="SET #response = :response",
+                   ExpressionAttributeNames={"#response": "response"},
+                   ExpressionAttributeValues={":response": json.dumps(response)})
+
+    def release_idempotency_key(self, key):
+        """Forget an idempotency key, so the request can be made again."""
+        table = self.dmo_client.Table(self.dmo_tables["idempotency"])
+        self._call("delete_item", table.delete_item, Key={"idempotency_key": key})
+
+    def take_rate_tokens(self, key, now, interval, burst, cost=1):
+        """Take tokens from a user's token bucket, if it has enough.
+
+        A bucket holds burst tokens and gains one every interval seconds. It is
+        stored as the time it will next be full, so taking tokens is one atomic
+        update in the usual case. An idle bucket is reset from now, and a busy
+        one has its time moved on, as long as that doesn't overdraw it.
+
+        Arguments:
+        key (str): The bucket.
+        now (float): The current time, in seconds since the epoch.
+        interval (float): Seconds per token.
+        burst (float): How many tokens the bucket holds.
+        cost (int): How many tokens to take. Default 1.
+
+        Returns:
+        float: 0 if the tokens were taken, otherwise how many seconds until
+               the bucket will have them.
+        """
+        table = self.dmo_client.Table(self.dmo_tables["admission"])
+        increment = interval * cost
+        tolerance = interval * burst
+        # More tokens than a bucket holds can never be taken, even from a
+        # full one
+        if increment > tolerance:
+            return increment - tolerance
+        # Once a bucket is full again its item is not needed
+        expires = int(math.ceil(now + tolerance)) + 1
+        full_at = None
+        # A bucket can change between attempts, so the second and third use
+        # what the failed update found
+        for _ in range(3):
+            if full_at is None or full_at <= now:
+                update = "SET #full_at = :next, #expires = :expires"
+                condition = "attribute_not_exists(#full_at) OR #full_at <= :now"
+                values = {":next": Decimal(str(round(now + increment, 3)))}
+            elif full_at + increment - now > tolerance:
+                return full_at + increment - tolerance - now
+            else:
+                update = "SET #full_at = #full_at + :increment, #expires = :expires"
+                condition = "#full_at > :now AND #full_at <= :limit"
+                values = {":increment": Decimal(str(round(increment, 3))),
+                          ":limit": Decimal(str(round(now + tolerance - increment, 3)))}
+            values.update({":now": Decimal(str(round(now, 3))), ":expires": expires})
+            try:
+                self._call("update_item", table.update_item,
+                           Key={"bucket_key": key},
+                           UpdateExpression=update,
+                           ConditionExpression=condition,
+                           ExpressionAttributeNames={"#full_at": "full_at",
+                                                     "#expires": "expires"},
+                           ExpressionAttributeValues=values,
+                           ReturnValuesOnConditionCheckFailure="ALL_OLD")
+                return 0
+            except ClientError as e:
+                if error_code(e) != "ConditionalCheckFailedException":
+                    raise
+                item = e.response.get("Item", {})
+                full_at = (float(self.deserializer.deserialize(item["full_at"]))
+                           if "full_at" in item else None)
+        # Still contended, so try again shortly
+        return interval
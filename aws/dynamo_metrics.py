@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class DynamoMetrics:
+    """Aggregate consumed capacity and latency of Dynamo calls for one invocation.
+
+    Calls are grouped by the handler that made them and the table operation.
+    emit() writes everything collected as a single line, so the log has one
+    metrics record per invocation. Set DYNAMO_METRICS_MODE to choose the output:
+        log: One JSON line, prefixed with DYNAMO_METRICS (default)
+        report: A human-readable table, for local benchmarks
+        off: Nothing
+    """
+    READ_OPERATIONS = ("get_item", "query", "scan", "batch_get_item")
+    WRITE_OPERATIONS = ("put_item", "update_item", "delete_item", "batch_write_item",
+                        "transact_write_items")
+
+    def __init__(self, handler, mode=None):
+        self.handler = handler
+        self.mode = mode or os.environ.get("DYNAMO_METRICS_MODE", "log")
+        self.operations = defaultdict(lambda: {
+            "calls": 0,
+            "read_capacity": 0.0,
+            "write_capacity": 0.0,
+            "eventual_read_capacity": 0.0,
+            "latency_ms": 0.0,
+            "max_latency_ms": 0.0,
+            "retries": 0,
+            "give_ups": 0
+        })
+        # Calls can be made from worker threads
+        self.lock = threading.Lock()
+
+    def record(self, operation, latency, response=None, consistent=True):
+        """Record one call.
+
+        Arguments:
+        operation (str): The Dynamo operation, e.g. "query".
+        latency (float): Wall-clock time of the call, in seconds.
+        response (dict): The response, used for its ConsumedCapacity. Default None.
+        consistent (bool): Was this a strongly consistent read? Default True.
+        """
+        with self.lock:
+            stats = self.operations[operation]
+            stats["calls"] += 1
+            latency_ms = latency * 1000
+            stats["latency_ms"] += latency_ms
+            stats["max_latency_ms"] = max(stats["max_latency_ms"], latency_ms)
+
+            consumed = (response or {}).get("ConsumedCapacity") or []
+            # Batch operations report capacity once per table
+            if isinstance(consumed, dict):
+                consumed = [consumed]
+            for table_capacity in consumed:
+                read = table_capacity.get("ReadCapacityUnits")
+                write = table_capacity.get("WriteCapacityUnits")
+                total = float(table_capacity.get("CapacityUnits", 0))
+                if read is None and write is None:
+                    if operation in self.WRITE_OPERATIONS:
+                        write = total
+                    else:
+                        read = total
+                stats["read_capacity"] += float(read or 0)
+                stats["write_capacity"] += float(write or 0)
+                if not consistent and operation in self.READ_OPERATIONS:
+                    stats["eventual_read_capacity"] += float(read or 0)
+
+    def record_retry(self, operation):
+        with self.lock:
+            self.operations[operation]["retries"] += 1
+
+    def record_give_up(self, operation):
+        with self.lock:
+            self.operations[operation]["give_ups"] += 1
+
+    @property
+    def eventual_read_capacity(self):
+        return sum(stats["eventual_read_capacity"] for stats in self.operations.values())
+
+    def report(self):
+        """Summarize the calls recorded so far.
+
+        Returns:
+        dict:
+            handler (str): The handler that made the calls.
+            operations (dict): Per-operation calls, capacity, and latency.
+            read_capacity (float): Total RCUs consumed.
+            write_capacity (float): Total WCUs consumed.
+            read_capacity_saved (float): RCUs saved by eventually consistent reads.
+            latency_ms (float): Total time spent in Dynamo calls.
+            retries (int): Calls retried after a throttle or transient error.
+            give_ups (int): Calls that ran out of retries.
+        """
+        operations = {op: {k: round(v, 3) for k, v in stats.items()}
+                      for op, stats in self.operations.items()}
+        return {
+            "handler": self.handler,
+            "operations": operations,
+            "read_capacity": sum(s["read_capacity"] for s in self.operations.values()),
+            "write_capacity": sum(s["write_capacity"] for s in self.operations.values()),
+            "read_capacity_saved": self.eventual_read_capacity,
+            "latency_ms": round(sum(s["latency_ms"] for s in self.operations.values()), 3),
+            "retries": sum(s["retries"] for s in self.operations.values()),
+            "give_ups": sum(s["give_ups"] for s in self.operations.values())
+        }
+
+    def format_report(self):
+        report = self.report()
+        lines = ["Dynamo usage for {}".format(report["handler"]),
+                 "{:<16}{:>7}{:>10}{:>10}{:>12}{:>12}{:>9}{:>10}".format(
+                     "operation", "calls", "RCU", "WCU", "total ms", "max ms",
+                     "retries", "give ups")]
+        for op, stats in sorted(report["operations"].items()):
+            lines.append("{:<16}{:>7}{:>10.2f}{:>10.2f}{:>12.2f}{:>12.2f}{:>9}{:>10}".format(
+                op, stats["calls"], stats["read_capacity"], stats["write_capacity"],
+                stats["latency_ms"], stats["max_latency_ms"], stats["retries"],
+                stats["give_ups"]))
+        lines.append("RCU saved by eventually consistent reads: {:.2f}"
+                     .format(report["read_capacity_saved"]))
+        return "\n".join(lines)
+
+    def emit(self):
+        """Write the metrics for this invocation according to the mode."""
+        if self.mode == "off" or not self.operations:
+            return
+        if self.mode == "report":
+            print(self.format_report())
+        else:
+            print("DYNAMO_METRICS", json.dumps(self.report()))
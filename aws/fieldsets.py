@@ -0,0 +1,178 @@
+import json
+
+from automate_manager import unknown_flow_status
+from dynamo_manager import DynamoManager
+
+status_codes = {
+    "SUCCEEDED": "S",
+    "ACTIVE": "P",
+    "QUEUED": "P",
+    "FAILED": "F",
+    "UNKNOWN": "U"
+}
+
+# What each character of a record's progress code means
+step_codes = {
+    "z": "not started",
+    "P": "in progress",
+    "S": "succeeded",
+    "F": "failed",
+    "N": "not requested",
+    "X": "cancelled"
+}
+
+# Flow states that will never change, so are cached on the status record
+TERMINAL_STATES = ("SUCCEEDED", "FAILED")
+
+# The fields a status response can hold, and the status record attributes each
+# is built from. Asking for fewer fields reads less from Dynamo.
+RESPONSE_FIELDS = {
+    "source_id": ("source_id",),
+    "version": ("version",),
+    "status_message": ("test", "source_id", "title", "submitter", "submission_time"),
+    "status_list": ("code", "messages"),
+    "code": ("code",),
+    "messages": ("messages",),
+    "status_code": ("action_id", "flow_state", "flow_description", "queued"),
+    "title": ("title",),
+    "submitter": ("submitter",),
+    "submission_time": ("submission_time",),
+    "description": ("action_id", "flow_state", "flow_description", "queued"),
+    "test": ("test",),
+    "active": ("action_id", "flow_state", "flow_description", "queued"),
+    "original_submission": ("original_submission",),
+    "flow_status": ("action_id", "flow_state", "flow_description")
+}
+# Fields that need the flow's state. A finished flow's state is cached on the
+# record, so these only go to Globus while the flow is running.
+FLOW_STATE_FIELDS = ("status_code", "description", "active", "flow_status")
+
+# Fields returned when none are asked for
+SUBMISSION_FIELDS = ("source_id", "status_message", "status_list", "status_code", "title",
+                     "submitter", "submission_time", "description", "test", "active",
+                     "original_submission")
+STATUS_FIELDS = ("original_submission", "flow_status")
+
+
+def parse_fields(requested, default):
+    """Read the fields asked for in a request.
+
+    Arguments:
+    requested (str or list): Comma-separated field names, or a list of them.
+                             None or empty to use the default.
+    default (tuple): The fields to use when none are requested.
+
+    Returns:
+    tuple: The fields.
+
+    Raises:
+    ValueError: If an unknown field is requested.
+    """
+    if not requested:
+        return default
+    if isinstance(requested, str):
+        requested = requested.split(",")
+    fields = tuple(dict.fromkeys(f.strip() for f in requested if f.strip()))
+    unknown = [f for f in fields if f not in RESPONSE_FIELDS]
+    if unknown:
+        raise ValueError("Unknown fields: {}. Valid fields are: {}".format(
+            ", ".join(unknown), ", ".join(RESPONSE_FIELDS)))
+    return fields or default
+
+
+def record_attributes(fields):
+    """The status record attributes to read for the fields.
+
+    The key attributes are always included, so records can be matched up and
+    updated.
+    """
+    attributes = ["source_id", "version"]
+    for field in fields:
+        attributes.extend(RESPONSE_FIELDS[field])
+    return list(dict.fromkeys(attributes))
+
+
+def cached_flow_status(status):
+    """The flow status cached on a record, if its flow has finished."""
+    if status.get('flow_state') not in TERMINAL_STATES:
+        return None
+    return {
+        "status": status['flow_state'],
+        "details": {
+            "description": status.get('flow_description', "")
+        }
+    }
+
+
+def needs_flow_status(status, fields):
+    """Does building the fields for this record need a call to Globus?"""
+    if not status.get('action_id') or cached_flow_status(status):
+        return False
+    return any(f in FLOW_STATE_FIELDS for f in fields)
+
+
+def record_tag_parts(status):
+    """The parts of a record that identify what a response built from it holds.
+
+    original_submission never changes for a version, and is the bulk of the
+    record, so it is left out to keep tags cheap to compute.
+    """
+    return {key: value for key, value in status.items() if key != "original_submission"}
+
+
+def format_status_list(status):
+    """Describe each status step from the record's progress code."""
+    if not status.get("code"):
+        return "need more status data"
+    return [
+        {
+            "step": step,
+            "description": description,
+            "state": step_codes.get(code, "unknown"),
+            "message": message
+        }
+        for (step, description), code, message
+        in zip(DynamoManager.STATUS_STEPS, status["code"], status["messages"])
+    ]
+
+
+def format_status_record(status:dict, automate_status:dict=None, fields=SUBMISSION_FIELDS) -> dict:
+    if 'action_id' not in status:
+        # Queued submissions wait for the submit worker to start their flow, and
+        # have a final state if it couldn't
+        automate_status = cached_flow_status(status)
+        if not automate_status and status.get("queued"):
+            automate_status = {
+                "status": "QUEUED",
+                "details": {
+                    "description": "Waiting for the flow to start"
+                }
+            }
+        elif not automate_status:
+            automate_status = unknown_flow_status("Submission prior to GlobusAutomate")
+    elif not automate_status:
+        automate_status = cached_flow_status(status) or unknown_flow_status("Unknown")
+
+    # Built only when asked for, so e.g. original_submission isn't parsed for
+    # clients that only want the status code
+    builders = {
+        "source_id": lambda: status["source_id"],
+        "version": lambda: status["version"],
+        "status_message": lambda: ("Status of {}submission {} ({})\n"
+                                   "Submitted by {} at {}\n\n").format(
+            "TEST " if status["test"] else "", status["source_id"], status["title"],
+            status["submitter"], status["submission_time"]),
+        "status_list": lambda: format_status_list(status),
+        "code": lambda: status.get("code"),
+        "messages": lambda: status.get("messages"),
+        "status_code": lambda: status_codes.get(automate_status['status'], "U"),
+        "title": lambda: status["title"],
+        "submitter": lambda: status["submitter"],
+        "submission_time": lambda: status["submission_time"],
+        "description": lambda: automate_status['details']['description'],
+        "test": lambda: status["test"],
+        "active": lambda: automate_status['status'] in ("ACTIVE", "QUEUED"),
+        "original_submission": lambda: json.loads(status["original_submission"]),
+        "flow_status": lambda: automate_status
+    }
+    return {field: builders[field]() for field in fields}
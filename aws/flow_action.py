@@ -9,14 +9,25 @@ class FlowAction:
     def get_status(self):
         return self.flow.get_status(self.action_id)
 
-    def get_error_msgs(self):
-        logs = self.flow.get_flow_logs(self.action_id)
-        error_msgs = []
-        for failure in filter(lambda x: x['code'] == 'ActionFailed', logs['entries']):
+    def iter_error_msgs(self):
+        """Yield error messages from the run's failures as its log is read, so
+        callers can stop reading once they have what they need."""
+        for entry in self.flow.iter_flow_logs(self.action_id):
+            if entry.get('code') != 'ActionFailed':
+                continue
             # Failures from Search Ingest Action Provider are bundled up as string
             # representation of Python dict
-            cause = ast.literal_eval(failure['details']['cause'])
-            if 'errors' in cause:
-                error_msgs.append(cause['errors'])
+            try:
+                cause = ast.literal_eval(entry['details']['cause'])
+            except (KeyError, TypeError, ValueError, SyntaxError):
+                continue
+            if isinstance(cause, dict) and 'errors' in cause:
+                yield cause['errors']
 
+    def get_error_msgs(self, max_errors: int = None):
+        error_msgs = []
+        for error in self.iter_error_msgs():
+            error_msgs.append(error)
+            if max_errors and len(error_msgs) >= max_errors:
+                break
         return error_msgs
@@ -0,0 +1,117 @@
+from dynamo_manager import DynamoManager
+
+# Status code for each step in DynamoManager.STATUS_STEPS
+NOT_STARTED = "z"
+IN_PROGRESS = "P"
+SUCCEEDED = "S"
+FAILED = "F"
+NOT_REQUESTED = "N"
+CANCELLED = "X"
+
+STEP_POSITIONS = {step: i for i, (step, _) in enumerate(DynamoManager.STATUS_STEPS)}
+
+# The status step each state of the MDF flow (automate/minimus_mdf_flow.py) is
+# part of. The flow has no separate download, extraction, or secondary
+# destination states, so those steps end up not requested.
+STATE_STEPS = {
+    "StartSubmission": "sub_start",
+    "EmailSubmission": "sub_start",
+    "Check Metadata Only": "sub_start",
+    "CreateDatasetDir": "data_transfer",
+    "CreateDestinationDir": "data_transfer",
+    "UserPermissions": "data_transfer",
+    "UserTransfer": "data_transfer",
+    "UndoUserPermissions": "data_transfer",
+    "CheckUserTransfer": "data_transfer",
+    "ChooseCuration": "curation",
+    "SendCurationEmail": "curation",
+    "CurateSubmission": "curation",
+    "ChooseAcceptance": "curation",
+    "FailCuration": "curation",
+    "NeedDOI": "ingest_publish",
+    "MintDOI": "ingest_publish",
+    "AddDoiToSearchRecord": "ingest_publish",
+    "SearchIngest": "ingest_search",
+    "SubmissionSuccess": "ingest_cleanup",
+    "NotifyUserEnd": "ingest_cleanup",
+    "EndSubmission": "ingest_cleanup",
+}
+# Reached from any step that fails, to email the user
+EXCEPTION_STATE = "ExceptionState"
+
+
+def new_progress():
+    steps = len(DynamoManager.STATUS_STEPS)
+    return NOT_STARTED * steps, ["No message available"] * steps
+
+
+def failure_message(entry):
+    details = entry.get("details") or {}
+    cause = details.get("cause") or details.get("error")
+    return str(cause) if cause else entry.get("description", "Failed")
+
+
+def apply_log_entries(code, messages, entries):
+    """Advance a status code and its messages with new flow log entries.
+
+    Steps start when one of their states does. Starting a step finishes the
+    one in progress, and marks the earlier steps never reached as not
+    requested. The flow publishes before it ingests to Search, so steps do
+    not always run in STATUS_STEPS order.
+
+    Arguments:
+    code (str): The current code, one character per status step.
+    messages (list of str): The current message for each step.
+    entries (iterable of dict): Log entries not applied before, oldest first.
+
+    Returns:
+    tuple: The new code and messages.
+    """
+    code = list(code)
+    messages = list(messages)
+
+    def current_step():
+        return next((i for i, c in enumerate(code) if c == IN_PROGRESS), None)
+
+    def fail(position, message):
+        if position is not None and code[position] != FAILED:
+            code[position] = FAILED
+            messages[position] = message
+
+    for entry in entries:
+        log_code = entry.get("code", "")
+        state = (entry.get("details") or {}).get("state_name")
+
+        if state == EXCEPTION_STATE:
+            # Some failures go straight to the exception handler, without a
+            # failed action in the log
+            position = current_step()
+            if position is not None:
+                fail(position, "Failed: " + messages[position])
+        elif state in STATE_STEPS:
+            position = STEP_POSITIONS[STATE_STEPS[state]]
+            # Once a step has failed, the flow only winds down. A step skipped
+            # over may still run, as Search ingestion does after publication.
+            if (log_code.endswith("Started") and FAILED not in code
+                    and code[position] in (NOT_STARTED, IN_PROGRESS, NOT_REQUESTED)):
+                for other in range(len(code)):
+                    if code[other] == IN_PROGRESS:
+                        code[other] = SUCCEEDED
+                    elif code[other] == NOT_STARTED and other < position:
+                        code[other] = NOT_REQUESTED
+                code[position] = IN_PROGRESS
+                messages[position] = entry.get("description", messages[position])
+            elif log_code.endswith("Failed"):
+                fail(position, failure_message(entry))
+            elif code[position] == IN_PROGRESS:
+                messages[position] = entry.get("description", messages[position])
+
+        if log_code == "FlowSucceeded":
+            code = [SUCCEEDED if c == IN_PROGRESS else NOT_REQUESTED if c == NOT_STARTED
+                    else c for c in code]
+        elif log_code == "FlowFailed":
+            fail(current_step(), failure_message(entry))
+        elif log_code == "FlowCanceled":
+            code = [CANCELLED if c == IN_PROGRESS else c for c in code]
+
+    return "".join(code), messages
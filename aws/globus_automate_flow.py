@@ -1,11 +1,47 @@
 import json
+import logging
+import os
+import threading
+from collections import OrderedDict
 from typing import Mapping, Any, Optional, List
 
-from globus_sdk import FlowsClient, GlobusAPIError
+from globus_sdk import (FlowsClient, GlobusAPIError, GlobusConnectionError,
+                        GlobusConnectionTimeoutError, NetworkError)
 import mdf_toolbox
 
 from flow_action import FlowAction
 from globus_auth_manager import GlobusAuthManager
+from retry import CircuitBreaker, RetriesExhausted, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+# Shared by every flow in the process, so a warm Lambda remembers that Flows
+# is failing instead of waiting on it for each request
+flows_breaker = CircuitBreaker("Globus Flows",
+                               failure_threshold=int(os.environ.get("FLOWS_BREAKER_FAILURES", 5)),
+                               reset_timeout=float(os.environ.get("FLOWS_BREAKER_RESET", 30)))
+
+
+def is_transient_flows_error(e):
+    """Is e a throttle, server error, or network error from Flows?"""
+    if isinstance(e, GlobusAPIError):
+        return e.http_status == 429 or e.http_status >= 500
+    return isinstance(e, NetworkError)
+
+
+def is_unstarted_run_error(e):
+    """Is e an error starting a run that means the run was not started?
+
+    Other server errors, and timeouts waiting for a response, can come after
+    the run started, so starting it again could make a second run.
+    """
+    if isinstance(e, GlobusAPIError):
+        return e.http_status in (429, 502, 503)
+    return isinstance(e, (GlobusConnectionError, GlobusConnectionTimeoutError))
+
+
+def is_flows_failure(e):
+    return isinstance(e, RetriesExhausted) or is_transient_flows_error(e)
 
 
 class GlobusAutomateFlowDef:
@@ -33,13 +69,23 @@ class GlobusAutomateFlowDef:
 
 
 class GlobusAutomateFlow:
+    # Log entries that end a run, after which its log never grows
+    FINAL_LOG_CODES = ("FlowSucceeded", "FlowFailed", "FlowCanceled")
+
     def __init__(self, client: FlowsClient, globus_auth: GlobusAuthManager = None):
         self.flows_client = client
+        self.status_client = None
         self.flow_id = None
         self.flow_scope = None
         self.saved_flow = None
         self.runAsScopes = None
         self.globus_auth = globus_auth
+        # Logs read so far, by action_id, least recently used first
+        self.log_cache = OrderedDict()
+        self.log_cache_size = int(os.environ.get("FLOW_LOG_CACHE_RUNS", 64))
+        # Threads sharing the flow take turns updating the cache. Each run's
+        # log has a lock of its own, for its entries and page position.
+        self.log_cache_lock = threading.Lock()
 
     @classmethod
     def from_flow_def(
@@ -78,8 +124,11 @@ class GlobusAutomateFlow:
             result.flow_scope = flow_scope
         return result
 
-    def set_client(self, client):
+    def set_client(self, client, status_client=None):
+        """Set the FlowsClient to call Flows with, and optionally another, with
+        a shorter timeout, for run status lookups."""
         self.flows_client = client
+        self.status_client = status_client
 
     @property
     def url(self):
@@ -93,15 +142,192 @@ class GlobusAutomateFlow:
             self.flow_scope
         ]
 
-    def get_status(self, action_id: str):
-        return self.flows_client.flow_action_status(
-            self.flow_id, self.flow_scope, action_id
+    def _call(self, method, *args, deadline=None, retryable=is_transient_flows_error,
+              **kwargs):
+        """Call Flows, retrying transient failures with jittered backoff, unless
+        the circuit breaker says Flows is down.
+
+        Arguments:
+        method (callable): The FlowsClient method.
+        deadline (float): time.monotonic() value after which no retry is started.
+                          Default None.
+        retryable (callable): Decides if an exception is worth retrying.
+                              Default is_transient_flows_error.
+
+        Raises:
+        RetriesExhausted: If the call was still failing when its attempts or
+                          the deadline ran out.
+        CircuitOpen: If Flows has been failing, and the call was not made.
+        """
+        policy = RetryPolicy(max_attempts=int(os.environ.get("FLOWS_MAX_ATTEMPTS", 3)),
+                             base_delay=float(os.environ.get("FLOWS_RETRY_BASE_DELAY", 0.25)),
+                             max_delay=float(os.environ.get("FLOWS_RETRY_MAX_DELAY", 4)),
+                             deadline=deadline, retryable=retryable)
+
+        def log_retry(e, attempt, delay):
+            logger.warning("Flows {} retry {} in {:.2f}s: {}".format(
+                getattr(method, "__name__", method), attempt, delay, e))
+
+        return flows_breaker.call(policy.call, method, *args, on_retry=log_retry,
+                                  failed=is_flows_failure, **kwargs)
+
+    def get_status(self, action_id: str, deadline: float = None):
+        client = self.status_client or self.flows_client
+        return self._call(client.flow_action_status,
+                          self.flow_id, self.flow_scope, action_id,
+                          deadline=deadline).data
+
+    def list_runs(
+        self,
+        label: str = None,
+        tags: List[str] = None,
+        statuses: List[str] = None,
+        per_page: int = 50,
+        max_pages: int = None,
+    ):
+        """
+        Page through this flow's runs with the Flows run-listing API, so many runs'
+        states come back in a few requests instead of one status call per run.
+        Runs can be narrowed down by label, tags, and status. Each run is returned
+        in the same form as get_status, keyed by its action_id.
+        """
+        filters = {}
+        if label:
+            filters["filter_label"] = label
+        if tags:
+            filters["filter_tags"] = ",".join(tags)
+
+        runs = {}
+        marker = None
+        pages = 0
+        while max_pages is None or pages < max_pages:
+            page = self._call(
+                self.flows_client.list_flow_runs,
+                flow_id=self.flow_id,
+                flow_scope=self.flow_scope,
+                statuses=statuses,
+                marker=marker,
+                per_page=per_page,
+                # list_flow_runs pops reserved keys out of filters
+                filters=dict(filters),
+            ).data
+            pages += 1
+            for run in page.get("runs", page.get("actions", [])):
+                action_id = run.get("action_id", run.get("run_id"))
+                run.setdefault("details", {})
+                if isinstance(run["details"], dict):
+                    run["details"].setdefault("description", run.get("display_status",
+                                                                      run["status"]))
+                runs[action_id] = run
+            marker = page.get("marker")
+            if not page.get("has_next_page") or not marker:
+                break
+        return runs
+
+    def iter_flow_logs(self, action_id: str, per_page: int = 100):
+        """
+        Iterate over a run's log entries, oldest first, following the log's pages.
+        Entries already read are cached for the run, along with the marker of the
+        page the log ended on, so later calls only fetch entries added since. Once
+        a run has finished its log is served from the cache alone. Threads reading
+        the same run take turns fetching its pages, a page at a time.
+        """
+        with self.log_cache_lock:
+            cached = self.log_cache.pop(action_id, None) or {
+                "entries": [],
+                # The marker the last page was fetched with, and how many of its
+                # entries were read
+                "page_marker": None,
+                "page_seen": 0,
+                "complete": False,
+                "lock": threading.Lock(),
+            }
+            # Most recently used goes last, and the least recently used is dropped
+            self.log_cache[action_id] = cached
+            while len(self.log_cache) > self.log_cache_size:
+                self.log_cache.popitem(last=False)
+
+        read = 0
+        more = True
+        while True:
+            with cached["lock"]:
+                # Another reader may have fetched past this one already
+                while read >= len(cached["entries"]) and more and not cached["complete"]:
+                    more = self._read_cached_log_page(action_id, cached, per_page)
+                entries = cached["entries"][read:]
+            if not entries:
+                return
+            read += len(entries)
+            yield from entries
+
+    def iter_new_flow_logs(self, action_id: str, position: dict, per_page: int = 100):
+        """
+        Iterate over the entries added to a run's log since a previous reader
+        stopped, without the cache. position holds the page_marker and page_seen
+        that reader left off at, or is empty to start from the beginning. It is
+        updated as entries are read, so it can be stored for the next reader.
+        """
+        position.setdefault("page_marker", None)
+        # Positions stored in Dynamo come back with Decimal counts
+        position["page_seen"] = int(position.get("page_seen") or 0)
+        position.setdefault("complete", False)
+        if position["complete"]:
+            return
+        yield from self._read_log_pages(action_id, position, per_page)
+
+    def _fetch_log_page(self, action_id: str, marker: str, per_page: int):
+        return self._call(
+            self.flows_client.flow_action_log,
+            self.flow_id, self.flow_scope, action_id,
+            limit=per_page, marker=marker, per_page=None if marker else per_page
         ).data
 
+    def _read_log_pages(self, action_id: str, position: dict, per_page: int):
+        marker = position["page_marker"]
+        while True:
+            page = self._fetch_log_page(action_id, marker, per_page)
+            page_entries = page.get("entries", [])
+            # Counted one at a time, so a reader that stops early resumes
+            # from the entry after the last one it saw
+            for entry in page_entries[position["page_seen"]:]:
+                position["page_seen"] += 1
+                if entry.get("code") in self.FINAL_LOG_CODES:
+                    position["complete"] = True
+                yield entry
+
+            next_marker = page.get("marker")
+            if not page.get("has_next_page") or not next_marker:
+                break
+            marker = next_marker
+            position["page_marker"] = marker
+            position["page_seen"] = 0
+
+    def _read_cached_log_page(self, action_id: str, cached: dict, per_page: int):
+        """Add the unread entries of the page a cached log is on to the cache,
+        and move on to the next page. Called with the run's lock held.
+
+        Returns:
+        bool: True if the log has more pages.
+        """
+        page = self._fetch_log_page(action_id, cached["page_marker"], per_page)
+        page_entries = page.get("entries", [])[cached["page_seen"]:]
+        cached["entries"].extend(page_entries)
+        cached["page_seen"] += len(page_entries)
+        if any(entry.get("code") in self.FINAL_LOG_CODES for entry in page_entries):
+            cached["complete"] = True
+
+        next_marker = page.get("marker")
+        if not page.get("has_next_page") or not next_marker:
+            return False
+        cached["page_marker"] = next_marker
+        cached["page_seen"] = 0
+        return True
+
     def get_flow_logs(self, action_id: str):
-        return self.flows_client.flow_action_log(
-            self.flow_id, self.flow_scope, action_id, limit=100
-        ).data
+        return {
+            "action_id": action_id,
+            "entries": list(self.iter_flow_logs(action_id))
+        }
 
     def update_flow(self, flow_def: GlobusAutomateFlowDef):
         flow_deploy_res = self.flows_client.update_flow(
@@ -140,18 +366,27 @@ class GlobusAutomateFlow:
         self.runAsScopes = self.saved_flow["globus_auth_scopes_by_RunAs"]
         print(self.runAsScopes)
 
-    def run_flow(self, flow_input: dict, monitor_by: list = None, label=None):
-
+    def run_flow(self, flow_input: dict, monitor_by: list = None, label=None,
+                 tags: list = None, deadline: float = None):
+        """
+        Start a run of the flow. Only failures that mean the run was not
+        started are retried, so a run is never started twice.
+        """
         try:
-            flow_res = self.flows_client.run_flow(
+            flow_res = self._call(
+                self.flows_client.run_flow,
                 self.flow_id,
                 self.flow_scope,
                 flow_input,
                 monitor_by=monitor_by,
                 label=label,
+                tags=tags,
+                deadline=deadline,
+                retryable=is_unstarted_run_error,
             )
         except GlobusAPIError as e:
-            print(e.raw_json)
+            logger.error("Unable to start flow {}: HTTP {} {}".format(
+                self.flow_id, e.http_status, e.message))
             raise
 
         return FlowAction(self, flow_res.data["action_id"])
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import os
+
+from api_responses import busy_response, request_header
+from retry import RetriesExhausted
+from stage_timer import stage
+
+logger = logging.getLogger(__name__)
+
+# Keys longer than this are rejected, so they can't bloat the table
+MAX_KEY_LENGTH = 255
+
+
+def idempotent(event, dynamo_manager, handle):
+    """Handle a request at most once per Idempotency-Key header.
+
+    A retry with the same key and body gets the first request's response,
+    without handle() being called again. The same key with a different body
+    is rejected. Keys belong to a user and a route, and are kept for
+    IDEMPOTENCY_TTL seconds. Requests without the header are just handled.
+
+    Arguments:
+    event (dict): The API Gateway event.
+    dynamo_manager (DynamoManager): The handler's manager.
+    handle (callable): Handles the request, returning its response.
+
+    Returns:
+    dict: The response.
+    """
+    key = request_header(event, "idempotency-key")
+    if not key:
+        return handle()
+    if len(key) > MAX_KEY_LENGTH:
+        return {
+            'statusCode': 400,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": "Idempotency-Key may be at most {} characters".format(
+                        MAX_KEY_LENGTH)
+                })
+        }
+
+    scoped_key = "{}:{}:{}".format(event['requestContext']['authorizer']['user_id'],
+                                   event.get("resource") or event.get("path") or "",
+                                   key)
+    request_hash = hashlib.sha256((event.get("body") or "").encode("utf-8")).hexdigest()
+    try:
+        with stage("idempotency"):
+            previous = dynamo_manager.claim_idempotency_key(
+                scoped_key, request_hash, int(os.environ.get("IDEMPOTENCY_TTL", 24 * 3600)))
+    except RetriesExhausted as e:
+        logger.error("Idempotency key claim throttled: {}".format(e))
+        return busy_response(e)
+
+    if previous:
+        if previous.get("request_hash") != request_hash:
+            return {
+                'statusCode': 422,
+                'body': json.dumps(
+                    {
+                        "success": False,
+                        "error": "Idempotency-Key was already used for a different request"
+                    })
+            }
+        if "response" not in previous:
+            return {
+                'statusCode': 409,
+                'headers': {'Retry-After': "1"},
+                'body': json.dumps(
+                    {
+                        "success": False,
+                        "error": "A request with this Idempotency-Key is in progress"
+                    })
+            }
+        response = json.loads(previous["response"])
+        response.setdefault("headers", {})["idempotent-replayed"] = "true"
+        return response
+
+    try:
+        response = handle()
+    except Exception:
+        dynamo_manager.release_idempotency_key(scoped_key)
+        raise
+
+    try:
+        with stage("idempotency"):
+            if response['statusCode'] >= 500 or response['statusCode'] == 429:
+                # The client is meant to retry these, so they aren't replayed
+                dynamo_manager.release_idempotency_key(scoped_key)
+            else:
+                dynamo_manager.save_idempotent_response(scoped_key, response)
+    except Exception as e:
+        # The request was handled, so the client still gets its response.
+        # Retries will be told it's in progress until the key expires.
+        logger.warning("Unable to save the response for idempotency key {}: {}".format(
+            scoped_key, repr(e)))
+    return response
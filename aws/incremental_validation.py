@@ -0,0 +1,100 @@
+"""Validate a document that was made by changing one already known to be valid.
+
+Only the parts of the document that changed are validated against their part
+of the schema. A schema keyword that relates one part of the document to
+another (uniqueItems, anyOf, dependencies, ...) can't be checked a piece at a
+time, so wherever one appears the whole subtree under it is validated.
+"""
+
+# Keywords that check an object or array the same way whatever its members
+# are. They are checked on the changed object or array itself.
+SHALLOW_KEYWORDS = {"type", "required", "additionalProperties", "minProperties",
+                    "maxProperties", "minItems", "maxItems"}
+# Keywords whose subschemas apply to one member at a time
+MEMBER_KEYWORDS = {"properties", "items"}
+ANNOTATION_KEYWORDS = {"$schema", "$id", "id", "$comment", "title", "description",
+                       "default", "examples", "definitions", "$defs"}
+SPLITTABLE_KEYWORDS = SHALLOW_KEYWORDS | MEMBER_KEYWORDS | ANNOTATION_KEYWORDS
+
+_MISSING = object()
+
+
+def iter_changed_errors(validator, instance, previous, schema=None):
+    """Yield the validation errors in the parts of instance that differ from previous.
+
+    Arguments:
+    validator (jsonschema validator): The validator for the whole document.
+                                      Its resolver resolves $refs.
+    instance: The document, or a part of it.
+    previous: The same part of a document that passed validator's schema.
+    schema (dict): The schema for this part. Default None, for the validator's
+                   schema.
+
+    Yields:
+    jsonschema.ValidationError: Errors found. Their paths are relative to the
+                                changed part they were found in.
+    """
+    if schema is None:
+        schema = validator.schema
+    if instance == previous:
+        return
+    if isinstance(schema, bool):
+        yield from validator.iter_errors(instance, schema)
+        return
+    if "$ref" in schema:
+        # Before draft 2019-09, $ref replaces the rest of the schema
+        with validator.resolver.resolving(schema["$ref"]) as resolved:
+            yield from iter_changed_errors(validator, instance, previous, resolved)
+        return
+
+    if isinstance(instance, dict) and isinstance(previous, dict):
+        members = [(key, value, previous.get(key, _MISSING))
+                   for key, value in instance.items()]
+        properties = schema.get("properties", {})
+        additional = schema.get("additionalProperties", {})
+
+        def member_schema(key):
+            if key in properties:
+                return properties[key]
+            # Members additionalProperties: false rules out are caught by the
+            # shallow check
+            return additional if isinstance(additional, dict) else {}
+    elif isinstance(instance, list) and isinstance(previous, list):
+        members = [(i, value, previous[i] if i < len(previous) else _MISSING)
+                   for i, value in enumerate(instance)]
+        items = schema.get("items", {})
+
+        def member_schema(i):
+            return items
+    else:
+        members = None
+
+    if (members is None or not SPLITTABLE_KEYWORDS.issuperset(schema)
+            or not isinstance(schema.get("items", {}), dict)):
+        # A scalar, a change of type, or keywords that relate members to
+        # one another
+        yield from validator.iter_errors(instance, schema)
+        return
+
+    scope = schema.get("$id", schema.get("id"))
+    if scope:
+        validator.resolver.push_scope(scope)
+    try:
+        shallow = {keyword: value for keyword, value in schema.items()
+                   if keyword in SHALLOW_KEYWORDS}
+        if isinstance(shallow.get("additionalProperties"), dict):
+            shallow.pop("additionalProperties")
+        elif shallow.get("additionalProperties") is False:
+            # Only the names of the properties are needed to check for others
+            shallow["properties"] = {key: {} for key in schema.get("properties", {})}
+        yield from validator.iter_errors(instance, shallow)
+
+        for key, value, previous_value in members:
+            if previous_value is _MISSING:
+                yield from validator.iter_errors(value, member_schema(key))
+            else:
+                yield from iter_changed_errors(validator, value, previous_value,
+                                               member_schema(key))
+    finally:
+        if scope:
+            validator.resolver.pop_scope()
@@ -0,0 +1,50 @@
+import os
+import uuid
+from collections import deque
+
+import boto3
+
+# SQS rejects larger messages
+MAX_MESSAGE_BYTES = 256 * 1024
+
+
+class SQSJobQueue:
+    """Submission jobs waiting for the submit_worker function, in SQS."""
+    def __init__(self, queue_url, client=None):
+        self.queue_url = queue_url
+        self.client = client or boto3.client(
+            "sqs", region_name=os.environ.get("MDF_AWS_REGION", "us-east-1"))
+
+    def send(self, body):
+        """Queue a job, already serialized to a string, and return its message ID."""
+        return self.client.send_message(QueueUrl=self.queue_url,
+                                        MessageBody=body)["MessageId"]
+
+
+class LocalJobQueue:
+    """In-process stand-in for SQS, for tests and running without AWS."""
+    def __init__(self):
+        self.messages = deque()
+
+    def send(self, body):
+        message_id = str(uuid.uuid4())
+        self.messages.append({"messageId": message_id, "body": body})
+        return message_id
+
+    def receive(self, max_messages=10):
+        """Take up to max_messages jobs, as the event SQS would invoke the worker with."""
+        records = []
+        while self.messages and len(records) < max_messages:
+            records.append(self.messages.popleft())
+        return {
+            "Records": records
+        }
+
+
+local_queue = LocalJobQueue()
+
+
+def job_queue_from_env():
+    """The SQS queue named by SUBMIT_QUEUE_URL, or the local queue without one."""
+    queue_url = os.environ.get("SUBMIT_QUEUE_URL")
+    return SQSJobQueue(queue_url) if queue_url else local_queue
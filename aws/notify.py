@@ -0,0 +1,276 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from boto3.dynamodb.types import TypeDeserializer
+
+from automate_manager import AutomateManager
+from dynamo_manager import DynamoManager
+from fieldsets import TERMINAL_STATES
+from flow_progress import apply_log_entries, new_progress
+from retry import RetriesExhausted, deadline_from_context
+from utils import get_secret
+from webhooks import deliver, new_secret, validate_url
+
+logger = logging.getLogger(__name__)
+
+deserializer = TypeDeserializer()
+
+
+def lambda_handler(event, context):
+    """Serves three kinds of event:
+        Dynamo stream records from the status table, sent on to subscribers
+        The scheduled reconciler, which records the final state of finished flows
+        The /subscriptions API
+    """
+    dynamo_manager = DynamoManager(handler="notify", context=context)
+    try:
+        if "Records" in event:
+            return process_stream(event, context, dynamo_manager)
+        if event.get("source") == "aws.events":
+            return reconcile(event, context, dynamo_manager)
+        return manage_subscriptions(event, context, dynamo_manager)
+    finally:
+        dynamo_manager.emit_metrics()
+
+
+def subscription_topic(user_id=None, source_id=None):
+    """Subscriptions are stored under the dataset or the user they follow."""
+    return "source:{}".format(source_id) if source_id else "user:{}".format(user_id)
+
+
+def state_transition(old, new):
+    """The event to send subscribers when a status record changes, if any.
+
+    A record with a flow run means its flow has started, whether it was
+    created with one or a queued submission's run was just recorded. After
+    that, subscribers hear about each change of the flow's state, including a
+    queued submission whose flow could not be started.
+    """
+    if not new or not (new.get("action_id") or new.get("flow_state")):
+        return None
+    state = new.get("flow_state", "ACTIVE")
+    if old and old.get("action_id"):
+        previous_state = old.get("flow_state", "ACTIVE")
+    else:
+        # A new record, or one still queued
+        previous_state = old.get("flow_state") if old else None
+    if state == previous_state:
+        return None
+    return {
+        "event": "submission.state_changed",
+        "source_id": new["source_id"],
+        "version": new["version"],
+        "state": state,
+        "previous_state": previous_state,
+        "description": new.get("flow_description", ""),
+        "test": new.get("test", False),
+        "submission_time": new.get("submission_time")
+    }
+
+
+def process_stream(event, context, dynamo_manager):
+    deadline = deadline_from_context(context)
+    failures = []
+    for record in event["Records"]:
+        images = record.get("dynamodb", {})
+        old = {k: deserializer.deserialize(v) for k, v in images.get("OldImage", {}).items()}
+        new = {k: deserializer.deserialize(v) for k, v in images.get("NewImage", {}).items()}
+        transition = state_transition(old, new)
+        if not transition:
+            continue
+
+        try:
+            subscriptions = dynamo_manager.get_subscriptions([
+                subscription_topic(source_id=new["source_id"]),
+                subscription_topic(user_id=new.get("user_id"))
+            ])
+        except RetriesExhausted as e:
+            # Lambda hands this record, and the ones after it, to the next invocation
+            logger.error("Subscription lookup throttled: {}".format(e))
+            failures.append({"itemIdentifier": images.get("SequenceNumber")})
+            break
+
+        # A user may follow a dataset and themselves with the same URL
+        by_url = {subscription["url"]: subscription for subscription in subscriptions}
+        for subscription in by_url.values():
+            res = deliver(subscription, transition, deadline=deadline)
+            if not res["success"]:
+                # Not retried from the stream, as that would repeat the deliveries
+                # that did succeed
+                logger.error("Webhook to {} for {}-{} failed: {}".format(
+                    subscription["url"], new["source_id"], new["version"], res["error"]))
+
+    return {
+        "batchItemFailures": failures
+    }
+
+
+def reconcile(event, context, dynamo_manager):
+    """Record the progress of running flows, and the final state of flows that
+    finished since they were last checked.
+
+    Only the status and listing handlers ask Globus about flows, so without this
+    a flow nobody polls would never reach the stream. Each run reads only the
+    log entries added since the last one, so a status query reads the progress
+    code from the record instead of the whole log.
+
+    Records are read from the active run index, which only holds records whose
+    flow is running or whose log has entries left to read, so each run costs
+    as much as the flows in progress rather than the whole status table.
+    """
+    try:
+        # The whole index, however long ago a flow started, so a flow that
+        # waits on curation for weeks still gets its final state
+        running = dynamo_manager.query_active_runs(
+            fields=["source_id", "version", "action_id", "flow_state", "code",
+                    "messages", "log_position"])
+    except Exception as e:
+        logger.error("Reconciler query failed: {}".format(repr(e)))
+        return {
+            "success": False,
+            "error": repr(e)
+        }
+    if not running:
+        return {
+            "success": True,
+            "checked": 0,
+            "finished": 0
+        }
+
+    deadline = deadline_from_context(context)
+    automate_manager = AutomateManager(get_secret(secret_name=os.environ['MDF_SECRETS_NAME'],
+                                                  region_name=os.environ['MDF_AWS_REGION']))
+    automate_manager.authenticate()
+    flow_statuses = automate_manager.get_statuses(
+        [status["action_id"] for status in running if not status.get("flow_state")],
+        deadline=deadline)
+    finished = 0
+    for status in running:
+        flow_status = flow_statuses.get(status["action_id"])
+        if not (flow_status and flow_status["status"] in TERMINAL_STATES):
+            flow_status = None
+        if deadline is not None and time.monotonic() >= deadline:
+            # Left for the next run, but a finished flow's state is still cached
+            if flow_status:
+                dynamo_manager.set_flow_state(status["source_id"], status["version"],
+                                              flow_status)
+                finished += 1
+            continue
+
+        code, messages = status.get("code"), status.get("messages")
+        if not code:
+            code, messages = new_progress()
+        position = dict(status.get("log_position") or {})
+        try:
+            entries = automate_manager.get_new_log_entries(status["action_id"], position)
+        except Exception as e:
+            logger.warning("Unable to read the log for {}-{}: {}".format(
+                status["source_id"], status["version"], repr(e)))
+            entries = None
+        # The state was final before the log was read, so nothing can be left
+        # to read, and the record can leave the index
+        done = entries is not None and bool(flow_status or status.get("flow_state"))
+        if done:
+            position["complete"] = True
+        if entries or done:
+            if entries:
+                code, messages = apply_log_entries(code, list(messages), entries)
+            dynamo_manager.update_progress(status["source_id"], status["version"],
+                                           code, messages, position,
+                                           flow_status=flow_status, finished=done)
+        elif flow_status:
+            dynamo_manager.set_flow_state(status["source_id"], status["version"],
+                                          flow_status)
+        if flow_status:
+            finished += 1
+
+    return {
+        "success": True,
+        "checked": len(running),
+        "finished": finished
+    }
+
+
+def manage_subscriptions(event, context, dynamo_manager):
+    """Subscribe to, list, or unsubscribe from webhook notifications.
+
+    POST and DELETE take a body of {"url": ..., "source_id": ...}. Without a
+    source_id, the subscription follows all of the user's submissions.
+    """
+    user_id = event['requestContext']['authorizer']['user_id']
+    method = event.get("httpMethod")
+
+    if method == "GET":
+        res = dynamo_manager.list_subscriptions(user_id)
+        return {
+            'statusCode': 200 if res["success"] else 500,
+            'body': json.dumps({
+                "success": res["success"],
+                "subscriptions": res.get("results", [])
+            } if res["success"] else res)
+        }
+
+    try:
+        body = json.loads(event["body"])
+        url = body["url"]
+        source_id = body.get("source_id")
+    except Exception:
+        return {
+            'statusCode': 400,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": "Body must be JSON with the webhook url"
+                })
+        }
+    topic = subscription_topic(user_id=user_id, source_id=source_id)
+
+    if method == "DELETE":
+        res = dynamo_manager.delete_subscription(topic, url, user_id)
+        return {
+            'statusCode': 200 if res["success"] else 404,
+            'body': json.dumps(res)
+        }
+
+    url_error = validate_url(url)
+    if url_error:
+        return {
+            'statusCode': 400,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": url_error
+                })
+        }
+    # Only the submitter may follow a dataset
+    if source_id:
+        status_rec = dynamo_manager.get_current_version(
+            source_id, call_site="notify", fields=["source_id", "version", "user_id"])
+        if not status_rec or status_rec.get("user_id") != user_id:
+            return {
+                'statusCode': 404,
+                'body': json.dumps(
+                    {
+                        "success": False,
+                        "error": "Submission not found"
+                    })
+            }
+
+    subscription = {
+        "topic": topic,
+        "url": url,
+        "user_id": user_id,
+        # Shown only in this response, for the subscriber to check signatures with
+        "secret": new_secret(),
+        "created": datetime.utcnow().isoformat("T") + "Z"
+    }
+    if source_id:
+        subscription["source_id"] = source_id
+    res = dynamo_manager.create_subscription(subscription)
+    return {
+        'statusCode': 201,
+        'body': json.dumps(res)
+    }
@@ -0,0 +1,82 @@
+"""Log request payloads without paying for them on every request.
+
+Events, submissions and flow inputs can be megabytes, and carry Globus tokens
+and other credentials. They are logged with log_payload(), which does nothing
+unless the logger is at DEBUG or the request was picked for sampling, so at
+the default level a request costs no serialization at all. Payloads that are
+logged have credentials redacted and are cut to a maximum size.
+
+Environment:
+    LOG_LEVEL: The level of the root logger. Default INFO.
+    PAYLOAD_LOG_SAMPLE_RATE: The fraction of requests whose payloads are logged
+                             at INFO. Default 0.
+    PAYLOAD_LOG_MAX_CHARS: The most characters of a payload that are logged.
+                           Default 4096.
+"""
+import json
+import logging
+import os
+import random
+import re
+from contextvars import ContextVar
+
+# Keys whose values are never logged
+REDACTED_KEYS = re.compile(r"token|secret|password|authorization|credential|cookie|api_?key",
+                           re.IGNORECASE)
+REDACTED = "[REDACTED]"
+
+_sampled = ContextVar("payload_log_sampled", default=False)
+
+
+def start_request():
+    """Set the log level and decide whether this request's payloads are logged.
+
+    Handlers call this first, once per invocation.
+
+    Returns:
+    bool: True if the request was sampled.
+    """
+    logging.getLogger().setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    sampled = random.random() < float(os.environ.get("PAYLOAD_LOG_SAMPLE_RATE", 0))
+    _sampled.set(sampled)
+    return sampled
+
+
+def redact(payload):
+    """A copy of payload with the values of credential-like keys replaced."""
+    if isinstance(payload, dict):
+        return {key: REDACTED if isinstance(key, str) and REDACTED_KEYS.search(key)
+                else redact(value)
+                for key, value in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return [redact(value) for value in payload]
+    return payload
+
+
+def truncate(text, max_chars=None):
+    """Cut text to at most max_chars characters, saying how much was cut."""
+    if max_chars is None:
+        max_chars = int(os.environ.get("PAYLOAD_LOG_MAX_CHARS", 4096))
+    if len(text) <= max_chars:
+        return text
+    return "{}...[{} more characters]".format(text[:max_chars], len(text) - max_chars)
+
+
+def log_payload(logger, message, payload):
+    """Log a payload as one JSON record, if this request's payloads are logged.
+
+    Arguments:
+    logger (logging.Logger): The caller's logger.
+    message (str): What the payload is.
+    payload: Anything JSON-serializable, as far as what is worth logging goes.
+             Objects that aren't are logged as their str().
+    """
+    level = logging.INFO if _sampled.get() else logging.DEBUG
+    if not logger.isEnabledFor(level):
+        return
+    text = json.dumps(redact(payload), default=str)
+    logger.log(level, json.dumps({
+        "message": message,
+        "payload": truncate(text),
+        "size": len(text)
+    }))
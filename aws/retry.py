@@ -0,0 +1,268 @@
+import math
+import random
+import threading
+import time
+
+from botocore.exceptions import (ClientError, ConnectionClosedError, EndpointConnectionError,
+                                 ReadTimeoutError)
+
+# Error codes that mean the table (or account) is over its provisioned throughput
+THROTTLE_ERRORS = ('ProvisionedThroughputExceededException',
+                   'ThrottlingException',
+                   'RequestLimitExceeded')
+# Error codes that are worth retrying, but that say nothing about our request rate
+TRANSIENT_ERRORS = ('InternalServerError',
+                    'ServiceUnavailable')
+# Network failures botocore would retry itself, if its retries weren't turned off
+TRANSIENT_EXCEPTIONS = (EndpointConnectionError,
+                        ConnectionClosedError,
+                        ReadTimeoutError)
+
+
+class RetriesExhausted(Exception):
+    """A call was still failing when its attempts or its deadline ran out."""
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        # Suggested wait in whole seconds before the client tries again
+        self.retry_after = retry_after
+
+
+class CircuitOpen(RetriesExhausted):
+    """A call was not made, because the service it calls keeps failing."""
+
+
+def error_code(e):
+    if isinstance(e, ClientError):
+        return e.response.get('Error', {}).get('Code')
+    return None
+
+
+def is_throttle(e):
+    return error_code(e) in THROTTLE_ERRORS
+
+
+def is_retryable(e):
+    return isinstance(e, TRANSIENT_EXCEPTIONS) or \
+        error_code(e) in THROTTLE_ERRORS + TRANSIENT_ERRORS
+
+
+def deadline_from_context(context, margin=1.0):
+    """Turn the Lambda context's remaining time into a time.monotonic() deadline.
+
+    Arguments:
+    context: The Lambda context, or None when not running in Lambda.
+    margin (float): Seconds to hold back for building the response. Default 1.
+
+    Returns:
+    float: The deadline, or None if there is no context to bound the call.
+    """
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - margin
+
+
+class TokenBucket:
+    """Client-side rate limiter that learns the sustainable rate from throttles.
+
+    The bucket starts at max_rate, so it costs nothing while the table keeps up.
+    Each throttle cuts the rate by backoff_factor and each success adds back
+    recovery_rate requests/second, up to max_rate. Safe to share between threads.
+    """
+    def __init__(self, max_rate, min_rate=1.0, backoff_factor=0.5, recovery_rate=1.0):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.backoff_factor = backoff_factor
+        self.recovery_rate = recovery_rate
+        self.rate = max_rate
+        self.tokens = max_rate
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self, deadline=None):
+        """Take a token, waiting for one if needed.
+
+        Returns:
+        bool: True if a token was taken, False if waiting would pass the deadline.
+        """
+        with self.lock:
+            self._refill()
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            # Taken before waiting, so threads that wait at the same time
+            # queue up behind each other instead of sharing one token
+            self.tokens -= 1
+        if wait:
+            time.sleep(wait)
+        return True
+
+    def on_throttle(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.backoff_factor)
+            self.tokens = min(self.tokens, self.rate)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.recovery_rate)
+
+
+class RetryPolicy:
+    """Retry transient failures with full-jitter exponential backoff.
+
+    Arguments:
+    max_attempts (int): Total attempts, including the first. Default 5.
+    base_delay (float): Backoff base, in seconds. Default 0.05.
+    max_delay (float): Cap on any single backoff, in seconds. Default 2.
+    deadline (float): time.monotonic() value after which no retry is started.
+                      Default None, for no deadline.
+    rate_limiter (TokenBucket): Limiter to take a token from before each attempt,
+                                and to inform about throttles. Default None.
+    retryable (callable): Decides if an exception is worth retrying.
+    throttled (callable): Decides if an exception is a throttle.
+    """
+    def __init__(self, max_attempts=5, base_delay=0.05, max_delay=2.0, deadline=None,
+                 rate_limiter=None, retryable=is_retryable, throttled=is_throttle):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.rate_limiter = rate_limiter
+        self.retryable = retryable
+        self.throttled = throttled
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def exhausted(self, attempt, delay):
+        """Is it time to give up, after attempt failures and a next backoff of delay?"""
+        return attempt >= self.max_attempts or (
+            self.deadline is not None and time.monotonic() + delay > self.deadline)
+
+    def call(self, method, *args, on_retry=None, **kwargs):
+        """Call method(*args, **kwargs), retrying retryable failures.
+
+        Arguments:
+        method (callable): The call to make.
+        on_retry (callable): Called as on_retry(exception, attempt, delay)
+                             before each retry. Default None.
+
+        Returns:
+        The result of the call.
+
+        Raises:
+        RetriesExhausted: If the call is still failing after max_attempts, or
+                          another attempt would not finish before the deadline.
+        """
+        attempt = 0
+        while True:
+            if self.rate_limiter and not self.rate_limiter.acquire(self.deadline):
+                raise RetriesExhausted("Request rate limited past the deadline",
+                                       retry_after=self.retry_after(self.max_delay))
+            try:
+                result = method(*args, **kwargs)
+            except Exception as e:
+                if not self.retryable(e):
+                    raise
+                if self.rate_limiter and self.throttled(e):
+                    self.rate_limiter.on_throttle()
+                attempt += 1
+                delay = self.backoff(attempt)
+                if self.exhausted(attempt, delay):
+                    raise RetriesExhausted("Giving up after {} attempts: {}".format(attempt, e),
+                                           retry_after=self.retry_after(delay)) from e
+                if on_retry:
+                    on_retry(e, attempt, delay)
+                time.sleep(delay)
+            else:
+                if self.rate_limiter:
+                    self.rate_limiter.on_success()
+                return result
+
+    def retry_after(self, delay):
+        """Seconds a client should wait before retrying, after a backoff of delay."""
+        return max(1, math.ceil(delay))
+
+
+class CircuitBreaker:
+    """Stop calling a service that keeps failing, and try it again later.
+
+    After failure_threshold failed calls in a row the circuit opens, and calls
+    fail straight away with CircuitOpen for reset_timeout seconds. Then one
+    trial call is let through: if it succeeds the circuit closes, and if it
+    fails the circuit opens again. Safe to share between threads.
+
+    Arguments:
+    name (str): The service, for error messages.
+    failure_threshold (int): Failures in a row that open the circuit. Default 5.
+    reset_timeout (float): Seconds the circuit stays open. Default 30.
+    """
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def _raise_if_open(self):
+        if self.opened_at is None:
+            return
+        remaining = self.opened_at + self.reset_timeout - time.monotonic()
+        if remaining > 0 or self.trial_running:
+            raise CircuitOpen("{} is unavailable".format(self.name),
+                              retry_after=max(1, math.ceil(remaining)))
+
+    def check(self):
+        """Raise CircuitOpen if a call would fail straight away."""
+        with self.lock:
+            self._raise_if_open()
+
+    def before_call(self):
+        """Claim a call, or raise CircuitOpen if the circuit is open."""
+        with self.lock:
+            self._raise_if_open()
+            if self.opened_at is not None:
+                self.trial_running = True
+
+    def on_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def on_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+    def call(self, method, *args, failed=lambda e: True, **kwargs):
+        """Call method(*args, **kwargs) unless the circuit is open.
+
+        Arguments:
+        method (callable): The call to make.
+        failed (callable): Decides if an exception means the service is failing,
+                           rather than that the request was bad. Default all
+                           exceptions.
+
+        Raises:
+        CircuitOpen: If the circuit is open.
+        """
+        self.before_call()
+        try:
+            result = method(*args, **kwargs)
+        except Exception as e:
+            if failed(e):
+                self.on_failure()
+            else:
+                self.on_success()
+            raise
+        self.on_success()
+        return result
@@ -218,7 +218,7 @@ class SourceIDManager:
         old_search = mdf_toolbox.gmeta_pop(search_client.post_search(
             mdf_toolbox.translate_index(index), old_q))
 
-        print("Search for the old ", old_search)
+        logger.debug("Search entries for the old version: %s", len(old_search))
         if len(old_search) == 0:
             search_version = 1
         elif len(old_search) == 1:
@@ -230,13 +230,14 @@ class SourceIDManager:
 
         # Get old submission information
         scan_res = self.dyanamo_manager.scan_table(table_name="status", fields=["source_id", "user_id"],
-                              filters=[("source_id", "^", source_name)])
+                              filters=[("source_id", "^", source_name)],
+                              call_site="submit")
         if not scan_res["success"]:
             logger.error("Unable to scan status database for '{}': '{}'"
                          .format(source_name, scan_res["error"]))
             raise ValueError("Dataset status has error")
 
-        print("Scan res", scan_res)
+        logger.debug("Previous submissions: %s", len(scan_res["results"]))
         user_ids = set([sub["user_id"] for sub in scan_res["results"]])
         # Get most recent previous source_id and info
         old_search_version = 0
@@ -0,0 +1,117 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current_timer = ContextVar("stage_timer", default=None)
+
+
+class StageTimer:
+    """Time the stages of one invocation of a handler.
+
+    Code marks a stage with `with stage("name"):`, which is timed by the timer
+    active for the invocation, or not at all if there is none. emit() writes
+    every stage as a single CloudWatch Embedded Metric Format record, so the log
+    has one metrics record per invocation, and add_header() gives the response
+    a Server-Timing header. Set STAGE_METRICS_MODE to choose the output:
+        emf: One EMF JSON line, and the header (default)
+        report: A human-readable table, and the header, for local benchmarks
+        off: Nothing
+    """
+    NAMESPACE = "MDFConnect"
+
+    def __init__(self, handler, mode=None):
+        self.handler = handler
+        self.mode = mode or os.environ.get("STAGE_METRICS_MODE", "emf")
+        self.namespace = os.environ.get("STAGE_METRICS_NAMESPACE", self.NAMESPACE)
+        self.stages = {}
+        self.start = time.perf_counter()
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_timer.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current_timer.reset(self._token)
+
+    @contextmanager
+    def span(self, name):
+        """Time a stage. A stage entered more than once is timed in total."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = (self.stages.get(name, 0.0)
+                                 + (time.perf_counter() - start) * 1000)
+
+    def report(self):
+        """Summarize the stages timed so far.
+
+        Returns:
+        dict:
+            handler (str): The handler that was timed.
+            stages (dict): Milliseconds spent in each stage, in the order they began.
+            total_ms (float): Milliseconds since the timer was made.
+        """
+        return {
+            "handler": self.handler,
+            "stages": {name: round(ms, 3) for name, ms in self.stages.items()},
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 3)
+        }
+
+    def server_timing(self):
+        report = self.report()
+        metrics = ["{};dur={}".format(name, ms) for name, ms in report["stages"].items()]
+        metrics.append("total;dur={}".format(report["total_ms"]))
+        return ", ".join(metrics)
+
+    def add_header(self, response):
+        """Add a Server-Timing header to an API Gateway response, and return it."""
+        if self.mode != "off" and isinstance(response, dict):
+            response.setdefault("headers", {})["Server-Timing"] = self.server_timing()
+        return response
+
+    def emf_record(self):
+        report = self.report()
+        values = dict(report["stages"], total=report["total_ms"])
+        return dict(values, **{
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [["handler"]],
+                    "Metrics": [{"Name": name, "Unit": "Milliseconds"} for name in values]
+                }]
+            },
+            "handler": self.handler
+        })
+
+    def format_report(self):
+        report = self.report()
+        lines = ["Stage timings for {}".format(report["handler"])]
+        for name, ms in report["stages"].items():
+            lines.append("{:<20}{:>12.2f} ms".format(name, ms))
+        lines.append("{:<20}{:>12.2f} ms".format("total", report["total_ms"]))
+        return "\n".join(lines)
+
+    def emit(self):
+        """Write the timings for this invocation according to the mode."""
+        if self.mode == "off":
+            return
+        if self.mode == "report":
+            print(self.format_report())
+        else:
+            print(json.dumps(self.emf_record()))
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of the current invocation, if it is being timed."""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.span(name):
+        yield
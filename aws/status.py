@@ -1,36 +1,306 @@
 import json
+import logging
 import os
+import time
 
 from dynamo_manager import DynamoManager
 from automate_manager import AutomateManager
+from admission import admit
+from api_responses import (FLOWS_UNAVAILABLE, busy_response, entity_tag, json_response,
+                           not_modified, request_header)
+from fieldsets import (STATUS_FIELDS, TERMINAL_STATES, cached_flow_status,
+                       format_status_record, needs_flow_status, parse_fields,
+                       record_attributes, record_tag_parts)
+from request_logging import log_payload, start_request
+from retry import RetriesExhausted, deadline_from_context
+from stage_timer import StageTimer, stage
 from utils import get_secret
 
+logger = logging.getLogger(__name__)
+
 
 def lambda_handler(event, context):
-    dynamo_manager = DynamoManager()
-    automate_manager = AutomateManager(get_secret(secret_name=os.environ['MDF_SECRETS_NAME'],
-                                                  region_name=os.environ['MDF_AWS_REGION']))
-    automate_manager.authenticate()
+    start_request()
+    dynamo_manager = DynamoManager(handler="status", context=context)
+    timer = StageTimer(handler="status")
+    try:
+        with timer:
+            with stage("admission"):
+                rejected = admit(event, dynamo_manager, "status")
+            if rejected:
+                return timer.add_header(rejected)
+            # POST /status looks up many submissions at once
+            if event.get("httpMethod") == "POST":
+                return timer.add_header(get_batch_status(event, context, dynamo_manager))
+            # GET /status/{source_id}/history pages through a dataset's versions
+            if (event.get("resource") or event.get("path") or "").endswith("/history"):
+                return timer.add_header(get_history(event, context, dynamo_manager))
+            return timer.add_header(get_status(event, context, dynamo_manager))
+    finally:
+        dynamo_manager.emit_metrics()
+        timer.emit()
+
+
+def bad_request(e):
+    return {
+        'statusCode': 400,
+        'body': json.dumps(
+            {
+                "success": False,
+                "error": str(e)
+            })
+    }
+
 
-    print(event)
+def get_status(event, context, dynamo_manager):
+    log_payload(logger, "Status event", event)
     source_id = event['pathParameters']['source_id']
 
-    version = event['queryStringParameters'].get('version', None) if event[
-        "queryStringParameters"] else None
+    query = event['queryStringParameters'] or {}
+    version = query.get('version', None)
+    try:
+        fields = parse_fields(query.get('fields'), default=STATUS_FIELDS)
+    except ValueError as e:
+        return bad_request(e)
+    try:
+        wait = max(0.0, float(query.get('wait', 0)))
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": "wait must be a number of seconds"
+                })
+        }
 
-    if version:
-        status_rec = dynamo_manager.read_status_record(source_id, version)
-    else:
-        status_rec = dynamo_manager.get_current_version(source_id)
+    # With wait, the handler holds the request until the status no longer
+    # matches the client's state token, which is the ETag of its last response
+    token = query.get('since') or request_header(event, "if-none-match")
+    deadline = time.monotonic() + min(wait, float(os.environ.get("STATUS_MAX_WAIT", 20)))
+    lambda_deadline = deadline_from_context(context)
+    if lambda_deadline is not None:
+        deadline = min(deadline, lambda_deadline)
+    interval = float(os.environ.get("STATUS_POLL_MIN_INTERVAL", 1))
+    max_interval = float(os.environ.get("STATUS_POLL_MAX_INTERVAL", 8))
 
-    print(status_rec)
+    automate_manager = None
+    while True:
+        try:
+            with stage("read_status"):
+                if version:
+                    status_rec = dynamo_manager.read_status_record(
+                        source_id, version, fields=record_attributes(fields))
+                else:
+                    status_rec = dynamo_manager.get_current_version(
+                        source_id, call_site="status", fields=record_attributes(fields))
+        except RetriesExhausted as e:
+            return busy_response(e)
 
-    result ={
-        "original_submission": json.loads(status_rec['original_submission']),
-        "flow_status":automate_manager.get_status(status_rec['action_id'])
-    }
+        log_payload(logger, "Status record", status_rec)
+        if not status_rec:
+            return {
+                'statusCode': 404,
+                'body': json.dumps(
+                    {
+                        "success": False,
+                        "error": "Submission not found"
+                    })
+            }
 
-    return {
-        'statusCode': 200,
-        'body': json.dumps(result)
-    }
+        flow_status = None
+        if needs_flow_status(status_rec, fields):
+            if not automate_manager:
+                with stage("get_secret"):
+                    secret = get_secret(secret_name=os.environ['MDF_SECRETS_NAME'],
+                                        region_name=os.environ['MDF_AWS_REGION'])
+                automate_manager = AutomateManager(secret)
+                with stage("authenticate"):
+                    automate_manager.authenticate()
+            try:
+                with stage("flow_status"):
+                    flow_status = automate_manager.get_status(
+                        status_rec['action_id'], deadline=lambda_deadline)
+            except RetriesExhausted as e:
+                return busy_response(e, FLOWS_UNAVAILABLE)
+            # Cache a final state, so later polls can be answered from the record alone
+            if flow_status.get('status') in TERMINAL_STATES:
+                dynamo_manager.set_flow_state(status_rec['source_id'], status_rec['version'],
+                                              flow_status)
+
+        # A running flow can move on without its record changing, so the state
+        # fetched from Globus is part of the tag. Finished flows are answered and
+        # tagged from the state cached on the record, so their polls never reach
+        # Globus.
+        tag = entity_tag(fields, record_tag_parts(status_rec), flow_status)
+        unchanged = not_modified(event, tag, if_none_match=token)
+        if not unchanged:
+            break
+
+        # A finished flow of a pinned version will not change again
+        finished = version and (cached_flow_status(status_rec) or
+                                (flow_status or {}).get('status') in TERMINAL_STATES)
+        if finished or time.monotonic() + interval > deadline:
+            return unchanged
+        # Check often at first, then back off while nothing happens
+        with stage("wait"):
+            time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+    result = format_status_record(status_rec, flow_status, fields=fields)
+
+    return json_response(event, 200, result, headers={"etag": tag})
+
+
+def get_batch_status(event, context, dynamo_manager):
+    """Look up the status of many submissions in one request.
+
+    The body is {"submissions": [{"source_id": ..., "version": ...}, ...]},
+    where version is optional and defaults to the latest version.
+    """
+    max_keys = int(os.environ.get("BATCH_STATUS_MAX_KEYS", 100))
+    try:
+        body = json.loads(event["body"])
+        requested = body["submissions"]
+        keys = [(sub["source_id"], sub.get("version")) for sub in requested]
+    except Exception:
+        return {
+            'statusCode': 400,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": "Body must be JSON with a list of submissions, each with a source_id"
+                })
+        }
+    try:
+        fields = parse_fields(body.get("fields"), default=STATUS_FIELDS)
+    except ValueError as e:
+        return bad_request(e)
+    if len(keys) > max_keys:
+        return {
+            'statusCode': 400,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": "At most {} submissions may be requested at once".format(max_keys)
+                })
+        }
+
+    try:
+        with stage("read_status"):
+            records = dynamo_manager.batch_read_status_records(
+                [key for key in keys if key[1]], fields=record_attributes(fields))
+            # Without a version, the latest one has to be found first
+            for source_id, version in keys:
+                if not version:
+                    latest = dynamo_manager.get_current_version(
+                        source_id, call_site="status", fields=record_attributes(fields))
+                    if latest:
+                        records[(source_id, None)] = latest
+    except RetriesExhausted as e:
+        return busy_response(e)
+
+    action_ids = list({rec['action_id'] for rec in records.values()
+                       if needs_flow_status(rec, fields)})
+    flow_statuses = {}
+    if action_ids:
+        with stage("get_secret"):
+            secret = get_secret(secret_name=os.environ['MDF_SECRETS_NAME'],
+                                region_name=os.environ['MDF_AWS_REGION'])
+        automate_manager = AutomateManager(secret)
+        with stage("authenticate"):
+            automate_manager.authenticate()
+
+        with stage("flow_status"):
+            flow_statuses = automate_manager.get_statuses(
+                action_ids, deadline=deadline_from_context(context))
+
+    statuses = []
+    for source_id, version in keys:
+        status_rec = records.get((source_id, version))
+        if not status_rec:
+            statuses.append({
+                "source_id": source_id,
+                "version": version,
+                "success": False,
+                "error": "Submission not found"
+            })
+            continue
+        entry = {
+            "source_id": source_id,
+            "version": status_rec['version'],
+            "success": True
+        }
+        entry.update(format_status_record(status_rec,
+                                          flow_statuses.get(status_rec.get('action_id')),
+                                          fields=fields))
+        statuses.append(entry)
+
+    # If the statuses don't fit in one response, the client asks again for the
+    # submissions from next_offset on
+    return json_response(event, 200, {
+        "success": True,
+        "statuses": statuses
+    }, page_key="statuses")
+
+
+def get_history(event, context, dynamo_manager):
+    """List a dataset's versions, newest first, a page at a time.
+
+    Takes limit and cursor query parameters. Pass the next_cursor of a
+    response as cursor to get the page after it.
+    """
+    source_id = event['pathParameters']['source_id']
+    query = event['queryStringParameters'] or {}
+    max_limit = int(os.environ.get("HISTORY_MAX_LIMIT", 100))
+    try:
+        limit = int(query.get('limit', 10))
+        if not 0 < limit <= max_limit:
+            raise ValueError()
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": "limit must be a whole number from 1 to {}".format(max_limit)
+                })
+        }
+
+    try:
+        with stage("read_history"):
+            page = dynamo_manager.query_version_history(source_id, limit=limit,
+                                                        cursor=query.get('cursor'))
+    except ValueError as e:
+        return bad_request(e)
+    except RetriesExhausted as e:
+        return busy_response(e)
+
+    if not page["versions"] and not query.get('cursor'):
+        return {
+            'statusCode': 404,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": "Submission not found"
+                })
+        }
+
+    versions = [{
+        "version": entry["version"],
+        "previous_version": entry["previous_version"],
+        "submission_time": entry.get("submission_time"),
+        "title": entry.get("title"),
+        "submitter": entry.get("submitter"),
+        "test": entry.get("test", False),
+        # Only finished flows have a state on the record
+        "final_state": entry.get("flow_state"),
+        "description": entry.get("flow_description")
+    } for entry in page["versions"]]
+
+    return json_response(event, 200, {
+        "success": True,
+        "source_id": source_id,
+        "versions": versions,
+        "next_cursor": page["next_cursor"]
+    })
@@ -1,69 +1,65 @@
 import json
+import logging
 import os
 
-from globus_sdk import GlobusAPIError
-
 from dynamo_manager import DynamoManager
 from automate_manager import AutomateManager
+from api_responses import busy_response, entity_tag, json_response, not_modified
+from fieldsets import (FLOW_STATE_FIELDS, SUBMISSION_FIELDS, TERMINAL_STATES,
+                       format_status_record, needs_flow_status, parse_fields,
+                       record_attributes, record_tag_parts)
+from request_logging import start_request
+from retry import RetriesExhausted, deadline_from_context
+from stage_timer import StageTimer, stage
 from utils import get_secret
 
-status_codes = {
-    "SUCCEEDED": "S",
-    "ACTIVE": "P",
-    "FAILED": "F",
-    "UNKNOWN": "U"
-}
-
-def format_status_record(status:dict, automate_manager:AutomateManager) -> dict:
-    usr_msg = ("Status of {}submission {} ({})\n"
-               "Submitted by {} at {}\n\n").format("TEST " if status["test"] else "",
-                                                   status["source_id"],
-                                                   status["title"],
-                                                   status["submitter"],
-                                                   status["submission_time"])
-
-    automate_status = {
-        "status": "UNKNOWN",
-        "details": {
-            "description": "Unknown"
-        }
-    }
-
-    if 'action-id' in status:
-        try:
-            automate_status = automate_manager.get_status(status['action_id'])
-        except GlobusAPIError:
-            automate_status["details"]['description'] = "Flow not found"
-    else:
-        automate_status["details"]['description'] = "Submission prior to GlobusAutomate"
+logger = logging.getLogger(__name__)
 
-    return {
-        "source_id": status["source_id"],
-        "status_message": usr_msg,
-        "status_list": "need more status data",
-        "status_code": status_codes[automate_status['status']],
-        "title": status["title"],
-        "submitter": status["submitter"],
-        "submission_time": status["submission_time"],
-        "description": automate_status['details']['description'],
-        "test": status["test"],
-        "active": automate_status['status'] == "ACTIVE",
-        "original_submission": json.loads(status["original_submission"])
-    }
 
 def lambda_handler(event, context):
-    user_id = event['requestContext']['authorizer']['user_id']
+    start_request()
+    dynamo_manager = DynamoManager(handler="submissions", context=context)
+    timer = StageTimer(handler="submissions")
+    try:
+        with timer:
+            return timer.add_header(list_submissions(event, context, dynamo_manager))
+    finally:
+        dynamo_manager.emit_metrics()
+        timer.emit()
 
-    if 'filters' in event['body']:
-        provided_filters = json.loads(event['body'])['filters']
-    else:
-        provided_filters = []
 
-    dynamo_manager = DynamoManager()
+def list_submissions(event, context, dynamo_manager):
+    user_id = event['requestContext']['authorizer']['user_id']
 
-    automate_manager = AutomateManager(get_secret(secret_name=os.environ['MDF_SECRETS_NAME'],
-                                                  region_name=os.environ['MDF_AWS_REGION']))
-    automate_manager.authenticate()
+    body = json.loads(event['body']) if event.get('body') else {}
+    provided_filters = body.get('filters', [])
+    # Listings too large for one response are returned a page at a time
+    try:
+        offset = int(body.get('offset', 0))
+        if offset < 0:
+            raise ValueError(offset)
+    except (TypeError, ValueError):
+        return {
+            'statusCode': 400,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": "offset must be a whole number of at least 0"
+                })
+        }
+    try:
+        fields = parse_fields(body.get('fields') or
+                              (event.get('queryStringParameters') or {}).get('fields'),
+                              default=SUBMISSION_FIELDS)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": str(e)
+                })
+        }
 
     if event["pathParameters"] and  "user_id" in event['pathParameters']:
         requested_user_id = event['pathParameters']['user_id']
@@ -72,14 +68,55 @@ def lambda_handler(event, context):
 
     filters = [("user_id", "==", requested_user_id)]
     filters.extend(provided_filters)
-    print(f"Final filters = {filters}")
-    scan_res = dynamo_manager.scan_table("status", filters=filters)
-    response = [format_status_record(status, automate_manager) for status in scan_res['results']]
+    logger.debug("Listing filters %s", filters)
+    attributes = record_attributes(fields)
+    # The reconciler records each running flow's progress in its code, so the
+    # tag follows flows that move on without Globus being asked
+    if any(f in FLOW_STATE_FIELDS for f in fields) and "code" not in attributes:
+        attributes.append("code")
+    try:
+        with stage("scan_status"):
+            scan_res = dynamo_manager.scan_table("status", fields=attributes,
+                                                 filters=filters, call_site="listing")
+    except RetriesExhausted as e:
+        return busy_response(e)
+    statuses = scan_res['results'][offset:]
+
+    # Tagged from the records alone, so an unchanged listing is answered
+    # before any flow is looked up. A running flow's state can be up to one
+    # reconciler run newer than its record.
+    tag = entity_tag(fields, offset, [record_tag_parts(status) for status in statuses])
+    unchanged = not_modified(event, tag)
+    if unchanged:
+        return unchanged
+
+    # Finished runs have their final state cached, so only ask Globus about the
+    # rest, and only if the requested fields need it
+    flow_statuses = {}
+    pending = list({status['action_id'] for status in statuses
+                    if needs_flow_status(status, fields)})
+    if pending:
+        with stage("get_secret"):
+            secret = get_secret(secret_name=os.environ['MDF_SECRETS_NAME'],
+                                region_name=os.environ['MDF_AWS_REGION'])
+        automate_manager = AutomateManager(secret)
+        with stage("authenticate"):
+            automate_manager.authenticate()
+        with stage("flow_status"):
+            fetched = automate_manager.get_statuses(pending,
+                                                    deadline=deadline_from_context(context))
+        flow_statuses.update(fetched)
+
+        for status in statuses:
+            flow_status = fetched.get(status.get('action_id'))
+            if flow_status and flow_status['status'] in TERMINAL_STATES:
+                dynamo_manager.set_flow_state(status['source_id'], status['version'],
+                                              flow_status)
+
+    response = [format_status_record(status, flow_statuses.get(status.get('action_id')),
+                                     fields=fields)
+                for status in statuses]
 
-    return {
-        'statusCode' : 200,
-        'headers': {"content-type": "application/json"},
-        'body': json.dumps({
-            "submissions": response
-        })
-    }
+    return json_response(event, 200, {
+        "submissions": response
+    }, headers={"etag": tag}, page_key="submissions", offset=offset)
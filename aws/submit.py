@@ -1,141 +1,237 @@
+import hashlib
 import json
 import logging
+import math
 import os
+import threading
 import traceback
 import uuid
-from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 
 import jsonschema
 
+from admission import admit
+from api_responses import FLOWS_UNAVAILABLE, busy_response
 from automate_manager import AutomateManager
 from dynamo_manager import DynamoManager
+from globus_automate_flow import flows_breaker
+from idempotency import idempotent
+from incremental_validation import iter_changed_errors
+from job_queue import MAX_MESSAGE_BYTES, job_queue_from_env
 from organization import Organization, OrganizationException
+from request_logging import log_payload, start_request
+from retry import RetriesExhausted, deadline_from_context
 from source_id_manager import SourceIDManager
+from stage_timer import StageTimer, stage
 from utils import get_secret
 
 logger = logging.getLogger(__name__)
 
 
-def validate_submission_schema(metadata):
-    schema_path = "./schemas/schemas"
-    with open(os.path.join(schema_path, "connect_submission.json")) as schema_file:
-        schema = json.load(schema_file)
-        resolver = jsonschema.RefResolver(base_uri="file://{}/{}/".format(os.getcwd(),
-                                                                          schema_path),
-                                          referrer=schema)
-        try:
-            jsonschema.validate(metadata, schema, resolver=resolver)
-            return None
-        except jsonschema.ValidationError as e:
-            return {
-                'statusCode': 400,
-                'body': json.dumps(
-                    {
-                        "success": False,
-                        "error": "Invalid submission: " + str(e).split("\n")[0]
-                    })
-            }
+class NonFiniteNumber(ValueError):
+    """A submission contained NaN, Infinity, or -Infinity."""
 
 
-def lambda_handler(event, context):
-    print(json.dumps(event))
-    name = event['requestContext']['authorizer']['name']
-    identities = eval(event['requestContext']['authorizer']['identities'])
-    user_id = event['requestContext']['authorizer']['user_id']
-    user_email = event['requestContext']['authorizer']['user_email']
-
-    depends = event['requestContext']['authorizer']['globus_dependent_token'].replace(
-        'null', 'None')
-    globus_dependent_token = eval(depends)
-    print("name ", name, "identities", identities)
-    print("globus_dependent_token ", globus_dependent_token)
-
-    user_groups = eval(event['requestContext']['authorizer']['group_info'])
-    print("user_groups ", user_groups)
-
-    run_as_scope = os.environ["RUN_AS_SCOPE"]
-    monitor_by_group = os.environ['MONITOR_BY_GROUP']
-    search_index_uuid = os.environ['SEARCH_INDEX_UUID']
-    test_search_index_uuid = os.environ['TEST_SEARCH_INDEX_UUID']
-    required_group_membership = os.environ['REQUIRED_GROUP_MEMBERSHIP']
+def reject_constant(constant):
+    raise NonFiniteNumber(constant)
 
-    access_token = event['headers']['authorization']
 
-    dynamo_manager = DynamoManager()
-    sourceid_manager = SourceIDManager()
+def finite_float(literal):
+    value = float(literal)
+    if math.isinf(value):
+        raise NonFiniteNumber(literal)
+    return value
 
-    if required_group_membership and required_group_membership not in user_groups:
-        return {
-            'statusCode': 400,
-            'body': json.dumps(
-                {
-                    "success": False,
-                    "error": "User must be a member of the required group: " + required_group_membership
-                })
-        }
 
-    try:
-        metadata = json.loads(event['body'], )
-    except Exception as e:
-        return {
-            'statusCode': 400,
-            'body': json.dumps(
-                {
-                    "success": False,
-                    "error": "Submission must be valid JSON"
-                })
-        }
-
-    md_copy = deepcopy(metadata)
+def parse_submission_body(body):
+    """Parse a request body in one pass, rejecting NaN and Infinity as it goes.
 
-    if not metadata:
-        return {
-            'statusCode': 400,
-            'body': json.dumps(
-                {
-                    "success": False,
-                    "error": "POST data empty or not JSON"
-                })
-        }
+    Every float literal is checked, since whether one overflows to infinity
+    depends on its mantissa as well as its exponent.
 
+    Returns:
+    tuple: The parsed body and None, or None and the error response.
+    """
     # NaN, Infinity, and -Infinity cause issues in Search, and have no use in MDF
     try:
-        json.dumps(metadata, allow_nan=False)
-    except Exception as e:
-        return {
-            'statusCode': 400,
-            'body': json.dumps(
-                {
-                    "success": False,
-                    "error": "Submission may not contain NaN or Infinity"
-                })
-        }
+        return json.loads(body, parse_constant=reject_constant,
+                          parse_float=finite_float), None
+    except NonFiniteNumber:
+        error = "Submission may not contain NaN or Infinity"
+    except Exception:
+        error = "Submission must be valid JSON"
+    return None, {
+        'statusCode': 400,
+        'body': json.dumps(
+            {
+                "success": False,
+                "error": error
+            })
+    }
 
-    print("+++Metadata+++", metadata)
 
-    org_cannonical_name = metadata.get("mdf", {}).get("organization", "MDF Open")
+SUBMISSION_SCHEMA_PATH = "./schemas/schemas"
+
+
+@lru_cache(maxsize=None)
+def submission_schema():
+    """The connect_submission schema, loaded and checked once per process."""
+    with open(os.path.join(SUBMISSION_SCHEMA_PATH, "connect_submission.json")) as schema_file:
+        schema = json.load(schema_file)
+    jsonschema.validators.validator_for(schema).check_schema(schema)
+    return schema
+
+
+# Resolvers keep a stack of scopes while they follow $refs, so each thread
+# has its own validator
+_validators = threading.local()
+
+
+def submission_validator():
+    """The connect_submission schema's validator, built once per thread."""
+    validator = getattr(_validators, "validator", None)
+    if validator is None:
+        schema = submission_schema()
+        resolver = jsonschema.RefResolver(base_uri="file://{}/{}/".format(
+            os.getcwd(), SUBMISSION_SCHEMA_PATH), referrer=schema)
+        validator = jsonschema.validators.validator_for(schema)(schema, resolver=resolver)
+        _validators.validator = validator
+    return validator
+
+
+@lru_cache(maxsize=None)
+def submission_schema_fingerprint():
+    """A hash of the submission schema and the schemas it refers to. Status
+    records keep the one they were validated with."""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(SUBMISSION_SCHEMA_PATH)):
+        if name.endswith(".json"):
+            with open(os.path.join(SUBMISSION_SCHEMA_PATH, name), "rb") as schema_file:
+                digest.update(name.encode("utf-8") + b"\0" + schema_file.read())
+    return digest.hexdigest()
+
+
+def validate_submission_schema(metadata, previous=None):
+    """Validate a normalized submission.
+
+    Arguments:
+    metadata (dict): The submission.
+    previous (dict): The normalized submission metadata updates, if it passed
+                     the current schema. Only what changed since it is
+                     validated. Default None, to validate everything.
+
+    Returns:
+    dict: The error response, or None if the submission is valid.
+    """
+    validator = submission_validator()
+    if previous is not None:
+        try:
+            if next(iter_changed_errors(validator, metadata, previous), None) is None:
+                return None
+            # Invalid, so validate everything to report the same error as
+            # jsonschema.validate
+        except Exception as e:
+            logger.warning("Incremental validation failed, validating everything: {}"
+                           .format(repr(e)))
+    # The error jsonschema.validate would raise
+    error = jsonschema.exceptions.best_match(validator.iter_errors(metadata))
+    if error is None:
+        return None
+    return {
+        'statusCode': 400,
+        'body': json.dumps(
+            {
+                "success": False,
+                "error": "Invalid submission: " + str(error).split("\n")[0]
+            })
+    }
+
+
+def launch_flow(automate_manager, job, organization=None, deadline=None):
+    """Start the MDF flow for a submission job.
+
+    Arguments:
+    automate_manager (AutomateManager): An authenticated manager.
+    job (dict): The submission, as built by build_submission.
+    organization (Organization): The job's organization, if already looked up.
+                                 Default None.
+    deadline (float): time.monotonic() value after which Flows calls are not
+                      retried. Default None.
+
+    Returns:
+    str: The flow run's action_id.
+    """
+    if organization is None:
+        organization = Organization.from_schema_repo(job["organization"])
+    # Passes to submit with magic UUID that allows mdf admins to monitor flows in progress
+    return automate_manager.submit(mdf_rec=job["metadata"], organization=organization,
+                                   submitting_user_token=job["submitting_user_token"],
+                                   submitting_user_id=job["user_id"],
+                                   submitting_user_email=job["user_email"],
+                                   monitor_by_id=[
+                                       'urn:globus:auth:identity:' + job["user_id"],
+                                       os.environ['MONITOR_BY_GROUP']],
+                                   search_index_uuid=job["search_index_uuid"],
+                                   data_sources=job["data_sources"],
+                                   is_test=job["is_test"],
+                                   update_metadata_only=job["update_metadata_only"],
+                                   deadline=deadline,
+                                   )
 
-    # MDF Connect Client needs to only allow one organization. Til then, we just
-    # take the first one
-    if type(org_cannonical_name) == list:
-        org_cannonical_name = org_cannonical_name[0]
 
+def lambda_handler(event, context):
+    start_request()
+    dynamo_manager = DynamoManager(handler="submit", context=context)
+    timer = StageTimer(handler="submit")
     try:
-        organization = Organization.from_schema_repo(org_cannonical_name)
-        print("######", organization)
-    except OrganizationException as e:
+        if (event.get("resource") or event.get("path") or "").endswith("/bulk"):
+            submit = submit_bulk
+        else:
+            submit = submit_dataset
+        # A client retrying after a timeout gets the first response, instead of
+        # a second flow run
+        with timer:
+            return timer.add_header(idempotent(event, dynamo_manager,
+                                               lambda: submit(event, context, dynamo_manager)))
+    finally:
+        dynamo_manager.emit_metrics()
+        timer.emit()
+
+
+def user_from_event(event):
+    """The submitting user, as described by the authorizer."""
+    authorizer = event['requestContext']['authorizer']
+    depends = authorizer['globus_dependent_token'].replace('null', 'None')
+    user = {
+        "name": authorizer['name'],
+        "identities": eval(authorizer['identities']),
+        "user_id": authorizer['user_id'],
+        "user_email": authorizer['user_email'],
+        "globus_dependent_token": eval(depends),
+        "user_groups": eval(authorizer['group_info'])
+    }
+    log_payload(logger, "Submitting user", user)
+    return user
+
+
+def check_group_membership(user):
+    required_group_membership = os.environ['REQUIRED_GROUP_MEMBERSHIP']
+    if required_group_membership and required_group_membership not in user["user_groups"]:
         return {
             'statusCode': 400,
             'body': json.dumps(
                 {
                     "success": False,
-                    "error": f"Organization: {org_cannonical_name} not found"
+                    "error": "User must be a member of the required group: " + required_group_membership
                 })
         }
+    return None
 
 
-    # Validate input JSON
+def normalize_submission(metadata):
+    """Fill in the defaults and shorthands of a submission, in place."""
     # resourceType is always going to be Dataset, don't require from user
     # i.e. default to Dataset
     if not metadata.get("dc") or not isinstance(metadata["dc"], dict):
@@ -161,10 +257,95 @@ def lambda_handler(event, context):
                 "subject": tag
             })
 
-    validate_err = validate_submission_schema(metadata)
+
+def updated_source_name(metadata):
+    """The source_name of the dataset an update submission is for, or None if
+    it isn't an update. Looked up before the submission is checked, so only
+    what the update changes needs validating."""
+    try:
+        if not metadata.get("update"):
+            return None
+        source_name = metadata.get("mdf", {}).get("source_name", None)
+        if source_name and metadata.get("test", False):
+            source_name += "-test"
+        return source_name
+    except Exception:
+        # prepare_submission reports what's wrong
+        return None
+
+
+def previous_submission(existing_record):
+    """The submission a dataset's current version was made with, if it can
+    stand in for validating what an update leaves unchanged."""
+    if (not existing_record or existing_record.get("submission_schema")
+            != submission_schema_fingerprint()):
+        # Validated against an older schema, or before fingerprints were kept
+        return None
+    try:
+        previous = json.loads(existing_record["original_submission"])
+        normalize_submission(previous)
+        return previous
+    except Exception:
+        return None
+
+
+def prepare_submission(metadata, user, original_submission, previous=None):
+    """Check a submission, and fill in what can be worked out without the
+    status database.
+
+    Arguments:
+    metadata (dict): The submission, from parse_submission_body. It is
+                     normalized in place.
+    user (dict): The submitting user, from user_from_event.
+    original_submission (str): The submission as it was sent, JSON encoded.
+    previous (dict): For updates, the current version's submission, from
+                     previous_submission. Default None.
+
+    Returns:
+    tuple: The prepared submission and None, or None and the error response.
+    """
+    if not metadata:
+        return None, {
+            'statusCode': 400,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": "POST data empty or not JSON"
+                })
+        }
+
+    log_payload(logger, "Submission metadata", metadata)
+
+    org_cannonical_name = metadata.get("mdf", {}).get("organization", "MDF Open")
+
+    # MDF Connect Client needs to only allow one organization. Til then, we just
+    # take the first one
+    if type(org_cannonical_name) == list:
+        org_cannonical_name = org_cannonical_name[0]
+
+    try:
+        with stage("organization"):
+            organization = Organization.from_schema_repo(org_cannonical_name)
+        logger.debug("Organization %s", organization)
+    except OrganizationException as e:
+        return None, {
+            'statusCode': 400,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": f"Organization: {org_cannonical_name} not found"
+                })
+        }
+
+
+    # Validate input JSON
+    normalize_submission(metadata)
+
+    with stage("validation"):
+        validate_err = validate_submission_schema(metadata, previous)
     if validate_err:
-        print("---->", validate_err)
-        return validate_err
+        logger.info("Invalid submission: %s", validate_err["body"])
+        return None, validate_err
 
     # Pull out configuration fields from metadata into submission_conf, set defaults where appropriate
     submission_conf = {
@@ -179,7 +360,7 @@ def lambda_handler(event, context):
         "services": metadata.pop("services", {}),
         "extraction_config": metadata.pop("extraction_config", {}),
         "no_extract": metadata.pop("no_extract", False),  # Pass-through flag
-        "submitter": name,
+        "submitter": user["name"],
         "update_metadata_only": metadata.pop("update_metadata_only", False),
     }
 
@@ -189,7 +370,7 @@ def lambda_handler(event, context):
         # author_name is first author familyName, first author creatorName,
         # or submitter
         author_name = metadata["dc"]["creators"][0].get(
-            "familyName", metadata["dc"]["creators"][0].get("creatorName", name))
+            "familyName", metadata["dc"]["creators"][0].get("creatorName", user["name"]))
 
         #
         existing_source_name = metadata.get("mdf", {}).get("source_name", None)
@@ -201,22 +382,10 @@ def lambda_handler(event, context):
         if is_test and existing_source_name:
             existing_source_name += "-test"
 
-        print("++++++++existing_source+++++++", existing_source_name)
-
-        if not existing_source_name:
-            source_name = str(uuid.uuid4())
-            existing_record = None
-            version = None
-            previous_versions = []
-        else:
-            existing_record = dynamo_manager.get_current_version(existing_source_name)
-            source_name = existing_source_name
-            version = existing_record['version'] if existing_record else None
-            previous_versions = existing_record['previous_versions'] + [
-                f"{source_name}-{version}"] if existing_record else []
+        logger.debug("Existing source name %s", existing_source_name)
     except Exception as e:
         traceback.print_exc()
-        return {
+        return None, {
             'statusCode': 400,
             'body': json.dumps(
                 {
@@ -225,8 +394,25 @@ def lambda_handler(event, context):
                 })
         }
 
+    return {
+        "metadata": metadata,
+        "original_submission": original_submission,
+        "organization_name": org_cannonical_name,
+        "organization": organization,
+        "submission_conf": submission_conf,
+        "title": submission_title,
+        # Without a source_name, this is a new dataset, with a new name
+        "existing_source_name": existing_source_name,
+        "source_name": existing_source_name or str(uuid.uuid4())
+    }, None
+
+
+def check_existing_record(submission, existing_record, user):
+    """The error response if the dataset's current version rules out this
+    submission, otherwise None."""
+    submission_conf = submission["submission_conf"]
     if existing_record and not any(
-            [uid == existing_record['user_id'] for uid in identities]):
+            [uid == existing_record['user_id'] for uid in user["identities"]]):
         return {
             'statusCode': 400,
             'body': json.dumps(
@@ -264,6 +450,20 @@ def lambda_handler(event, context):
                         "please resubmit with 'update=False'.")
                 })
         }
+    return None
+
+
+def build_submission(submission, existing_record, user):
+    """Give a prepared submission its version.
+
+    Returns:
+    tuple: The job that starts its flow, and its status record.
+    """
+    metadata = submission["metadata"]
+    submission_conf = submission["submission_conf"]
+    source_name = submission["source_name"]
+    is_test = submission_conf["test"]
+    version = existing_record['version'] if existing_record else None
 
     # Set appropriate metadata
     if not metadata.get("mdf"):
@@ -273,7 +473,7 @@ def lambda_handler(event, context):
     metadata["mdf"]["versioned_source_id"] = f"{source_name}-{version}"
     metadata["mdf"]["source_name"] = source_name
     metadata["mdf"]["version"] = version
-    metadata["mdf"]["domains"] = organization.domains
+    metadata["mdf"]["domains"] = submission["organization"].domains
     metadata["mdf"]["resource_type"] = "dataset"  # Force the resource type to make this findable in the portal
     metadata["mdf"]["ingest_date"] = datetime.utcnow().isoformat("T") + "Z"
 
@@ -299,56 +499,198 @@ def lambda_handler(event, context):
     status_info = {
         "source_id": source_name,
         "version": metadata["mdf"]["version"],
-        "previous_versions": previous_versions,
         "submission_time": datetime.utcnow().isoformat("T") + "Z",
-        "submitter": name,
-        "title": submission_title,
-        "user_id": user_id,
-        "user_email": user_email,
+        "submitter": user["name"],
+        "title": submission["title"],
+        "user_id": user["user_id"],
+        "user_email": user["user_email"],
         "acl": submission_conf["acl"],
         "test": submission_conf["test"],
-        "original_submission": json.dumps(md_copy),
+        "original_submission": submission["original_submission"],
+        "submission_schema": submission_schema_fingerprint(),
         "update_metadata_only": submission_conf["update_metadata_only"],
     }
 
-    print("status info", status_info)
+    # Only a pointer to the parent version is stored, so records stay the same
+    # size however many times a dataset is updated. The full lineage is available
+    # from DynamoManager.get_version_history
+    if existing_record:
+        status_info["previous_version"] = existing_record["version"]
 
-    automate_manager = AutomateManager(get_secret(secret_name=os.environ['MDF_SECRETS_NAME'],
-                                                  region_name=os.environ['MDF_AWS_REGION']), is_test)
-    automate_manager.authenticate()
+    log_payload(logger, "Status info", status_info)
 
+    job = {
+        "source_id": source_name,
+        "version": status_info["version"],
+        "metadata": metadata,
+        "organization": submission["organization_name"],
+        "submitting_user_token": user["globus_dependent_token"][os.environ["RUN_AS_SCOPE"]],
+        "user_id": user["user_id"],
+        "user_email": user["user_email"],
+        "search_index_uuid": (os.environ['SEARCH_INDEX_UUID'] if not is_test
+                              else os.environ['TEST_SEARCH_INDEX_UUID']),
+        "data_sources": submission_conf["data_sources"],
+        "is_test": is_test,
+        "update_metadata_only": submission_conf["update_metadata_only"]
+    }
+    return job, status_info
+
+
+def queued_job_body(job):
+    """The job, serialized for the submit queue, or None to start its flow here.
+
+    In queued mode the flow is started by the submit_worker function, so the
+    response doesn't wait on secrets, Globus Auth, or Flows. Jobs too large
+    for the queue are still started here.
+    """
+    if os.environ.get("SUBMIT_MODE", "sync") != "queued":
+        return None
+    job_body = json.dumps(job)
+    if len(job_body.encode("utf-8")) > MAX_MESSAGE_BYTES:
+        return None
+    return job_body
+
+
+def fallback_job_body(job):
+    """The job, serialized for the submit queue, to leave for the submit worker
+    while Flows is unavailable, or None if there is no queue to leave it on."""
+    if not os.environ.get("SUBMIT_QUEUE_URL"):
+        return None
+    job_body = json.dumps(job)
+    if len(job_body.encode("utf-8")) > MAX_MESSAGE_BYTES:
+        return None
+    return job_body
+
+
+def new_automate_manager(is_test):
+    with stage("get_secret"):
+        secret = get_secret(secret_name=os.environ['MDF_SECRETS_NAME'],
+                            region_name=os.environ['MDF_AWS_REGION'])
+    automate_manager = AutomateManager(secret, is_test)
+    with stage("authenticate"):
+        automate_manager.authenticate()
+    return automate_manager
+
+
+def submission_bucket(metadata):
+    """The admission bucket a submission is counted against."""
+    if isinstance(metadata, dict) and metadata.get("test"):
+        return "submit_test"
+    return "submit"
+
+
+def lookup_current_version(dynamo_manager, source_name):
+    """The current version of a dataset.
+
+    Returns:
+    tuple: The version's status record, or None if there isn't one, and None,
+           or None and the error response.
+    """
     try:
-        # Passes to submit with magic UUID that allows mdf admins to monitor flows in progress
-        action_id = automate_manager.submit(mdf_rec=metadata, organization=organization,
-                                            submitting_user_token=globus_dependent_token[
-                                                run_as_scope],
-                                            submitting_user_id=user_id,
-                                            submitting_user_email=user_email,
-                                            monitor_by_id=[
-                                                'urn:globus:auth:identity:' + user_id,
-                                                monitor_by_group],
-                                            search_index_uuid=search_index_uuid if not is_test else test_search_index_uuid,
-                                            data_sources=submission_conf['data_sources'],
-                                            is_test=is_test,
-                                            update_metadata_only=submission_conf[
-                                                'update_metadata_only'],
-                                            )
-        status_info['action_id'] = action_id
-
+        with stage("get_current_version"):
+            return dynamo_manager.get_current_version(source_name), None
+    except RetriesExhausted as e:
+        logger.error("Status lookup throttled: {}".format(e))
+        return None, busy_response(e)
     except Exception as e:
-        logger.error("Globus Automate Flow Submission exception: {}".format(e))
         traceback.print_exc()
-        return {
-            'statusCode': 500,
+        return None, {
+            'statusCode': 400,
             'body': json.dumps(
                 {
                     "success": False,
-                    "error": repr(e)
+                    "error": str(e)
                 })
         }
 
+
+def submit_dataset(event, context, dynamo_manager):
+    log_payload(logger, "Submit event", event)
+    with stage("authorizer"):
+        user = user_from_event(event)
+
+    access_token = event['headers']['authorization']
+
+    sourceid_manager = SourceIDManager()
+
+    group_err = check_group_membership(user)
+    if group_err:
+        return group_err
+
+    with stage("parse"):
+        metadata, parse_err = parse_submission_body(event['body'])
+    if parse_err:
+        return parse_err
+
+    # Test submissions have their own limit
+    with stage("admission"):
+        rejected = admit(event, dynamo_manager, submission_bucket(metadata))
+    if rejected:
+        return rejected
+
+    existing_record = None
+    update_of = updated_source_name(metadata)
+    if update_of:
+        existing_record, lookup_err = lookup_current_version(dynamo_manager, update_of)
+        if lookup_err:
+            return lookup_err
+
+    # The body is stored as sent, so it isn't copied or serialized again
+    submission, submission_err = prepare_submission(
+        metadata, user, event['body'], previous_submission(existing_record))
+    if submission_err:
+        return submission_err
+
+    if submission["existing_source_name"] and not update_of:
+        existing_record, lookup_err = lookup_current_version(dynamo_manager,
+                                                             submission["source_name"])
+        if lookup_err:
+            return lookup_err
+
+    existing_err = check_existing_record(submission, existing_record, user)
+    if existing_err:
+        return existing_err
+
+    job, status_info = build_submission(submission, existing_record, user)
+    source_name = status_info["source_id"]
+
+    job_body = queued_job_body(job)
+    if job_body:
+        status_info["queued"] = True
+    else:
+        try:
+            # Don't wait on secrets and Globus Auth for a flow that can't start
+            flows_breaker.check()
+            automate_manager = new_automate_manager(job["is_test"])
+            with stage("run_flow"):
+                status_info['action_id'] = launch_flow(automate_manager, job,
+                                                       submission["organization"],
+                                                       deadline_from_context(context))
+        except RetriesExhausted as e:
+            logger.warning("Globus Flows unavailable: {}".format(e))
+            # The submit worker starts the flow once Flows recovers
+            job_body = fallback_job_body(job)
+            if not job_body:
+                return busy_response(e, FLOWS_UNAVAILABLE)
+            status_info["queued"] = True
+        except Exception as e:
+            logger.error("Globus Automate Flow Submission exception: {}".format(e))
+            traceback.print_exc()
+            return {
+                'statusCode': 500,
+                'body': json.dumps(
+                    {
+                        "success": False,
+                        "error": repr(e)
+                    })
+            }
+
     try:
-        status_res = dynamo_manager.create_status(status_info)
+        with stage("create_status"):
+            status_res = dynamo_manager.create_status(status_info)
+    except RetriesExhausted as e:
+        logger.error("Status creation throttled: {}".format(e))
+        return busy_response(e)
     except Exception as e:
         logger.error("Status creation exception: {}".format(e))
         return {
@@ -367,6 +709,28 @@ def lambda_handler(event, context):
             'body': json.dumps(status_res)
         }
 
+    if job_body:
+        try:
+            with stage("queue"):
+                job_queue_from_env().send(job_body)
+        except Exception as e:
+            logger.error("Submission queueing exception: {}".format(e))
+            # Otherwise the record would wait for a flow that never starts
+            dynamo_manager.set_flow_state(source_name, status_info['version'], {
+                "status": "FAILED",
+                "details": {
+                    "description": "Unable to queue the submission"
+                }
+            })
+            return {
+                'statusCode': 500,
+                'body': json.dumps(
+                    {
+                        "success": False,
+                        "error": repr(e)
+                    })
+            }
+
     return {
         'statusCode': 202,
         'body': json.dumps(
@@ -376,3 +740,278 @@ def lambda_handler(event, context):
                 'version': status_info['version']
             })
     }
+
+
+def item_error(index, response):
+    """A bulk submission item's result, from the response it would have had
+    if submitted alone."""
+    return {
+        "index": index,
+        "success": False,
+        "status_code": response['statusCode'],
+        "error": json.loads(response['body'])["error"]
+    }
+
+
+def prepare_bulk_item(dynamo_manager, user, metadata):
+    """Check one item of a bulk submission, and look up the version it replaces.
+
+    Called from several threads at once.
+
+    Returns:
+    tuple: The prepared submission, the current version's status record or
+           None, and the error response or None.
+    """
+    submission, existing_record, item_err = None, None, None
+    update_of = updated_source_name(metadata)
+    if update_of:
+        existing_record, item_err = lookup_current_version(dynamo_manager, update_of)
+    if not item_err:
+        try:
+            submission, item_err = prepare_submission(
+                metadata, user, json.dumps(metadata), previous_submission(existing_record))
+        except Exception as e:
+            # One malformed item shouldn't cost the others their results
+            traceback.print_exc()
+            item_err = {
+                'statusCode': 400,
+                'body': json.dumps({"error": repr(e)})
+            }
+    if not item_err and submission["existing_source_name"] and not update_of:
+        existing_record, item_err = lookup_current_version(dynamo_manager,
+                                                           submission["source_name"])
+    return submission, existing_record, item_err
+
+
+def submit_bulk(event, context, dynamo_manager):
+    """Submit many datasets in one request.
+
+    The body is {"submissions": [...]}, each submission as POST /submit takes
+    it. Each item succeeds or fails on its own, and the response lists the
+    result of each, in order. Items are checked, and the versions they
+    replace looked up, by BULK_LAUNCH_WORKERS threads. Every new version is
+    written in one transaction, and the flows are started by the same number
+    of threads, or queued for the submit worker in queued mode.
+    """
+    with stage("authorizer"):
+        user = user_from_event(event)
+
+    group_err = check_group_membership(user)
+    if group_err:
+        return group_err
+
+    with stage("parse"):
+        body, parse_err = parse_submission_body(event['body'])
+    if parse_err:
+        return parse_err
+    try:
+        submissions = body["submissions"]
+        assert isinstance(submissions, list) and submissions
+    except Exception as e:
+        return {
+            'statusCode': 400,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": "Body must be JSON with a list of submissions"
+                })
+        }
+    max_items = int(os.environ.get("BULK_SUBMIT_MAX_ITEMS", 25))
+    if len(submissions) > max_items:
+        return {
+            'statusCode': 400,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": "At most {} submissions may be made at once".format(max_items)
+                })
+        }
+
+    # Each item takes a token, from the test or production bucket
+    buckets = [submission_bucket(metadata) for metadata in submissions]
+    with stage("admission"):
+        for bucket in sorted(set(buckets)):
+            rejected = admit(event, dynamo_manager, bucket, cost=buckets.count(bucket))
+            if rejected:
+                return rejected
+
+    # Looking up current versions is mostly waiting on Dynamo, so the items
+    # are prepared at the same time
+    workers = int(os.environ.get("BULK_LAUNCH_WORKERS", 4))
+    with stage("prepare"), ThreadPoolExecutor(max_workers=workers) as executor:
+        prepared = list(executor.map(
+            lambda metadata: prepare_bulk_item(dynamo_manager, user, metadata), submissions))
+
+    results = [None] * len(submissions)
+    # The jobs to start, by index, with their status records
+    accepted = {}
+    for index, (submission, existing_record, item_err) in enumerate(prepared):
+        if not item_err and any(job["source_id"] == submission["source_name"]
+                                for job, _ in accepted.values()):
+            item_err = {
+                'statusCode': 400,
+                'body': json.dumps({
+                    "error": "Only one version of a dataset may be submitted at once"
+                })
+            }
+        if not item_err:
+            item_err = check_existing_record(submission, existing_record, user)
+
+        if not item_err:
+            accepted[index] = build_submission(submission, existing_record, user)
+        elif item_err['statusCode'] == 503:
+            # The status table is throttled, so the other items would be too
+            return item_err
+        else:
+            results[index] = item_error(index, item_err)
+
+    # Records start out queued, and the flow runs are recorded as they start
+    for job, status_info in accepted.values():
+        status_info["queued"] = True
+    try:
+        with stage("create_status"):
+            status_results = dynamo_manager.create_statuses(
+                [status_info for _, status_info in accepted.values()])
+    except RetriesExhausted as e:
+        logger.error("Status creation throttled: {}".format(e))
+        return busy_response(e)
+    except Exception as e:
+        logger.error("Status creation exception: {}".format(e))
+        return {
+            'statusCode': 500,
+            'body': json.dumps(
+                {
+                    "success": False,
+                    "error": repr(e)
+                })
+        }
+
+    to_launch = {}
+    for (index, (job, status_info)), status_res in zip(list(accepted.items()), status_results):
+        if not status_res["success"]:
+            logger.error("Status creation error: {}".format(status_res["error"]))
+            results[index] = {
+                "index": index,
+                "success": False,
+                "status_code": 409 if "already exists" in status_res["error"] else 500,
+                "error": status_res["error"]
+            }
+            continue
+
+        job_body = queued_job_body(job)
+        if not job_body:
+            to_launch[index] = job
+            continue
+        try:
+            with stage("queue"):
+                job_queue_from_env().send(job_body)
+        except Exception as e:
+            logger.error("Submission queueing exception: {}".format(e))
+            dynamo_manager.set_flow_state(job["source_id"], job["version"], {
+                "status": "FAILED",
+                "details": {
+                    "description": "Unable to queue the submission"
+                }
+            })
+            results[index] = item_error(index, {
+                'statusCode': 500,
+                'body': json.dumps({"error": repr(e)})
+            })
+            continue
+        results[index] = {
+            "index": index,
+            "success": True,
+            "source_id": job["source_id"],
+            "version": job["version"]
+        }
+
+    if to_launch:
+        try:
+            flows_breaker.check()
+            unavailable = None
+        except RetriesExhausted as e:
+            unavailable = e
+
+        if unavailable:
+            launches = [(None, unavailable)] * len(to_launch)
+        else:
+            # The records are already queued, so a manager that can't be made
+            # fails its jobs like a launch would, rather than the whole request
+            automate_managers = {}
+            for job in to_launch.values():
+                if job["is_test"] not in automate_managers:
+                    try:
+                        automate_managers[job["is_test"]] = new_automate_manager(job["is_test"])
+                    except Exception as e:
+                        logger.error("Globus authentication exception: {}".format(e))
+                        automate_managers[job["is_test"]] = e
+            deadline = deadline_from_context(context)
+
+            def launch(job):
+                automate_manager = automate_managers[job["is_test"]]
+                if isinstance(automate_manager, Exception):
+                    return None, automate_manager
+                try:
+                    return launch_flow(automate_manager, job, deadline=deadline), None
+                except Exception as e:
+                    logger.error("Globus Automate Flow Submission exception: {}".format(e))
+                    return None, e
+
+            # Starting a flow is mostly waiting on Globus, so the launches overlap
+            with stage("run_flow"), ThreadPoolExecutor(max_workers=workers) as executor:
+                launches = list(executor.map(launch, to_launch.values()))
+
+        # Dynamo calls stay on this thread
+        for (index, job), (action_id, error) in zip(to_launch.items(), launches):
+            job_body = fallback_job_body(job) if isinstance(error, RetriesExhausted) else None
+            if job_body:
+                # The record is already queued, so the submit worker can take over
+                try:
+                    with stage("queue"):
+                        job_queue_from_env().send(job_body)
+                except Exception as e:
+                    logger.error("Submission queueing exception: {}".format(e))
+                    job_body = None
+            if error is None:
+                try:
+                    res = dynamo_manager.set_action_id(job["source_id"], job["version"],
+                                                       action_id)
+                except Exception as e:
+                    # The flow has started, so the item is still accepted
+                    res = {
+                        "success": False,
+                        "error": repr(e)
+                    }
+                if not res["success"]:
+                    logger.error("Flow run {} for {}-{} not recorded: {}".format(
+                        action_id, job["source_id"], job["version"], res["error"]))
+            if error is None or job_body:
+                results[index] = {
+                    "index": index,
+                    "success": True,
+                    "source_id": job["source_id"],
+                    "version": job["version"]
+                }
+            else:
+                dynamo_manager.set_flow_state(job["source_id"], job["version"], {
+                    "status": "FAILED",
+                    "details": {
+                        "description": "Unable to start the flow: {}".format(error)
+                    }
+                })
+                if isinstance(error, RetriesExhausted):
+                    results[index] = item_error(index, busy_response(error, FLOWS_UNAVAILABLE))
+                else:
+                    results[index] = item_error(index, {
+                        'statusCode': 500,
+                        'body': json.dumps({"error": repr(error)})
+                    })
+
+    return {
+        'statusCode': 202 if all(result["success"] for result in results) else 207,
+        'body': json.dumps(
+            {
+                "success": any(result["success"] for result in results),
+                "results": results
+            })
+    }
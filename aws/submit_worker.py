@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+import time
+
+from globus_sdk import GlobusAPIError
+
+from automate_manager import AutomateManager
+from dynamo_manager import DynamoManager
+from globus_automate_flow import is_unstarted_run_error
+from organization import OrganizationException
+from retry import RetriesExhausted, TokenBucket, deadline_from_context
+from submit import launch_flow
+from utils import get_secret
+
+logger = logging.getLogger(__name__)
+
+# Shared by every batch in the process, so a warm worker keeps to the launch
+# rate across invocations, and slows down when Flows throttles it
+launch_limiter = TokenBucket(float(os.environ.get("FLOW_LAUNCH_RATE", 5)))
+
+# Authenticated managers, by is_test, with the time they were authenticated
+automate_managers = {}
+
+
+def lambda_handler(event, context):
+    """Start the flows of queued submissions, a batch of SQS messages at a time."""
+    dynamo_manager = DynamoManager(handler="submit_worker", context=context)
+    try:
+        return launch_flows(event, context, dynamo_manager)
+    finally:
+        dynamo_manager.emit_metrics()
+
+
+def get_automate_manager(is_test):
+    """An authenticated manager, reused between batches until it is
+    FLOW_CLIENT_MAX_AGE seconds old, well before its tokens expire."""
+    max_age = float(os.environ.get("FLOW_CLIENT_MAX_AGE", 3600))
+    cached = automate_managers.get(is_test)
+    if cached and time.monotonic() - cached[1] < max_age:
+        return cached[0]
+    automate_manager = AutomateManager(get_secret(secret_name=os.environ['MDF_SECRETS_NAME'],
+                                                  region_name=os.environ['MDF_AWS_REGION']),
+                                       is_test)
+    automate_manager.authenticate()
+    automate_managers[is_test] = (automate_manager, time.monotonic())
+    return automate_manager
+
+
+def fail_submission(dynamo_manager, job, reason):
+    """Give up on a job, recording why on its status record."""
+    logger.error("Unable to start the flow for {}-{}: {}".format(
+        job["source_id"], job["version"], reason))
+    dynamo_manager.set_flow_state(job["source_id"], job["version"], {
+        "status": "FAILED",
+        "details": {
+            "description": "Unable to start the flow: {}".format(reason)
+        }
+    })
+
+
+def retry_later(dynamo_manager, job, reason):
+    """Give back the launch of a job that started no run, for its next delivery."""
+    logger.warning("Flow launch for {}-{} will be retried: {}".format(
+        job["source_id"], job["version"], reason))
+    dynamo_manager.release_launch(job["source_id"], job["version"])
+    return False
+
+
+def launch_job(job, dynamo_manager, deadline=None):
+    """Start the flow for one queued submission.
+
+    Returns:
+    bool: False if the job should be tried again later.
+    """
+    # SQS may deliver a job more than once, even to two workers at once, so
+    # the launch is claimed on the status record first
+    record = dynamo_manager.claim_launch(job["source_id"], job["version"])
+    if record is not None:
+        if not record:
+            logger.error("No status record for queued submission {}-{}".format(
+                job["source_id"], job["version"]))
+            return True
+        if record.get("action_id") or record.get("flow_state"):
+            return True
+        # Another delivery is starting the run, unless its worker timed out
+        # part way, which leaves a claim older than the worker's timeout
+        claim_age = time.time() - float(record["launching_since"])
+        if claim_age < float(os.environ.get("FLOW_LAUNCH_CLAIM_TIMEOUT", 120)):
+            return False
+        fail_submission(dynamo_manager, job,
+                        "the flow may have started, contact MDF support before "
+                        "resubmitting: the launch was interrupted")
+        return True
+
+    try:
+        automate_manager = get_automate_manager(job["is_test"])
+    except Exception as e:
+        # No run can have started yet
+        return retry_later(dynamo_manager, job, repr(e))
+
+    try:
+        action_id = launch_flow(automate_manager, job, deadline=deadline)
+    except (OrganizationException, ValueError, AssertionError) as e:
+        # Problems with the submission itself won't go away on a retry
+        fail_submission(dynamo_manager, job, str(e))
+        return True
+    except RetriesExhausted as e:
+        # Only failures that mean the run was not started are retried, and
+        # an open circuit makes no call at all
+        launch_limiter.on_throttle()
+        return retry_later(dynamo_manager, job, e)
+    except Exception as e:
+        if is_unstarted_run_error(e):
+            launch_limiter.on_throttle()
+            return retry_later(dynamo_manager, job, repr(e))
+        if isinstance(e, GlobusAPIError) and e.http_status < 500:
+            fail_submission(dynamo_manager, job, e.message)
+            return True
+        # Other server errors and timeouts can come after the run started, and
+        # a retry could start a second run, so the submission needs checking
+        fail_submission(dynamo_manager, job,
+                        "the flow may have started, contact MDF support before "
+                        "resubmitting: {}".format(repr(e)))
+        return True
+    launch_limiter.on_success()
+
+    try:
+        res = dynamo_manager.set_action_id(job["source_id"], job["version"], action_id)
+    except Exception as e:
+        # Not retried, as that would start a second run
+        res = {
+            "success": False,
+            "error": repr(e)
+        }
+    if not res["success"]:
+        logger.error("Flow run {} for {}-{} not recorded: {}".format(
+            action_id, job["source_id"], job["version"], res["error"]))
+    return True
+
+
+def launch_flows(event, context, dynamo_manager):
+    """Messages that are not done are reported back to SQS, which delivers
+    them again after their visibility timeout."""
+    deadline = deadline_from_context(context)
+    failures = []
+    for record in event["Records"]:
+        job = json.loads(record["body"])
+        done = False
+        if launch_limiter.acquire(deadline=deadline):
+            try:
+                done = launch_job(job, dynamo_manager, deadline)
+            except RetriesExhausted as e:
+                logger.warning("Status update throttled: {}".format(e))
+        if not done:
+            failures.append({"itemIdentifier": record["messageId"]})
+
+    return {
+        "batchItemFailures": failures
+    }
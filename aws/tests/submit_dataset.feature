@@ -8,7 +8,7 @@ Feature: Submit Dataset
 
         Then a dynamo record should be created with the generated uuid
         And the dynamo record should be version 1.0
-        And the previous_versions field should be empty
+        And the previous_version field should be empty
         And an automate flow started
         And the data destination should be the Petrel MDF directory
         And the search subject should be the uuid with the version
@@ -45,6 +45,14 @@ Feature: Submit Dataset
         When I submit the dataset
         Then I should receive a failure result
 
+    Scenario: Attempt to submit a dataset containing NaN
+        Given I'm authenticated with MDF
+        And I have a new MDF dataset to submit
+        And the submission contains NaN
+        When I submit the dataset
+        Then I should receive a failure result
+        And no dynamo record should be created
+
     Scenario: Attempt to update another users record
         Given I'm authenticated with MDF
         And I have an update to another users record
@@ -64,7 +72,7 @@ Feature: Submit Dataset
 
         Then a dynamo record should be created with the original source_id
         And the dynamo record should be version 1.1
-        And the previous_versions field should be ['my dataset-1.0']
+        And the previous_version field should be 1.0
         And an automate flow started
         And I should receive a success result with the generated uuid and version 1.1
 
@@ -102,4 +110,14 @@ Feature: Submit Dataset
         Given I'm authenticated with MDF
         And I have a new MDF dataset to submit for an organization that does not exist
         When I submit the dataset
-        Then I should receive a failure result
\ No newline at end of file
+        Then I should receive a failure result
+    Scenario: Queue a submission for the submit worker
+        Given I'm authenticated with MDF
+        And I have a new MDF dataset to submit
+        And submissions are queued
+        When I submit the dataset
+
+        Then a queued dynamo record should be created
+        And no automate flow started
+        And the submission should be queued for the submit worker
+        And I should receive a success result with the generated uuid and version 1.0
@@ -0,0 +1,74 @@
+import json
+import os
+
+from admission import LocalBuckets, admit
+from status import lambda_handler
+
+
+def request(user_id="my-id"):
+    return {
+        "httpMethod": "POST",
+        "requestContext": {"authorizer": {"user_id": user_id}},
+        "body": json.dumps({"submissions": [{"source_id": "abc", "version": "1.0"}]})
+    }
+
+
+class TestAdmission:
+    def test_local_buckets(self, mocker):
+        mocker.patch.dict(os.environ, {"ADMISSION_MODE": "local",
+                                       "ADMISSION_SUBMIT_RATE": "0.5",
+                                       "ADMISSION_SUBMIT_BURST": "3"})
+        mocker.patch("admission.local_buckets", LocalBuckets())
+        clock = mocker.patch("admission.time.time", return_value=1000.0)
+
+        assert admit(request(), None, "submit", cost=2) is None
+        assert admit(request(), None, "submit") is None
+        rejected = admit(request(), None, "submit")
+        assert rejected['statusCode'] == 429
+        assert rejected['headers']['Retry-After'] == "2"
+        # Other users, and the user's test submissions, have their own buckets
+        assert admit(request("other-id"), None, "submit") is None
+        assert admit(request(), None, "submit_test") is None
+
+        # A token is added every two seconds
+        clock.return_value = 1002.0
+        assert admit(request(), None, "submit") is None
+        assert admit(request(), None, "submit")['statusCode'] == 429
+        # More tokens than the bucket holds can never be taken, so there is
+        # no point in retrying
+        clock.return_value = 2000.0
+        rejected = admit(request(), None, "submit", cost=4)
+        assert rejected['statusCode'] == 413
+        assert 'headers' not in rejected
+        assert "limit of 3 at once" in json.loads(rejected['body'])['error']
+        assert admit(request(), None, "submit", cost=3) is None
+
+    def test_dynamo_buckets(self, mocker):
+        mocker.patch.dict(os.environ, {"ADMISSION_MODE": "dynamo"})
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.take_rate_tokens = mocker.Mock(side_effect=[0, 12.5, ValueError()])
+
+        assert admit(request(), dynamo_manager, "status") is None
+        assert dynamo_manager.take_rate_tokens.call_args[0][0] == "status:my-id"
+        assert dynamo_manager.take_rate_tokens.call_args[0][2:] == (0.1, 100, 1)
+        assert admit(request(), dynamo_manager, "status")['headers']['Retry-After'] == "13"
+        # An unavailable table doesn't keep everyone out
+        assert admit(request(), dynamo_manager, "status") is None
+
+        os.environ["ADMISSION_MODE"] = "off"
+        assert admit(request(), dynamo_manager, "status") is None
+        assert dynamo_manager.take_rate_tokens.call_count == 3
+
+    def test_status_rejected(self, mocker):
+        mocker.patch.dict(os.environ, {"ADMISSION_MODE": "local",
+                                       "ADMISSION_STATUS_BURST": "1"})
+        mocker.patch("admission.local_buckets", LocalBuckets())
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.batch_read_status_records = mocker.Mock(return_value={})
+        mocker.patch("status.DynamoManager", return_value=dynamo_manager)
+
+        assert lambda_handler(request(), None)['statusCode'] == 200
+        result = lambda_handler(request(), None)
+        assert result['statusCode'] == 429
+        assert int(result['headers']['Retry-After']) >= 1
+        dynamo_manager.batch_read_status_records.assert_called_once()
@@ -0,0 +1,74 @@
+import base64
+import gzip
+import json
+from decimal import Decimal
+
+import brotli
+
+from api_responses import FLOWS_UNAVAILABLE, busy_response, dumps, json_response
+from retry import RetriesExhausted
+
+
+class TestApiResponses:
+    def test_dumps_decimal(self):
+        assert json.loads(dumps({"count": Decimal("3"), "size": Decimal("1.5"),
+                                 "tags": {"b", "a"}})) == \
+            {"count": 3, "size": 1.5, "tags": ["a", "b"]}
+
+    def test_uncompressed(self):
+        result = json_response({"headers": {}}, 200, {"submissions": ["x"] * 1000})
+        assert result['statusCode'] == 200
+        assert 'isBase64Encoded' not in result
+        assert "content-encoding" not in result['headers']
+        assert json.loads(result['body']) == {"submissions": ["x"] * 1000}
+
+    def test_gzip(self):
+        body = {"submissions": ["x"] * 1000}
+        result = json_response({"headers": {"Accept-Encoding": "gzip, deflate"}}, 200, body)
+        assert result['isBase64Encoded']
+        assert result['headers']['content-encoding'] == "gzip"
+        assert result['headers']['vary'] == "Accept-Encoding"
+        assert json.loads(gzip.decompress(base64.b64decode(result['body']))) == body
+
+    def test_brotli_preferred(self):
+        body = {"submissions": ["x"] * 1000}
+        result = json_response({"headers": {"accept-encoding": "gzip, br"}}, 200, body)
+        assert result['headers']['content-encoding'] == "br"
+        assert json.loads(brotli.decompress(base64.b64decode(result['body']))) == body
+
+        result = json_response({"headers": {"accept-encoding": "gzip, br;q=0"}}, 200, body)
+        assert result['headers']['content-encoding'] == "gzip"
+
+    def test_small_body_not_compressed(self):
+        result = json_response({"headers": {"accept-encoding": "gzip"}}, 200, {"ok": True})
+        assert "content-encoding" not in result['headers']
+        assert json.loads(result['body']) == {"ok": True}
+
+    def test_truncated(self, mocker):
+        mocker.patch("api_responses.MAX_RESPONSE_BYTES", 2000)
+        items = ["{:04d}".format(i) * 10 for i in range(100)]
+        result = json_response({"headers": {}}, 200, {"submissions": items},
+                               page_key="submissions", offset=40)
+        assert len(result['body']) <= 2000
+        body = json.loads(result['body'])
+        assert body['truncated']
+        kept = len(body['submissions'])
+        assert 0 < kept < 100
+        assert body['submissions'] == items[:kept]
+        assert body['next_offset'] == 40 + kept
+
+    def test_too_large(self, mocker):
+        mocker.patch("api_responses.MAX_RESPONSE_BYTES", 100)
+        result = json_response({"headers": {}}, 200, {"submission": "x" * 1000})
+        assert result['statusCode'] == 500
+
+    def test_busy_response(self):
+        result = busy_response(RetriesExhausted("throttled", retry_after=3))
+        assert result['statusCode'] == 503
+        assert result['headers'] == {'Retry-After': "3"}
+        assert json.loads(result['body']) == {
+            "success": False, "error": "The status database is busy, please retry"}
+
+        result = busy_response(RetriesExhausted("down"), FLOWS_UNAVAILABLE)
+        assert result['headers'] == {'Retry-After': "1"}
+        assert json.loads(result['body'])['error'] == FLOWS_UNAVAILABLE
@@ -1,7 +1,12 @@
+import itertools
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
 from unittest import mock
 
 import pytest
+from globus_sdk import GlobusAPIError, GlobusTimeoutError
 
 from automate_manager import AutomateManager
 from organization import Organization
@@ -251,3 +256,172 @@ class TestAutomateManager:
         mock_flow.run_flow.assert_called()
         assert(mock_flow.run_flow.call_args[0][0]['mdf_portal_link'] == "https://acdc.alcf.anl.gov/mdf/detail/123-456-7890-1.0.1")
 
+
+    @mock.patch('automate_manager.GlobusAutomateFlow', autospec=True)
+    def test_get_statuses(self, mock_automate, secrets, mocker, set_environ):
+        flow = mocker.Mock()
+        deadlines = {}
+        finished = []
+
+        def get_status(action_id, deadline=None):
+            deadlines[action_id] = deadline
+            if action_id == "slow":
+                # The status client's HTTP timeout ends the request
+                time.sleep(float(os.environ["FLOW_STATUS_TIMEOUT"]))
+                finished.append(action_id)
+                raise GlobusTimeoutError("timed out", TimeoutError())
+            if action_id == "missing":
+                raise GlobusAPIError.__new__(GlobusAPIError)
+            return {"status": "ACTIVE", "action_id": action_id}
+
+        flow.get_status = mocker.Mock(side_effect=get_status)
+        mock_automate.from_existing_flow = mocker.Mock(return_value=flow)
+        manager = AutomateManager(secrets, is_test=False)
+
+        os.environ["FLOW_STATUS_TIMEOUT"] = "0.2"
+        try:
+            started = time.monotonic()
+            statuses = manager.get_statuses(["a", "b", "slow", "missing"])
+        finally:
+            del os.environ["FLOW_STATUS_TIMEOUT"]
+
+        assert statuses["a"]["status"] == "ACTIVE"
+        assert statuses["b"]["action_id"] == "b"
+        assert statuses["slow"]["status"] == "UNKNOWN"
+        assert statuses["slow"]["details"]["description"] == "Flow status timed out"
+        assert statuses["missing"]["details"]["description"] == "Flow not found"
+        # Each lookup has its own timeout, and none is still running afterwards
+        assert finished == ["slow"]
+        assert all(started < d <= started + 0.2 + 0.1 for d in deadlines.values())
+
+        # Lookups that start after the caller's deadline don't call Globus
+        flow.get_status.reset_mock()
+        statuses = manager.get_statuses(["c"], deadline=time.monotonic() - 1)
+        assert statuses["c"]["details"]["description"] == "Flow status timed out"
+        flow.get_status.assert_not_called()
+
+        # Nor do lookups that couldn't finish by it, so the batch ends in time
+        os.environ["FLOW_STATUS_TIMEOUT"] = "0.2"
+        os.environ["FLOW_STATUS_WORKERS"] = "1"
+        try:
+            started = time.monotonic()
+            deadline = started + 0.3
+            statuses = manager.get_statuses(["slow", "d"], deadline=deadline)
+        finally:
+            del os.environ["FLOW_STATUS_TIMEOUT"]
+            del os.environ["FLOW_STATUS_WORKERS"]
+        assert time.monotonic() < deadline
+        # Retries of the first lookup stop while a whole request still fits
+        assert deadlines["slow"] == pytest.approx(deadline - 0.2)
+        assert statuses["d"]["details"]["description"] == "Flow status timed out"
+        assert [c[0][0] for c in flow.get_status.call_args_list] == ["slow"]
+        assert manager.get_statuses([]) == {}
+
+    @mock.patch('automate_manager.GlobusAutomateFlow', autospec=True)
+    def test_get_statuses_from_run_listing(self, mock_automate, secrets, mocker, set_environ):
+        flow = mocker.Mock()
+        flow.list_runs = mocker.Mock(return_value={
+            "run-{}".format(i): {"status": "ACTIVE", "details": {"description": "Running"}}
+            for i in range(15)
+        })
+        flow.get_status = mocker.Mock(return_value={"status": "SUCCEEDED"})
+        mock_automate.from_existing_flow = mocker.Mock(return_value=flow)
+        manager = AutomateManager(secrets, is_test=False)
+
+        os.environ["FLOW_RUN_LISTING_THRESHOLD"] = "10"
+        try:
+            statuses = manager.get_statuses(["run-{}".format(i) for i in range(12)]
+                                            + ["finished"])
+        finally:
+            del os.environ["FLOW_RUN_LISTING_THRESHOLD"]
+
+        flow.list_runs.assert_called_once()
+        assert flow.list_runs.call_args[1]['statuses'] == ["ACTIVE", "INACTIVE"]
+        # Only the run that was not in progress needs its own status call
+        flow.get_status.assert_called_once_with("finished", deadline=mock.ANY)
+        assert len(statuses) == 13
+        assert statuses["run-3"]["status"] == "ACTIVE"
+        assert statuses["finished"]["status"] == "SUCCEEDED"
+
+    def test_concurrent_launches(self, secrets, organization, mocker, mdf_rec, set_environ,
+                                 monkeypatch, tmp_path):
+        # Without an mdf_flow_info.json in the working directory, the flow
+        # comes from FLOW_ID and FLOW_SCOPE, wherever the tests are run from
+        monkeypatch.chdir(tmp_path)
+        os.environ['PORTAL_URL'] = "https://acdc.alcf.anl.gov/mdf/detail/"
+        issued = itertools.count()
+
+        def auth_client(client_id, client_secret):
+            # Every authentication gets new tokens, marked with the manager's client
+            def credentials_tokens(requested_scopes):
+                n = next(issued)
+                return mocker.Mock(by_resource_server={
+                    "flows.globus.org": {"access_token": "manage-{}".format(n),
+                                         "expires_at_seconds": 0},
+                    "flow-id-1": {"access_token": "{}-run-{}".format(client_id, n)}
+                })
+            return mocker.Mock(oauth2_client_credentials_tokens=credentials_tokens)
+
+        runs = []
+
+        class FakeFlowsClient:
+            """Starts runs with the token its authorizer callback gives, as
+            FlowsClient does."""
+            def __init__(self, authorizer_callback):
+                self.authorizer_callback = authorizer_callback
+                self.transport = mocker.Mock()
+
+            def run_flow(self, flow_id, flow_scope, flow_input, label=None, **kwargs):
+                authorizer = self.authorizer_callback(flow_url="/flows/" + flow_id,
+                                                      flow_scope=flow_scope,
+                                                      client_id="55-321")
+                # Give other threads a chance to authenticate in between
+                time.sleep(0.001)
+                runs.append((label, authorizer.access_token))
+                return mocker.Mock(data={"action_id": label})
+
+        mocker.patch("automate_manager.globus_sdk.ConfidentialAppAuthClient",
+                     side_effect=auth_client)
+        mocker.patch("automate_manager.ClientCredentialsAuthorizer")
+        mocker.patch("automate_manager.FlowsClient.new_client",
+                     side_effect=lambda client_id, authorizer_callback, authorizer, **kwargs:
+                     FakeFlowsClient(authorizer_callback))
+
+        managers = []
+        for i in range(4):
+            manager = AutomateManager(dict(secrets, API_CLIENT_ID="client-{}".format(i)),
+                                      is_test=bool(i % 2))
+            manager.authenticate()
+            managers.append(manager)
+
+        def launch(n):
+            i = n % len(managers)
+            rec = deepcopy(mdf_rec)
+            rec["mdf"]["source_id"] = "client-{}-{}".format(i, n)
+            return managers[i].submit(
+                mdf_rec=rec, organization=organization,
+                submitting_user_token={'access_token': '1234567890'},
+                submitting_user_id="12-33-55", monitor_by_id=["12-33-55"],
+                submitting_user_email="foo@bar.com", search_index_uuid="098-765-4321",
+                data_sources=["https://app.globus.org/file-manager?origin_id=e38ee745-6d04-11e5-ba46-22000b92c6ec&origin_path=%2Fdataset%2F"],
+                is_test=False)
+
+        def churn():
+            # Managers authenticating again, and new ones being made, while
+            # flows are launched
+            for n in range(50):
+                managers[n % len(managers)].authenticate()
+                AutomateManager(secrets).authenticate()
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            churning = executor.submit(churn)
+            action_ids = list(executor.map(launch, range(200)))
+            churning.result()
+
+        assert len(runs) == 200
+        assert sorted(action_ids) == sorted(label for label, _ in runs)
+        # Every run used a token of the manager that started it
+        for label, token in runs:
+            source_id = label[len("MDF Submission "):]
+            client_id = source_id.rsplit("-", 1)[0]
+            assert token.startswith(client_id + "-run-")
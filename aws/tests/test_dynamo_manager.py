@@ -1,6 +1,12 @@
+import json
 import os
+
+import pytest
 from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from admission import LocalBuckets
 from dynamo_manager import DynamoManager
+from retry import RetriesExhausted, TokenBucket
 
 
 class TestDynamoManager:
@@ -27,6 +33,8 @@ class TestDynamoManager:
         }
 
         mock_table.query = mocker.Mock(side_effect=[batch1, batch2])
+        mock_table.get_item = mocker.Mock(
+            side_effect=lambda **kwargs: {"Item": dict(kwargs['Key'], title="Latest")})
         mock_boto = mocker.patch('dynamo_manager.boto3')
         mock_boto.resource = mocker.Mock(return_value=mock_dynamo)
 
@@ -35,6 +43,8 @@ class TestDynamoManager:
         dynamo_manager = DynamoManager()
         record = dynamo_manager.get_current_version("test_submission")
         assert record['version'] == '1.13'
+        assert record['title'] == 'Latest'
+        mock_table.get_item.assert_called_once()
 
         query_calls = mock_table.query.call_args_list
         assert len(query_calls) == 2
@@ -43,6 +53,8 @@ class TestDynamoManager:
         assert query_calls[1][1]['ExclusiveStartKey'] == '3'
         assert query_calls[0][1]['KeyConditionExpression'] == Key('source_id').eq(
             'test_submission')
+        # Only the version numbers are read while looking for the latest
+        assert query_calls[0][1]['ExpressionAttributeNames'] == {'#v': 'version'}
 
     def test_get_current_version_not_exist(self, mocker):
         mock_dynamo = mocker.Mock()
@@ -70,3 +82,444 @@ class TestDynamoManager:
         assert DynamoManager.increment_record_version("1.12") == "1.13"
         assert not DynamoManager.increment_record_version("1")
         assert DynamoManager.increment_record_version(None) == '1.0'
+
+    def test_read_consistency_policy(self):
+        policy = DynamoManager.load_read_consistency(None)
+        assert policy['submit'] == 'strong'
+        assert policy['listing'] == 'eventual'
+
+        policy = DynamoManager.load_read_consistency("status=eventual, export=strong")
+        assert policy['status'] == 'eventual'
+        assert policy['export'] == 'strong'
+        assert policy['submit'] == 'strong'
+
+        policy = DynamoManager.load_read_consistency("strong")
+        assert all(level == 'strong' for level in policy.values())
+
+        with pytest.raises(ValueError):
+            DynamoManager.load_read_consistency("status=sometimes")
+
+    def test_scan_table_eventual_read(self, mocker):
+        mock_dynamo = mocker.Mock()
+        mock_table = mocker.Mock()
+        mock_table.table_status = "ACTIVE"
+        mock_dynamo.Table = mocker.Mock(return_value=mock_table)
+        mock_table.scan = mocker.Mock(return_value={
+            "Items": [{"source_id": "abc", "version": "1.0"}],
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+            "ConsumedCapacity": {"TableName": "test_table", "CapacityUnits": 2.5}
+        })
+        mock_boto = mocker.patch('dynamo_manager.boto3')
+        mock_boto.resource = mocker.Mock(return_value=mock_dynamo)
+
+        os.environ["DYNAMO_STATUS_TABLE"] = 'test_table'
+        dynamo_manager = DynamoManager()
+        scan_res = dynamo_manager.scan_table("status", filters=[("user_id", "==", "me")])
+        assert scan_res['success']
+        scan_args = mock_table.scan.call_args[1]
+        assert not scan_args['ConsistentRead']
+        assert scan_args['ReturnConsumedCapacity'] == 'TOTAL'
+        assert dynamo_manager.capacity_report()['read_capacity_saved'] == 2.5
+
+        # Submit path existence checks stay strongly consistent
+        dynamo_manager.scan_table("status", call_site="submit")
+        scan_args = mock_table.scan.call_args[1]
+        assert scan_args['ConsistentRead']
+        assert dynamo_manager.capacity_report()['read_capacity_saved'] == 2.5
+
+    def test_scan_table_projection(self, mocker):
+        mock_dynamo = mocker.Mock()
+        mock_table = mocker.Mock()
+        mock_table.table_status = "ACTIVE"
+        mock_dynamo.Table = mocker.Mock(return_value=mock_table)
+        mock_table.scan = mocker.Mock(return_value={
+            "Items": [],
+            "ResponseMetadata": {"HTTPStatusCode": 200}
+        })
+        mock_boto = mocker.patch('dynamo_manager.boto3')
+        mock_boto.resource = mocker.Mock(return_value=mock_dynamo)
+
+        os.environ["DYNAMO_STATUS_TABLE"] = 'test_table'
+        dynamo_manager = DynamoManager()
+        dynamo_manager.scan_table("status", fields=["source_id", "version", "test"])
+        scan_args = mock_table.scan.call_args[1]
+        # Every name is aliased, since some attribute names are reserved words
+        assert scan_args['ProjectionExpression'] == "#source_id, #version, #test"
+        assert scan_args['ExpressionAttributeNames'] == {
+            "#source_id": "source_id", "#version": "version", "#test": "test"}
+
+    def test_consumed_capacity_metrics(self, mocker, capsys):
+        mock_dynamo = mocker.Mock()
+        mock_table = mocker.Mock()
+        mock_table.table_status = "ACTIVE"
+        mock_dynamo.Table = mocker.Mock(return_value=mock_table)
+        mock_table.get_item = mocker.Mock(return_value={
+            "ConsumedCapacity": {"TableName": "test_table", "CapacityUnits": 1.0}
+        })
+        mock_table.put_item = mocker.Mock(return_value={
+            "ConsumedCapacity": {"TableName": "test_table", "CapacityUnits": 3.0}
+        })
+        mock_boto = mocker.patch('dynamo_manager.boto3')
+        mock_boto.resource = mocker.Mock(return_value=mock_dynamo)
+
+        os.environ["DYNAMO_STATUS_TABLE"] = 'test_table'
+        os.environ["DYNAMO_METRICS_MODE"] = 'log'
+        dynamo_manager = DynamoManager(handler="submit")
+        dynamo_manager.read_status_record("abc", "1.0")
+        dynamo_manager.read_status_record("abc", "1.1")
+        dynamo_manager._call("put_item", mock_table.put_item, Item={"source_id": "abc"})
+
+        assert mock_table.get_item.call_args[1]['ReturnConsumedCapacity'] == 'TOTAL'
+        assert mock_table.put_item.call_args[1]['ReturnConsumedCapacity'] == 'TOTAL'
+        assert 'ConsistentRead' not in mock_table.put_item.call_args[1]
+
+        report = dynamo_manager.metrics.report()
+        assert report['handler'] == 'submit'
+        assert report['operations']['get_item']['calls'] == 2
+        assert report['operations']['get_item']['read_capacity'] == 2.0
+        assert report['operations']['put_item']['write_capacity'] == 3.0
+        assert report['read_capacity'] == 2.0
+        assert report['write_capacity'] == 3.0
+
+        dynamo_manager.emit_metrics()
+        lines = [line for line in capsys.readouterr().out.splitlines()
+                 if line.startswith("DYNAMO_METRICS")]
+        assert len(lines) == 1
+        assert json.loads(lines[0].split(" ", 1)[1])['write_capacity'] == 3.0
+
+    def test_throttled_calls_are_retried(self, mocker):
+        mocker.patch('retry.time.sleep')
+        mock_dynamo = mocker.Mock()
+        mock_table = mocker.Mock()
+        mock_table.table_status = "ACTIVE"
+        mock_dynamo.Table = mocker.Mock(return_value=mock_table)
+        throttle = ClientError({"Error": {"Code": "ProvisionedThroughputExceededException"}},
+                               "GetItem")
+        mock_table.get_item = mocker.Mock(side_effect=[throttle, {"Item": {"version": "1.0"}}])
+        mock_boto = mocker.patch('dynamo_manager.boto3')
+        mock_boto.resource = mocker.Mock(return_value=mock_dynamo)
+        mocker.patch.object(DynamoManager, 'rate_limiter', TokenBucket(max_rate=50))
+
+        os.environ["DYNAMO_STATUS_TABLE"] = 'test_table'
+        dynamo_manager = DynamoManager(handler="status")
+        assert dynamo_manager.read_status_record("abc", "1.0") == {"version": "1.0"}
+        assert mock_table.get_item.call_count == 2
+        assert dynamo_manager.metrics.report()['retries'] == 1
+
+        mock_table.get_item = mocker.Mock(side_effect=throttle)
+        with pytest.raises(RetriesExhausted):
+            dynamo_manager.read_status_record("abc", "1.0")
+        assert dynamo_manager.metrics.report()['give_ups'] == 1
+        assert DynamoManager.rate_limiter.rate < 50
+
+    def test_batch_read_status_records(self, mocker):
+        mocker.patch('retry.time.sleep')
+        mock_dynamo = mocker.Mock()
+        mock_dynamo.Table = mocker.Mock(return_value=mocker.Mock())
+        unprocessed = {"test_table": {"Keys": [{"source_id": "b", "version": "1.0"}],
+                                      "ConsistentRead": True}}
+        mock_dynamo.batch_get_item = mocker.Mock(side_effect=[
+            {"Responses": {"test_table": [{"source_id": "a", "version": "1.0"}]},
+             "UnprocessedKeys": unprocessed},
+            {"Responses": {"test_table": [{"source_id": "b", "version": "1.0"}]},
+             "UnprocessedKeys": {}}
+        ])
+        mock_boto = mocker.patch('dynamo_manager.boto3')
+        mock_boto.resource = mocker.Mock(return_value=mock_dynamo)
+
+        os.environ["DYNAMO_STATUS_TABLE"] = 'test_table'
+        dynamo_manager = DynamoManager(handler="status")
+        records = dynamo_manager.batch_read_status_records(
+            [("a", "1.0"), ("b", "1.0"), ("a", "1.0"), ("c", "1.0")])
+
+        assert set(records.keys()) == {("a", "1.0"), ("b", "1.0")}
+        calls = mock_dynamo.batch_get_item.call_args_list
+        assert len(calls) == 2
+        first_request = calls[0][1]['RequestItems']['test_table']
+        assert len(first_request['Keys']) == 3
+        assert 'ConsistentRead' not in calls[0][1]
+        assert calls[1][1]['RequestItems'] == unprocessed
+        assert dynamo_manager.metrics.report()['retries'] == 1
+
+    def test_create_statuses(self, mocker):
+        mock_dynamo = mocker.Mock()
+        mock_dynamo.Table = mocker.Mock(return_value=mocker.Mock())
+        conflict = ClientError({"Error": {"Code": "TransactionCanceledException"},
+                                "CancellationReasons": [{"Code": "None"},
+                                                        {"Code": "ConditionalCheckFailed"}]},
+                               "TransactWriteItems")
+        transact = mocker.Mock(side_effect=[conflict, {}])
+        mock_dynamo.meta.client.transact_write_items = transact
+        mock_boto = mocker.patch('dynamo_manager.boto3')
+        mock_boto.resource = mocker.Mock(return_value=mock_dynamo)
+
+        os.environ["DYNAMO_STATUS_TABLE"] = 'test_table'
+        dynamo_manager = DynamoManager(handler="submit")
+        statuses = [{"source_id": source_id, "version": "1.0",
+                     "submission_time": "2024-01-01T00:00:00Z", "submitter": "Bob",
+                     "title": "A dataset", "user_id": "my-id", "user_email": "me@foo.com",
+                     "acl": ["public"], "test": False, "original_submission": "{}",
+                     "update_metadata_only": False}
+                    for source_id in ("abc", "def")]
+        results = dynamo_manager.create_statuses(statuses)
+
+        assert [res["success"] for res in results] == [True, False]
+        assert "already exists" in results[1]["error"]
+        # The conflict is left out of the second try
+        calls = transact.call_args_list
+        assert [[item["Put"]["Item"]["source_id"] for item in c[1]["TransactItems"]]
+                for c in calls] == [[{"S": "abc"}, {"S": "def"}], [{"S": "abc"}]]
+        put = calls[0][1]["TransactItems"][0]["Put"]
+        assert put["TableName"] == "test_table"
+        assert put["Item"]["version_order"] == {"S": DynamoManager.version_order("1.0")}
+        # No flow run yet, so not in the active run index
+        assert "active_run" not in put["Item"]
+
+        # Large records are split across transactions by size
+        transact.reset_mock(side_effect=True)
+        transact.return_value = {}
+        mocker.patch.object(DynamoManager, "TRANSACTION_MAX_BYTES", 5000)
+        for status in statuses:
+            status["original_submission"] = "x" * 3000
+        results = dynamo_manager.create_statuses(statuses)
+        assert [res["success"] for res in results] == [True, True]
+        assert [len(c[1]["TransactItems"]) for c in transact.call_args_list] == [1, 1]
+
+    def test_get_version_history(self, mocker):
+        mock_dynamo = mocker.Mock()
+        mock_table = mocker.Mock()
+        mock_dynamo.Table = mocker.Mock(return_value=mock_table)
+        items = {
+            "1.2": {"source_id": "abc", "version": "1.2", "previous_version": "1.1"},
+            "1.1": {"source_id": "abc", "version": "1.1",
+                    "previous_versions": ["abc-1.0"]},
+            "1.0": {"source_id": "abc", "version": "1.0", "previous_versions": []}
+        }
+        mock_table.query = mocker.Mock(return_value={
+            "Items": [{"version": v} for v in items], "LastEvaluatedKey": None})
+        mock_table.get_item = mocker.Mock(
+            side_effect=lambda **kwargs: {"Item": dict(items[kwargs['Key']['version']])})
+        mock_boto = mocker.patch('dynamo_manager.boto3')
+        mock_boto.resource = mocker.Mock(return_value=mock_dynamo)
+
+        os.environ["DYNAMO_STATUS_TABLE"] = 'test_table'
+        dynamo_manager = DynamoManager()
+        page = dynamo_manager.get_version_history("abc", limit=2)
+        assert [v['version'] for v in page['versions']] == ["1.2", "1.1"]
+        assert page['versions'][1]['previous_version'] == "1.0"
+        assert 'previous_versions' not in page['versions'][1]
+        assert page['next_version'] == "1.0"
+        assert 'ProjectionExpression' in mock_table.get_item.call_args[1]
+
+        page = dynamo_manager.get_version_history("abc", start_version=page['next_version'],
+                                                  limit=2)
+        assert [v['version'] for v in page['versions']] == ["1.0"]
+        assert page['next_version'] is None
+
+    def test_query_version_history(self, mocker):
+        mock_dynamo = mocker.Mock()
+        mock_table = mocker.Mock()
+        mock_dynamo.Table = mocker.Mock(return_value=mock_table)
+        # 1.10 and 1.9 are in the version order index, the older versions predate it
+        indexed = [{"source_id": "abc", "version": "1.10", "previous_version": "1.9"},
+                   {"source_id": "abc", "version": "1.9", "previous_version": "1.8"}]
+        older = {
+            "1.8": {"source_id": "abc", "version": "1.8", "previous_versions": ["abc-1.7"]},
+            "1.7": {"source_id": "abc", "version": "1.7", "previous_versions": []}
+        }
+        last_key = {"source_id": "abc", "version": "1.9",
+                    "version_order": DynamoManager.version_order("1.9")}
+        mock_table.query = mocker.Mock(side_effect=[
+            {"Items": [dict(item) for item in indexed], "LastEvaluatedKey": last_key},
+            {"Items": []}
+        ])
+        mock_table.get_item = mocker.Mock(
+            side_effect=lambda **kwargs: {"Item": dict(older[kwargs['Key']['version']])})
+        mock_boto = mocker.patch('dynamo_manager.boto3')
+        mock_boto.resource = mocker.Mock(return_value=mock_dynamo)
+
+        os.environ["DYNAMO_STATUS_TABLE"] = 'test_table'
+        dynamo_manager = DynamoManager()
+        page = dynamo_manager.query_version_history("abc", limit=2)
+        assert [v['version'] for v in page['versions']] == ["1.10", "1.9"]
+        query = mock_table.query.call_args[1]
+        assert query['IndexName'] == DynamoManager.VERSION_ORDER_INDEX
+        assert query['ScanIndexForward'] is False
+        assert query['Limit'] == 2
+        assert 'ConsistentRead' not in query
+        mock_table.get_item.assert_not_called()
+
+        # The index has run out, so the history goes on through parent pointers
+        page = dynamo_manager.query_version_history("abc", limit=2,
+                                                    cursor=page['next_cursor'])
+        assert mock_table.query.call_args[1]['ExclusiveStartKey'] == last_key
+        assert [v['version'] for v in page['versions']] == ["1.8", "1.7"]
+        assert page['next_cursor'] is None
+
+    def test_claim_launch(self, mocker):
+        mock_dynamo = mocker.Mock()
+        mock_table = mocker.Mock()
+        mock_dynamo.Table = mocker.Mock(return_value=mock_table)
+        claimed = ClientError({"Error": {"Code": "ConditionalCheckFailedException"},
+                               "Item": {"source_id": {"S": "abc"}, "version": {"S": "1.0"},
+                                        "launching_since": {"N": "1700000000"}}},
+                              "UpdateItem")
+        missing = ClientError({"Error": {"Code": "ConditionalCheckFailedException"}},
+                              "UpdateItem")
+        mock_table.update_item = mocker.Mock(side_effect=[{}, claimed, missing, {}])
+        mock_boto = mocker.patch('dynamo_manager.boto3')
+        mock_boto.resource = mocker.Mock(return_value=mock_dynamo)
+
+        os.environ["DYNAMO_STATUS_TABLE"] = 'test_table'
+        dynamo_manager = DynamoManager(handler="submit_worker")
+        assert dynamo_manager.claim_launch("abc", "1.0") is None
+        update_args = mock_table.update_item.call_args[1]
+        assert update_args['UpdateExpression'] == "SET launching_since = :now"
+        assert update_args['ReturnValuesOnConditionCheckFailure'] == "ALL_OLD"
+        # The claim it lost to comes back from the failed write, and a missing
+        # record is not created
+        assert dynamo_manager.claim_launch("abc", "1.0") == {"launching_since": 1700000000}
+        assert dynamo_manager.claim_launch("abc", "1.0") == {}
+
+        dynamo_manager.release_launch("abc", "1.0")
+        assert mock_table.update_item.call_args[1]['UpdateExpression'] == \
+            "REMOVE launching_since"
+
+    def test_query_active_runs(self, mocker):
+        mock_dynamo = mocker.Mock()
+        mock_table = mocker.Mock()
+        mock_dynamo.Table = mocker.Mock(return_value=mock_table)
+        last_key = {"source_id": "abc", "version": "1.0", "active_run": "1",
+                    "submission_time": "2024-01-02T00:00:00Z"}
+        mock_table.query = mocker.Mock(side_effect=[
+            {"Items": [{"source_id": "abc", "version": "1.0"}], "LastEvaluatedKey": last_key},
+            {"Items": [{"source_id": "def", "version": "1.0"}]}
+        ])
+        mock_boto = mocker.patch('dynamo_manager.boto3')
+        mock_boto.resource = mocker.Mock(return_value=mock_dynamo)
+
+        os.environ["DYNAMO_STATUS_TABLE"] = 'test_table'
+        dynamo_manager = DynamoManager(handler="notify")
+        records = dynamo_manager.query_active_runs(fields=["source_id", "version"])
+
+        assert [r["source_id"] for r in records] == ["abc", "def"]
+        first, second = [c[1] for c in mock_table.query.call_args_list]
+        assert first['IndexName'] == DynamoManager.ACTIVE_RUN_INDEX
+        # Every active run, however old
+        assert first['KeyConditionExpression'] == Key("active_run").eq("1")
+        assert 'ConsistentRead' not in first
+        assert second['ExclusiveStartKey'] == last_key
+
+    def test_list_subscriptions(self, mocker):
+        mock_dynamo = mocker.Mock()
+        mock_table = mocker.Mock()
+        mock_dynamo.Table = mocker.Mock(return_value=mock_table)
+        last_key = {"topic": "source:abc", "url": "https://example.com/hook",
+                    "user_id": "my-id"}
+        mock_table.query = mocker.Mock(side_effect=[
+            {"Items": [dict(last_key)], "LastEvaluatedKey": last_key},
+            {"Items": [{"topic": "user:my-id", "url": "https://example.com/hook",
+                        "user_id": "my-id"}]}
+        ])
+        mock_boto = mocker.patch('dynamo_manager.boto3')
+        mock_boto.resource = mocker.Mock(return_value=mock_dynamo)
+
+        os.environ["DYNAMO_STATUS_TABLE"] = 'test_table'
+        os.environ["DYNAMO_SUBSCRIPTIONS_TABLE"] = 'test_subscriptions_table'
+        dynamo_manager = DynamoManager(handler="notify")
+        res = dynamo_manager.list_subscriptions("my-id")
+
+        assert res["success"]
+        assert [sub["topic"] for sub in res["results"]] == ["source:abc", "user:my-id"]
+        mock_dynamo.Table.assert_called_with('test_subscriptions_table')
+        # The user's subscriptions are queried, not filtered out of a scan
+        mock_table.scan.assert_not_called()
+        first, second = [c[1] for c in mock_table.query.call_args_list]
+        assert first['IndexName'] == DynamoManager.SUBSCRIPTION_USER_INDEX
+        assert first['KeyConditionExpression'] == Key("user_id").eq("my-id")
+        assert "secret" not in first['ExpressionAttributeNames'].values()
+        assert second['ExclusiveStartKey'] == last_key
+
+    def test_version_order(self):
+        versions = ["1.10", "1.9", "2.0", "1.0"]
+        assert sorted(versions, key=DynamoManager.version_order) == [
+            "1.0", "1.9", "1.10", "2.0"]
+        with pytest.raises(ValueError):
+            DynamoManager.decode_cursor("not-a-cursor")
+
+    def test_claim_idempotency_key(self, mocker):
+        mock_dynamo = mocker.Mock()
+        mock_table = mocker.Mock()
+        mock_dynamo.Table = mocker.Mock(return_value=mock_table)
+        used = ClientError({"Error": {"Code": "ConditionalCheckFailedException"},
+                            "Item": {"idempotency_key": {"S": "me:/submit:1"},
+                                     "request_hash": {"S": "abc"},
+                                     "response": {"S": "{}"}}},
+                           "PutItem")
+        mock_table.put_item = mocker.Mock(side_effect=[{}, used])
+        mock_boto = mocker.patch('dynamo_manager.boto3')
+        mock_boto.resource = mocker.Mock(return_value=mock_dynamo)
+
+        os.environ["DYNAMO_STATUS_TABLE"] = 'test_table'
+        os.environ["DYNAMO_IDEMPOTENCY_TABLE"] = 'test_idempotency_table'
+        dynamo_manager = DynamoManager(handler="submit")
+        assert dynamo_manager.claim_idempotency_key("me:/submit:1", "abc", 60) is None
+        put_args = mock_table.put_item.call_args[1]
+        assert put_args['Item']['expires'] > 60
+        assert put_args['ReturnValuesOnConditionCheckFailure'] == "ALL_OLD"
+        mock_dynamo.Table.assert_called_with('test_idempotency_table')
+
+        # The earlier request comes back from the failed write itself
+        assert dynamo_manager.claim_idempotency_key("me:/submit:1", "abc", 60) == {
+            "idempotency_key": "me:/submit:1", "request_hash": "abc", "response": "{}"}
+        mock_table.get_item.assert_not_called()
+
+    def test_take_rate_tokens(self, mocker):
+        buckets = {}
+
+        def update_item(Key, UpdateExpression, ConditionExpression,
+                        ExpressionAttributeValues, **kwargs):
+            # Evaluate the two updates take_rate_tokens makes, as Dynamo would
+            values = ExpressionAttributeValues
+            full_at = buckets.get(Key["bucket_key"])
+            if "#full_at + :increment" in UpdateExpression:
+                taken = full_at is not None and values[":now"] < full_at <= values[":limit"]
+                new_full_at = full_at + values[":increment"] if taken else None
+            else:
+                taken = full_at is None or full_at <= values[":now"]
+                new_full_at = values[":next"]
+            if not taken:
+                item = {"full_at": {"N": str(full_at)}} if full_at is not None else {}
+                raise ClientError({"Error": {"Code": "ConditionalCheckFailedException"},
+                                   "Item": item}, "UpdateItem")
+            buckets[Key["bucket_key"]] = new_full_at
+            return {}
+
+        mock_dynamo = mocker.Mock()
+        mock_table = mocker.Mock()
+        mock_dynamo.Table = mocker.Mock(return_value=mock_table)
+        mock_table.update_item = mocker.Mock(side_effect=update_item)
+        mock_boto = mocker.patch('dynamo_manager.boto3')
+        mock_boto.resource = mocker.Mock(return_value=mock_dynamo)
+
+        os.environ["DYNAMO_STATUS_TABLE"] = 'test_table'
+        os.environ["DYNAMO_ADMISSION_TABLE"] = 'test_admission_table'
+        dynamo_manager = DynamoManager(handler="status")
+        local_buckets = LocalBuckets()
+        # (time, tokens taken), with a bucket of 3 that gains a token a second
+        for now, cost in [(1000, 1), (1000, 1), (1000, 1), (1000, 1), (1001.5, 1),
+                          (1001.5, 3), (1010, 3), (1010, 1), (1020, 4), (1020, 3)]:
+            expected = local_buckets.take_rate_tokens("status:me", now, 1, 3, cost)
+            assert dynamo_manager.take_rate_tokens("status:me", now, 1, 3, cost) == \
+                pytest.approx(expected)
+
+        # More than the bucket holds is never taken, even from a new bucket
+        update_count = mock_table.update_item.call_count
+        assert dynamo_manager.take_rate_tokens("status:new", 1000, 1, 3, 4) == \
+            local_buckets.take_rate_tokens("status:new", 1000, 1, 3, 4) == 1
+        assert "status:new" not in buckets
+        assert mock_table.update_item.call_count == update_count
+        assert mock_table.update_item.call_args[1]['ReturnValuesOnConditionCheckFailure'] \
+            == "ALL_OLD"
+        mock_dynamo.Table.assert_called_with('test_admission_table')
+
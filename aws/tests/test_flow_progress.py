@@ -0,0 +1,65 @@
+from flow_progress import apply_log_entries, new_progress
+
+
+def started(state, description=None):
+    return {"code": "ActionStarted", "description": description or state + " started",
+            "details": {"state_name": state}}
+
+
+def failed(state, cause):
+    return {"code": "ActionFailed", "description": state + " failed",
+            "details": {"state_name": state, "cause": cause}}
+
+
+class TestFlowProgress:
+    def test_successful_flow(self):
+        code, messages = new_progress()
+        code, messages = apply_log_entries(code, messages, [
+            {"code": "FlowStarted", "description": "Started"},
+            started("EmailSubmission"),
+            started("UserTransfer"),
+            started("CheckUserTransfer"),
+            started("ChooseCuration"),
+            started("MintDOI"),
+            started("SearchIngest"),
+            started("NotifyUserEnd"),
+            {"code": "FlowSucceeded", "description": "Done"}
+        ])
+        # The flow has no download, extraction, backup, Citrine or MRR states
+        assert code == "SNNSNSSNSNNS"
+        assert messages[3] == "CheckUserTransfer started"
+        assert messages[8] == "MintDOI started"
+
+    def test_failed_curation(self):
+        code, messages = apply_log_entries(*new_progress(), [
+            started("EmailSubmission"),
+            started("UserTransfer"),
+            started("CurateSubmission"),
+            failed("CurateSubmission", "Curator rejected the submission"),
+            started("ExceptionState"),
+            started("NotifyUserEnd"),
+            {"code": "FlowFailed", "description": "Failed"}
+        ])
+        assert code == "SNNSNFzzzzzz"
+        assert messages[5] == "Curator rejected the submission"
+
+    def test_exception_without_failed_action(self):
+        code, messages = apply_log_entries(*new_progress(), [
+            started("EmailSubmission"),
+            started("SearchIngest", "Ingesting"),
+            {"code": "PassStarted", "description": "ExceptionState started",
+             "details": {"state_name": "ExceptionState"}}
+        ])
+        assert code == "SNNNNNFzzzzz"
+        assert messages[6] == "Failed: Ingesting"
+
+    def test_incremental(self):
+        entries = [started("EmailSubmission"), started("UserTransfer"),
+                   started("SearchIngest"), {"code": "FlowCanceled"}]
+        code, messages = apply_log_entries(*new_progress(), entries)
+
+        partial = new_progress()
+        for entry in entries:
+            partial = apply_log_entries(*partial, [entry])
+        assert partial == (code, messages)
+        assert code == "SNNSNNXzzzzz"
@@ -0,0 +1,272 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import pytest
+from globus_sdk import GlobusAPIError, GlobusConnectionError, GlobusTimeoutError
+
+from flow_action import FlowAction
+from globus_automate_flow import GlobusAutomateFlow
+from retry import CircuitBreaker, CircuitOpen, RetriesExhausted
+
+RECORDED_DIR = os.path.join(os.path.dirname(__file__), "recorded")
+
+
+def recorded_pages(mocker, name):
+    with open(os.path.join(RECORDED_DIR, name)) as f:
+        return [mocker.Mock(data=page) for page in json.load(f)]
+
+
+def globus_error(status):
+    error = GlobusAPIError.__new__(GlobusAPIError)
+    error.http_status = status
+    error.messages = ["HTTP {}".format(status)]
+    return error
+
+
+class FakeFlowsClient:
+    """Flows that fails each call with the next of a list of errors, then
+    works."""
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.calls = []
+
+    def _respond(self, name, data):
+        self.calls.append(name)
+        if self.failures:
+            raise self.failures.pop(0)
+        return FakeResponse(data)
+
+    def run_flow(self, flow_id, flow_scope, flow_input, **kwargs):
+        return self._respond("run_flow", {"action_id": "action-1"})
+
+    def flow_action_status(self, flow_id, flow_scope, action_id):
+        return self._respond("flow_action_status", {"action_id": action_id,
+                                                    "status": "ACTIVE"})
+
+    def flow_action_log(self, flow_id, flow_scope, action_id, **kwargs):
+        return self._respond("flow_action_log", {"entries": [{"code": "FlowSucceeded"}]})
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class TestGlobusAutomateFlow:
+    def test_list_runs(self, mocker):
+        client = mocker.Mock()
+        client.list_flow_runs = mocker.Mock(side_effect=recorded_pages(mocker,
+                                                                       "flow_runs.json"))
+        flow = GlobusAutomateFlow.from_existing_flow(flow_id="flow-id-1",
+                                                     flow_scope="flow-scope-1",
+                                                     client=client)
+
+        runs = flow.list_runs(statuses=["ACTIVE", "INACTIVE"], tags=["version:1.2"],
+                              per_page=2)
+
+        assert len(runs) == 3
+        calls = client.list_flow_runs.call_args_list
+        assert len(calls) == 2
+        assert calls[0][1]['flow_id'] == "flow-id-1"
+        assert calls[0][1]['statuses'] == ["ACTIVE", "INACTIVE"]
+        assert calls[0][1]['filters'] == {"filter_tags": "version:1.2"}
+        assert calls[0][1]['marker'] is None
+        assert calls[1][1]['marker'] == "eyJsYXN0X2tleSI6ICI2ZjBjMWQyZSJ9"
+
+        run = runs["0a5e7a84-9c3e-4f5b-9d3a-1c2a7f1e5b01"]
+        assert run['status'] == "ACTIVE"
+        assert run['details']['description'] == "State CurateSubmission of type Action started"
+        # Runs listed without details still get a description
+        assert runs["6f0c1d2e-3b4a-4c5d-8e9f-a0b1c2d3e4f5"]['details']['description'] == \
+            "INACTIVE"
+
+    def test_list_runs_max_pages(self, mocker):
+        client = mocker.Mock()
+        client.list_flow_runs = mocker.Mock(side_effect=recorded_pages(mocker,
+                                                                       "flow_runs.json"))
+        flow = GlobusAutomateFlow.from_existing_flow(flow_id="flow-id-1",
+                                                     flow_scope="flow-scope-1",
+                                                     client=client)
+        runs = flow.list_runs(label="MDF Submission", max_pages=1)
+        assert len(runs) == 2
+        assert client.list_flow_runs.call_args[1]['filters'] == {
+            "filter_label": "MDF Submission"}
+
+    def recorded_log(self, mocker, *pages):
+        with open(os.path.join(RECORDED_DIR, "flow_action_log.json")) as f:
+            recorded = json.load(f)
+        return [mocker.Mock(data=recorded[page]) for page in pages]
+
+    def test_iter_flow_logs(self, mocker):
+        client = mocker.Mock()
+        client.flow_action_log = mocker.Mock(side_effect=self.recorded_log(
+            mocker, "first_page", "last_page", "last_page_grown", "final_page"))
+        flow = GlobusAutomateFlow.from_existing_flow(flow_id="flow-id-1",
+                                                     flow_scope="flow-scope-1",
+                                                     client=client)
+
+        logs = flow.get_flow_logs("action-1")
+        assert [e['code'] for e in logs['entries']] == [
+            "FlowStarted", "ActionStarted", "ActionCompleted", "PassStarted", "ActionStarted"]
+        assert client.flow_action_log.call_count == 2
+        assert client.flow_action_log.call_args_list[1][1]['marker'] == "eyJwYWdlIjogMn0="
+
+        # Only the page the log ended on is asked for again, and its entries
+        # already read are not repeated
+        logs = flow.get_flow_logs("action-1")
+        assert [e['code'] for e in logs['entries']][5:] == ["ActionFailed", "FlowFailed"]
+        assert len(logs['entries']) == 7
+        assert client.flow_action_log.call_count == 4
+        assert client.flow_action_log.call_args_list[2][1]['marker'] == "eyJwYWdlIjogMn0="
+        assert client.flow_action_log.call_args_list[3][1]['marker'] == "eyJwYWdlIjogM30="
+
+        # The run has finished, so its log comes from the cache
+        assert len(flow.get_flow_logs("action-1")['entries']) == 7
+        assert client.flow_action_log.call_count == 4
+
+    def test_iter_new_flow_logs(self, mocker):
+        client = mocker.Mock()
+        client.flow_action_log = mocker.Mock(side_effect=self.recorded_log(
+            mocker, "first_page", "last_page", "last_page_grown", "final_page"))
+        flow = GlobusAutomateFlow.from_existing_flow(flow_id="flow-id-1",
+                                                     flow_scope="flow-scope-1",
+                                                     client=client)
+
+        position = {}
+        assert len(list(flow.iter_new_flow_logs("action-1", position))) == 5
+        assert position == {"page_marker": "eyJwYWdlIjogMn0=", "page_seen": 2,
+                            "complete": False}
+
+        # A stored position resumes after the last entry read
+        stored = dict(position, page_seen=Decimal(2))
+        assert [e['code'] for e in flow.iter_new_flow_logs("action-1", stored)] == [
+            "ActionFailed", "FlowFailed"]
+        assert stored["complete"]
+        assert list(flow.iter_new_flow_logs("action-1", stored)) == []
+        assert client.flow_action_log.call_count == 4
+
+    def test_error_msgs_stop_early(self, mocker):
+        client = mocker.Mock()
+        client.flow_action_log = mocker.Mock(side_effect=self.recorded_log(
+            mocker, "first_page", "last_page_grown", "final_page"))
+        flow = GlobusAutomateFlow.from_existing_flow(flow_id="flow-id-1",
+                                                     flow_scope="flow-scope-1",
+                                                     client=client)
+
+        errors = FlowAction(flow, "action-1").get_error_msgs(max_errors=1)
+        assert errors == [['Record 4 is missing mdf.source_id']]
+        # The final page was never needed
+        assert client.flow_action_log.call_count == 2
+
+        # Reading on resumes from the page after the one the first read stopped in
+        assert FlowAction(flow, "action-1").get_error_msgs() == errors
+        assert client.flow_action_log.call_count == 3
+        assert client.flow_action_log.call_args[1]['marker'] == "eyJwYWdlIjogM30="
+        assert len(flow.get_flow_logs("action-1")['entries']) == 7
+
+    def test_concurrent_log_readers(self, mocker):
+        client = mocker.Mock()
+        barrier = threading.Barrier(2, timeout=5)
+        pages = self.recorded_log(mocker, "first_page", "last_page_grown", "final_page")
+
+        def flow_action_log(*args, **kwargs):
+            time.sleep(0.01)
+            return pages.pop(0)
+
+        client.flow_action_log = mocker.Mock(side_effect=flow_action_log)
+        flow = GlobusAutomateFlow.from_existing_flow(flow_id="flow-id-1",
+                                                     flow_scope="flow-scope-1",
+                                                     client=client)
+
+        def read(_):
+            barrier.wait()
+            return [e['code'] for e in flow.iter_flow_logs("action-1")]
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            logs = list(executor.map(read, range(2)))
+
+        # Each page is fetched once, and both readers see the whole log once
+        expected = ["FlowStarted", "ActionStarted", "ActionCompleted", "PassStarted",
+                    "ActionStarted", "ActionFailed", "FlowFailed"]
+        assert logs == [expected, expected]
+        assert client.flow_action_log.call_count == 3
+        assert [e['code'] for e in flow.log_cache["action-1"]["entries"]] == expected
+
+    def test_log_cache_is_bounded(self, mocker):
+        client = mocker.Mock()
+        client.flow_action_log = mocker.Mock(side_effect=lambda *args, **kwargs: mocker.Mock(
+            data={"entries": [{"code": "FlowSucceeded"}], "has_next_page": False}))
+        flow = GlobusAutomateFlow.from_existing_flow(flow_id="flow-id-1",
+                                                     flow_scope="flow-scope-1",
+                                                     client=client)
+        flow.log_cache_size = 2
+        for action_id in ("a", "b", "a", "c"):
+            flow.get_flow_logs(action_id)
+        assert list(flow.log_cache) == ["a", "c"]
+
+
+class TestFlowsFailures:
+    def flow(self, mocker, *failures):
+        mocker.patch("retry.time.sleep")
+        mocker.patch("globus_automate_flow.flows_breaker",
+                     CircuitBreaker("Globus Flows", failure_threshold=3, reset_timeout=30))
+        client = FakeFlowsClient(failures)
+        return GlobusAutomateFlow.from_existing_flow(flow_id="flow-id-1",
+                                                     flow_scope="flow-scope-1",
+                                                     client=client), client
+
+    def test_run_flow_retries_unstarted_runs(self, mocker):
+        flow, client = self.flow(mocker, globus_error(429), globus_error(503),
+                                 GlobusConnectionError("refused", ValueError()))
+        mocker.patch.dict(os.environ, {"FLOWS_MAX_ATTEMPTS": "4"})
+        assert flow.run_flow({"a": 1}).action_id == "action-1"
+        assert client.calls == ["run_flow"] * 4
+
+    def test_run_flow_does_not_start_runs_twice(self, mocker):
+        # The run may have started before these
+        for failure in (globus_error(500), globus_error(504),
+                        GlobusTimeoutError("read timed out", ValueError())):
+            flow, client = self.flow(mocker, failure)
+            with pytest.raises(type(failure)):
+                flow.run_flow({"a": 1})
+            assert client.calls == ["run_flow"]
+
+        # Nor are bad requests retried
+        flow, client = self.flow(mocker, globus_error(400))
+        with pytest.raises(GlobusAPIError):
+            flow.run_flow({"a": 1})
+        assert client.calls == ["run_flow"]
+
+    def test_status_and_log_retries(self, mocker):
+        flow, client = self.flow(mocker, globus_error(500), globus_error(502))
+        assert flow.get_status("action-1")["status"] == "ACTIVE"
+        assert client.calls == ["flow_action_status"] * 3
+
+        flow, client = self.flow(mocker, GlobusTimeoutError("read timed out", ValueError()))
+        assert flow.get_flow_logs("action-1")["entries"] == [{"code": "FlowSucceeded"}]
+        assert client.calls == ["flow_action_log"] * 2
+
+    def test_retries_stop_at_deadline(self, mocker):
+        flow, client = self.flow(mocker, globus_error(503), globus_error(503))
+        mocker.patch("retry.time.monotonic", return_value=100.0)
+        with pytest.raises(RetriesExhausted):
+            flow.get_status("action-1", deadline=100.0)
+        assert client.calls == ["flow_action_status"]
+
+    def test_circuit_breaker(self, mocker):
+        flow, client = self.flow(mocker, *[globus_error(503)] * 9)
+        for _ in range(3):
+            with pytest.raises(RetriesExhausted):
+                flow.get_status("action-1")
+        assert len(client.calls) == 9
+
+        # Flows isn't called again until the breaker's timeout passes
+        with pytest.raises(CircuitOpen) as e:
+            flow.run_flow({"a": 1})
+        assert e.value.retry_after >= 1
+        assert len(client.calls) == 9
+
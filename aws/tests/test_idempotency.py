@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from idempotency import idempotent
+from retry import RetriesExhausted
+
+
+def request(body, key="key-1"):
+    return {
+        "resource": "/submit",
+        "requestContext": {"authorizer": {"user_id": "my-id"}},
+        "headers": {"Idempotency-Key": key} if key else {},
+        "body": body
+    }
+
+
+class TestIdempotency:
+    def key_store(self, mocker):
+        """A dynamo_manager mock that keeps idempotency keys in a dict."""
+        keys = {}
+
+        def claim(key, request_hash, ttl):
+            if key in keys:
+                return dict(keys[key])
+            keys[key] = {"request_hash": request_hash}
+            return None
+
+        def save(key, response):
+            keys[key]["response"] = json.dumps(response)
+
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.claim_idempotency_key = mocker.Mock(side_effect=claim)
+        dynamo_manager.save_idempotent_response = mocker.Mock(side_effect=save)
+        dynamo_manager.release_idempotency_key = mocker.Mock(
+            side_effect=lambda key: keys.pop(key))
+        return dynamo_manager, keys
+
+    def test_replay(self, mocker):
+        dynamo_manager, keys = self.key_store(mocker)
+        handle = mocker.Mock(return_value={'statusCode': 202,
+                                           'body': json.dumps({"success": True})})
+
+        first = idempotent(request('{"a": 1}'), dynamo_manager, handle)
+        replay = idempotent(request('{"a": 1}'), dynamo_manager, handle)
+
+        handle.assert_called_once()
+        assert first == {'statusCode': 202, 'body': json.dumps({"success": True})}
+        assert replay['statusCode'] == 202
+        assert replay['body'] == first['body']
+        assert replay['headers']['idempotent-replayed'] == "true"
+        # Keys belong to the user and route
+        assert list(keys) == ["my-id:/submit:key-1"]
+
+        # A different body with the same key
+        conflict = idempotent(request('{"a": 2}'), dynamo_manager, handle)
+        assert conflict['statusCode'] == 422
+        handle.assert_called_once()
+
+        # No key, no bookkeeping
+        idempotent(request('{"a": 1}', key=None), dynamo_manager, handle)
+        assert handle.call_count == 2
+        assert dynamo_manager.claim_idempotency_key.call_count == 3
+
+    def test_in_progress(self, mocker):
+        dynamo_manager, keys = self.key_store(mocker)
+
+        def handle():
+            # The client gives up and retries while the first request runs
+            return idempotent(request('{"a": 1}'), dynamo_manager, mocker.Mock())
+
+        retry = idempotent(request('{"a": 1}'), dynamo_manager, handle)
+        assert retry['statusCode'] == 409
+        assert retry['headers']['Retry-After'] == "1"
+
+    def test_failures_are_not_replayed(self, mocker):
+        dynamo_manager, keys = self.key_store(mocker)
+        handle = mocker.Mock(side_effect=[
+            {'statusCode': 500, 'body': json.dumps({"success": False})},
+            ValueError("Bad"),
+            {'statusCode': 202, 'body': json.dumps({"success": True})}])
+
+        assert idempotent(request("{}"), dynamo_manager, handle)['statusCode'] == 500
+        assert not keys
+        with pytest.raises(ValueError):
+            idempotent(request("{}"), dynamo_manager, handle)
+        assert not keys
+        assert idempotent(request("{}"), dynamo_manager, handle)['statusCode'] == 202
+        assert handle.call_count == 3
+
+    def test_throttled(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.claim_idempotency_key = mocker.Mock(
+            side_effect=RetriesExhausted("Throttled", retry_after=4))
+        handle = mocker.Mock()
+        result = idempotent(request("{}"), dynamo_manager, handle)
+        assert result['statusCode'] == 503
+        assert result['headers']['Retry-After'] == "4"
+        handle.assert_not_called()
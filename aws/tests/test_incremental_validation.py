@@ -0,0 +1,125 @@
+import json
+from copy import deepcopy
+
+import jsonschema
+
+import submit
+from incremental_validation import iter_changed_errors
+
+schema = {
+    "$schema": "http://json-schema.org/draft-07/schema#",
+    "type": "object",
+    "required": ["dc", "data_sources"],
+    "additionalProperties": False,
+    "definitions": {
+        "creator": {
+            "type": "object",
+            "required": ["creatorName"],
+            "properties": {
+                "creatorName": {"type": "string"},
+                "affiliations": {"type": "array", "items": {"type": "string"}}
+            }
+        }
+    },
+    "properties": {
+        "dc": {
+            "type": "object",
+            "required": ["titles", "creators"],
+            "properties": {
+                "titles": {"type": "array", "minItems": 1,
+                           "items": {"type": "object",
+                                     "properties": {"title": {"type": "string"}}}},
+                "creators": {"type": "array", "items": {"$ref": "#/definitions/creator"}},
+                "subjects": {"type": "array", "uniqueItems": True}
+            }
+        },
+        "data_sources": {"type": "array", "items": {"type": "string"}},
+        "update": {"type": "boolean"},
+        "custom": {"type": "object", "additionalProperties": {"type": "string"}}
+    }
+}
+
+previous = {
+    "dc": {
+        "titles": [{"title": "How to make a dataset"}],
+        "creators": [{"creatorName": "Creator {}".format(i), "affiliations": ["UIUC"]}
+                     for i in range(100)],
+        "subjects": [{"subject": "a"}, {"subject": "b"}]
+    },
+    "data_sources": ["globus://abc/"],
+    "custom": {"temperature": "300K"}
+}
+
+
+def validator():
+    validator_class = jsonschema.validators.validator_for(schema)
+    return validator_class(schema)
+
+
+def changed_errors(instance):
+    return list(iter_changed_errors(validator(), instance, previous))
+
+
+class TestIncrementalValidation:
+    def test_matches_full_validation(self):
+        assert validator().is_valid(previous)
+        changes = [
+            lambda doc: doc.update(update=True),
+            lambda doc: doc["dc"]["titles"][0].update(title="A new title"),
+            lambda doc: doc["dc"]["titles"][0].update(title=5),
+            lambda doc: doc["dc"].update(titles=[]),
+            lambda doc: doc["dc"]["creators"][50].update(creatorName=None),
+            lambda doc: doc["dc"]["creators"][50]["affiliations"].append(1),
+            lambda doc: doc["dc"]["creators"].append({"affiliations": []}),
+            lambda doc: doc["dc"]["creators"].append({"creatorName": "Bob"}),
+            lambda doc: doc["dc"]["subjects"].append({"subject": "a"}),
+            lambda doc: doc["dc"]["subjects"].append({"subject": "c"}),
+            lambda doc: doc.update(extra="not allowed"),
+            lambda doc: doc.pop("data_sources"),
+            lambda doc: doc["custom"].update(pressure=1),
+            lambda doc: doc["custom"].update(pressure="1 atm"),
+            lambda doc: doc.update(dc=[]),
+        ]
+        for change in changes:
+            doc = deepcopy(previous)
+            change(doc)
+            assert bool(changed_errors(doc)) == (not validator().is_valid(doc))
+
+    def test_only_changes_validated(self, mocker):
+        v = validator()
+        iter_errors = mocker.spy(v, "iter_errors")
+        doc = deepcopy(previous)
+        doc["update"] = True
+        doc["dc"]["creators"][50]["creatorName"] = "Someone else"
+
+        assert not list(iter_changed_errors(v, doc, previous))
+        checked = [c[0][0] for c in iter_errors.call_args_list]
+        # The changed name, and the objects and arrays holding it without
+        # their members, but not the other 99 creators
+        assert "Someone else" in checked
+        assert not any(creator in checked for creator in previous["dc"]["creators"])
+
+    def test_submit_falls_back_to_full_validation(self, mocker):
+        mocker.patch("submit.submission_validator", return_value=validator())
+        doc = deepcopy(previous)
+        doc["dc"]["creators"][50]["creatorName"] = None
+        full_err = submit.validate_submission_schema(doc)
+        # Errors are reported as full validation reports them
+        assert submit.validate_submission_schema(doc, previous) == full_err
+        assert json.loads(full_err["body"])["error"].startswith("Invalid submission")
+
+        doc["dc"]["creators"][50]["creatorName"] = "Someone else"
+        assert submit.validate_submission_schema(doc, previous) is None
+
+        # Anything that goes wrong along the way means validating everything
+        mocker.patch("submit.iter_changed_errors", side_effect=RecursionError)
+        assert submit.validate_submission_schema(doc, previous) is None
+
+    def test_previous_submission(self):
+        record = {"original_submission": json.dumps(dict(previous, tags=["c"])),
+                  "submission_schema": submit.submission_schema_fingerprint()}
+        normalized = submit.previous_submission(record)
+        assert normalized["dc"]["subjects"][-1] == {"subject": "c"}
+        # Versions validated against another schema are validated in full
+        assert submit.previous_submission(dict(record, submission_schema="old")) is None
+        assert submit.previous_submission(None) is None
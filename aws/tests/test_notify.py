@@ -0,0 +1,184 @@
+import json
+import os
+import socket
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeSerializer
+
+from notify import lambda_handler, state_transition
+
+serializer = TypeSerializer()
+
+
+def stream_record(old, new, sequence="1"):
+    images = {"SequenceNumber": sequence}
+    if old:
+        images["OldImage"] = {k: serializer.serialize(v) for k, v in old.items()}
+    if new:
+        images["NewImage"] = {k: serializer.serialize(v) for k, v in new.items()}
+    return {"eventName": "MODIFY" if old else "INSERT", "dynamodb": images}
+
+
+class TestNotify:
+    record = {"source_id": "abc", "version": "1.0", "user_id": "my-id",
+              "action_id": "action-1", "submission_time": "2023-10-01T00:00:00Z"}
+
+    def test_state_transition(self):
+        started = state_transition(None, self.record)
+        assert started["state"] == "ACTIVE"
+        assert started["previous_state"] is None
+
+        finished = dict(self.record, flow_state="SUCCEEDED", flow_description="Done")
+        transition = state_transition(self.record, finished)
+        assert transition["state"] == "SUCCEEDED"
+        assert transition["previous_state"] == "ACTIVE"
+        assert transition["description"] == "Done"
+
+        # Unrelated updates are not transitions
+        assert state_transition(finished, dict(finished, title="New title")) is None
+        # Nor are submissions from before Globus Automate
+        assert state_transition(None, {"source_id": "abc", "version": "1.0"}) is None
+
+        # A queued submission starts when its flow run is recorded
+        queued = {"source_id": "abc", "version": "1.0", "queued": True}
+        assert state_transition(None, queued) is None
+        started = state_transition(queued, self.record)
+        assert (started["previous_state"], started["state"]) == (None, "ACTIVE")
+        not_started = dict(queued, flow_state="FAILED")
+        assert state_transition(queued, not_started)["state"] == "FAILED"
+
+    def test_process_stream(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.get_subscriptions = mocker.Mock(return_value=[
+            {"topic": "source:abc", "url": "https://example.com/hook", "secret": "a"},
+            {"topic": "user:my-id", "url": "https://example.com/hook", "secret": "b"},
+            {"topic": "user:my-id", "url": "https://example.org/hook", "secret": "c"}
+        ])
+        mocker.patch("notify.DynamoManager", return_value=dynamo_manager)
+        deliver = mocker.patch("notify.deliver", return_value={"success": True})
+
+        finished = dict(self.record, flow_state="SUCCEEDED")
+        result = lambda_handler({"Records": [
+            stream_record(self.record, dict(self.record, title="New title"), "1"),
+            stream_record(self.record, finished, "2")
+        ]}, None)
+
+        assert result == {"batchItemFailures": []}
+        dynamo_manager.get_subscriptions.assert_called_once_with(["source:abc", "user:my-id"])
+        # One delivery per URL
+        assert sorted(c[0][0]["url"] for c in deliver.call_args_list) == [
+            "https://example.com/hook", "https://example.org/hook"]
+        assert deliver.call_args[0][1]["state"] == "SUCCEEDED"
+
+    def test_reconcile(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.query_active_runs = mocker.Mock(return_value=[
+            {"source_id": "abc", "version": "1.0", "action_id": "action-1"},
+            {"source_id": "def", "version": "1.0", "action_id": "action-2"}
+        ])
+        mocker.patch("notify.DynamoManager", return_value=dynamo_manager)
+        automate_manager = mocker.Mock()
+        automate_manager.get_statuses = mocker.Mock(return_value={
+            "action-1": {"status": "SUCCEEDED", "details": {"description": "Done"}},
+            "action-2": {"status": "ACTIVE", "details": {"description": "Running"}}
+        })
+        automate_manager.get_new_log_entries = mocker.Mock(return_value=[])
+        mocker.patch("notify.AutomateManager", return_value=automate_manager)
+        mocker.patch("notify.get_secret")
+        os.environ["MDF_SECRETS_NAME"] = "mdf-secrets"
+        os.environ["MDF_AWS_REGION"] = "us-east-1"
+
+        result = lambda_handler({"source": "aws.events"}, None)
+
+        assert result == {"success": True, "checked": 2, "finished": 1}
+        # Only the active run index is read, all of it, however old the runs
+        dynamo_manager.scan_table.assert_not_called()
+        assert dynamo_manager.query_active_runs.call_args[0] == ()
+        # The finished flow leaves the index, with its final state
+        dynamo_manager.update_progress.assert_called_once()
+        assert dynamo_manager.update_progress.call_args[0][:2] == ("abc", "1.0")
+        assert dynamo_manager.update_progress.call_args[1] == {
+            "flow_status": {"status": "SUCCEEDED", "details": {"description": "Done"}},
+            "finished": True}
+
+    def test_reconcile_progress(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.query_active_runs = mocker.Mock(return_value=[
+            # Cached by a status poll, with its last log entries still unread
+            {"source_id": "abc", "version": "1.0", "action_id": "action-1",
+             "flow_state": "SUCCEEDED", "code": "P" + "z" * 11,
+             "messages": ["Started"] + ["No message available"] * 11,
+             "log_position": {"page_marker": None, "page_seen": Decimal(1),
+                              "complete": False}},
+            # Still running
+            {"source_id": "def", "version": "1.0", "action_id": "action-2",
+             "code": "P" + "z" * 11, "messages": ["Started"] + ["No message available"] * 11,
+             "log_position": {"page_marker": None, "page_seen": Decimal(1),
+                              "complete": False}}
+        ])
+        mocker.patch("notify.DynamoManager", return_value=dynamo_manager)
+        automate_manager = mocker.Mock()
+        automate_manager.get_statuses = mocker.Mock(return_value={
+            "action-2": {"status": "ACTIVE", "details": {"description": "Running"}}})
+
+        def new_entries(action_id, position):
+            assert position["page_seen"] == 1
+            if action_id == "action-2":
+                return []
+            position.update(page_seen=3, complete=True)
+            return [{"code": "ActionStarted", "description": "Ingesting",
+                     "details": {"state_name": "SearchIngest"}},
+                    {"code": "FlowSucceeded", "description": "Done"}]
+        automate_manager.get_new_log_entries = mocker.Mock(side_effect=new_entries)
+        mocker.patch("notify.AutomateManager", return_value=automate_manager)
+        mocker.patch("notify.get_secret")
+        os.environ["MDF_SECRETS_NAME"] = "mdf-secrets"
+        os.environ["MDF_AWS_REGION"] = "us-east-1"
+
+        result = lambda_handler({"source": "aws.events"}, None)
+
+        assert result == {"success": True, "checked": 2, "finished": 0}
+        automate_manager.get_statuses.assert_called_once_with(["action-2"], deadline=None)
+        # The running flow had nothing new, so only the finished one is written
+        dynamo_manager.update_progress.assert_called_once()
+        source_id, version, code, messages, position = \
+            dynamo_manager.update_progress.call_args[0]
+        assert (source_id, version) == ("abc", "1.0")
+        assert code == "SNNNNNSNNNNN"
+        assert messages[6] == "Ingesting"
+        assert position["complete"]
+        assert dynamo_manager.update_progress.call_args[1]["finished"]
+        dynamo_manager.set_flow_state.assert_not_called()
+
+    def test_subscribe(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.get_current_version = mocker.Mock(return_value=self.record)
+        dynamo_manager.create_subscription = mocker.Mock(
+            side_effect=lambda sub: {"success": True, "subscription": sub})
+        mocker.patch("notify.DynamoManager", return_value=dynamo_manager)
+        mocker.patch("webhooks.socket.getaddrinfo", side_effect=lambda host, port, **kwargs: [
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "",
+             ("93.184.216.34" if host == "example.com" else host, port))])
+
+        def event(body, user_id="my-id"):
+            return {"httpMethod": "POST",
+                    "requestContext": {"authorizer": {"user_id": user_id}},
+                    "body": json.dumps(body)}
+
+        result = lambda_handler(event({"url": "https://example.com/hook",
+                                       "source_id": "abc"}), None)
+        assert result['statusCode'] == 201
+        subscription = json.loads(result['body'])['subscription']
+        assert subscription['topic'] == "source:abc"
+        assert len(subscription['secret']) == 64
+
+        result = lambda_handler(event({"url": "https://example.com/hook",
+                                       "source_id": "abc"}, user_id="someone-else"), None)
+        assert result['statusCode'] == 404
+
+        result = lambda_handler(event({"url": "http://example.com/hook"}), None)
+        assert result['statusCode'] == 400
+        result = lambda_handler(event({"url": "https://169.254.169.254/latest/meta-data/"}),
+                                None)
+        assert result['statusCode'] == 400
+        assert dynamo_manager.create_subscription.call_count == 1
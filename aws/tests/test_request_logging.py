@@ -0,0 +1,69 @@
+import json
+import logging
+import os
+
+import request_logging
+from request_logging import log_payload, redact, start_request, truncate
+
+logger = logging.getLogger("test_request_logging")
+
+
+class TestRequestLogging:
+    def test_redact(self):
+        event = {
+            "headers": {"Authorization": "Bearer abc", "Content-Type": "application/json"},
+            "requestContext": {"authorizer": {"user_id": "my-id",
+                                              "globus_dependent_token": "{'a': 1}"}},
+            "tokens": [{"access_token": "abc", "expires_at_seconds": 1}],
+            "secrets": {"API_CLIENT_SECRET": "xyz"},
+            "body": "{}"
+        }
+        assert redact(event) == {
+            "headers": {"Authorization": "[REDACTED]", "Content-Type": "application/json"},
+            "requestContext": {"authorizer": {"user_id": "my-id",
+                                              "globus_dependent_token": "[REDACTED]"}},
+            "tokens": "[REDACTED]",
+            "secrets": "[REDACTED]",
+            "body": "{}"
+        }
+        # The payload itself is left alone
+        assert event["headers"]["Authorization"] == "Bearer abc"
+
+    def test_truncate(self):
+        assert truncate("abcdef", 10) == "abcdef"
+        assert truncate("abcdef", 4) == "abcd...[2 more characters]"
+
+    def test_levels_and_sampling(self, mocker, caplog):
+        mocker.patch.dict(os.environ, {"LOG_LEVEL": "INFO", "PAYLOAD_LOG_SAMPLE_RATE": "0",
+                                       "PAYLOAD_LOG_MAX_CHARS": "20"})
+        redact_spy = mocker.spy(request_logging, "redact")
+        payload = {"metadata": "x" * 100, "access_token": "abc"}
+
+        # Not sampled, at INFO: nothing is serialized
+        assert not start_request()
+        with caplog.at_level(logging.INFO):
+            log_payload(logger, "Submission", payload)
+        assert not caplog.records
+        redact_spy.assert_not_called()
+
+        # At DEBUG, every request is logged
+        with caplog.at_level(logging.DEBUG):
+            log_payload(logger, "Submission", payload)
+        record = json.loads(caplog.records[0].getMessage())
+        assert caplog.records[0].levelno == logging.DEBUG
+        assert record["message"] == "Submission"
+        assert record["size"] == len(json.dumps(redact(payload)))
+        assert record["payload"].startswith('{"metadata": "xxxxxx')
+        assert record["payload"].endswith("more characters]")
+        assert "abc" not in record["payload"]
+        caplog.clear()
+
+        # Sampled requests are logged at INFO
+        os.environ["PAYLOAD_LOG_SAMPLE_RATE"] = "1"
+        assert start_request()
+        with caplog.at_level(logging.INFO):
+            log_payload(logger, "Submission", payload)
+        assert caplog.records[0].levelno == logging.INFO
+
+        os.environ["PAYLOAD_LOG_SAMPLE_RATE"] = "0"
+        start_request()
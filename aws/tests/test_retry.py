@@ -0,0 +1,156 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+
+from retry import (CircuitBreaker, CircuitOpen, RetriesExhausted, RetryPolicy, TokenBucket,
+                   deadline_from_context)
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "PutItem")
+
+
+class TestRetryPolicy:
+    def test_retries_throttles_until_success(self, mocker):
+        mocker.patch('retry.time.sleep')
+        method = mocker.Mock(side_effect=[
+            client_error('ProvisionedThroughputExceededException'),
+            client_error('ThrottlingException'),
+            {"Item": {}}
+        ])
+        on_retry = mocker.Mock()
+        policy = RetryPolicy(max_attempts=5)
+        assert policy.call(method, on_retry=on_retry, Key={"source_id": "abc"}) == {"Item": {}}
+        assert method.call_count == 3
+        assert on_retry.call_count == 2
+        assert method.call_args[1] == {"Key": {"source_id": "abc"}}
+
+    def test_gives_up_after_max_attempts(self, mocker):
+        mocker.patch('retry.time.sleep')
+        method = mocker.Mock(side_effect=client_error('ProvisionedThroughputExceededException'))
+        policy = RetryPolicy(max_attempts=3)
+        with pytest.raises(RetriesExhausted) as e:
+            policy.call(method)
+        assert method.call_count == 3
+        assert e.value.retry_after >= 1
+
+    def test_retries_network_errors(self, mocker):
+        mocker.patch('retry.time.sleep')
+        rate_limiter = TokenBucket(100)
+        on_throttle = mocker.spy(rate_limiter, "on_throttle")
+        method = mocker.Mock(side_effect=[
+            EndpointConnectionError(endpoint_url="https://dynamodb.us-east-1.amazonaws.com"),
+            ReadTimeoutError(endpoint_url="https://dynamodb.us-east-1.amazonaws.com"),
+            {"Item": {}}
+        ])
+        assert RetryPolicy(rate_limiter=rate_limiter).call(method) == {"Item": {}}
+        assert method.call_count == 3
+        # They say nothing about the request rate
+        on_throttle.assert_not_called()
+
+    def test_does_not_retry_other_errors(self, mocker):
+        method = mocker.Mock(side_effect=client_error('ConditionalCheckFailedException'))
+        with pytest.raises(ClientError):
+            RetryPolicy().call(method)
+        assert method.call_count == 1
+
+    def test_gives_up_at_deadline(self, mocker):
+        sleep = mocker.patch('retry.time.sleep')
+        context = mocker.Mock()
+        context.get_remaining_time_in_millis = mocker.Mock(return_value=1000)
+        method = mocker.Mock(side_effect=client_error('ThrottlingException'))
+        # Deadline is already passed once the margin is held back
+        policy = RetryPolicy(max_attempts=10, deadline=deadline_from_context(context))
+        with pytest.raises(RetriesExhausted):
+            policy.call(method)
+        assert method.call_count == 1
+        sleep.assert_not_called()
+
+    def test_full_jitter_backoff(self):
+        policy = RetryPolicy(base_delay=0.1, max_delay=1.0)
+        for attempt in range(1, 10):
+            delay = policy.backoff(attempt)
+            assert 0 <= delay <= min(1.0, 0.1 * 2 ** attempt)
+
+    def test_no_deadline_without_context(self):
+        assert deadline_from_context(None) is None
+
+
+class TestTokenBucket:
+    def test_learns_from_throttles(self, mocker):
+        mocker.patch('retry.time.sleep')
+        method = mocker.Mock(side_effect=[client_error('ThrottlingException'),
+                                          client_error('ThrottlingException'),
+                                          "ok"])
+        bucket = TokenBucket(max_rate=40, min_rate=1, backoff_factor=0.5, recovery_rate=1)
+        RetryPolicy(rate_limiter=bucket).call(method)
+        assert bucket.rate == 40 * 0.5 * 0.5 + 1
+
+        for _ in range(100):
+            bucket.on_success()
+        assert bucket.rate == 40
+
+        for _ in range(100):
+            bucket.on_throttle()
+        assert bucket.rate == 1
+
+    def test_acquire_respects_deadline(self, mocker):
+        bucket = TokenBucket(max_rate=1)
+        bucket.tokens = 0
+        mocker.patch('retry.time.monotonic', return_value=bucket.last_refill)
+        assert not bucket.acquire(deadline=bucket.last_refill + 0.1)
+
+    def test_threads_share_tokens(self, mocker):
+        waits = []
+        mocker.patch('retry.time.sleep', side_effect=waits.append)
+        now = time.monotonic()
+        mocker.patch('retry.time.monotonic', return_value=now)
+        bucket = TokenBucket(max_rate=10)
+        bucket.last_refill = now
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            assert all(executor.map(lambda _: bucket.acquire(), range(30)))
+
+        # The 10 tokens in the bucket went straight away, and the other 20
+        # callers each waited for a token of their own
+        assert len(waits) == 20
+        assert sorted(round(w, 6) for w in waits) == [n / 10 for n in range(1, 21)]
+
+
+class TestCircuitBreaker:
+    def test_opens_after_failures(self, mocker):
+        clock = mocker.patch('retry.time.monotonic', return_value=100.0)
+        breaker = CircuitBreaker("Flows", failure_threshold=2, reset_timeout=30)
+        failing = mocker.Mock(side_effect=ValueError("down"))
+
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                breaker.call(failing)
+        # Open: calls fail fast, saying when to try again
+        with pytest.raises(CircuitOpen) as e:
+            breaker.call(failing)
+        assert e.value.retry_after == 30
+        assert failing.call_count == 2
+
+        # After the timeout one trial call goes through, and its failure
+        # opens the circuit again
+        clock.return_value = 131.0
+        breaker.check()
+        with pytest.raises(ValueError):
+            breaker.call(failing)
+        with pytest.raises(CircuitOpen):
+            breaker.check()
+
+        # A successful trial closes it
+        clock.return_value = 162.0
+        assert breaker.call(mocker.Mock(return_value="ok")) == "ok"
+        breaker.check()
+
+    def test_only_counts_service_failures(self, mocker):
+        breaker = CircuitBreaker("Flows", failure_threshold=1)
+        bad_request = mocker.Mock(side_effect=KeyError("bad"))
+        with pytest.raises(KeyError):
+            breaker.call(bad_request, failed=lambda e: not isinstance(e, KeyError))
+        breaker.check()
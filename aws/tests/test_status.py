@@ -0,0 +1,285 @@
+import json
+import os
+
+import status
+from status import lambda_handler
+
+
+class TestBatchStatus:
+    def batch_event(self, submissions):
+        return {
+            "httpMethod": "POST",
+            "requestContext": {"authorizer": {"user_id": "my-id"}},
+            "body": json.dumps({"submissions": submissions})
+        }
+
+    def test_batch_status(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.batch_read_status_records = mocker.Mock(return_value={
+            ("abc", "1.0"): {"source_id": "abc", "version": "1.0", "action_id": "action-1",
+                             "original_submission": json.dumps({"title": "abc"})},
+        })
+        dynamo_manager.get_current_version = mocker.Mock(return_value={
+            "source_id": "def", "version": "1.3", "action_id": "action-2",
+            "original_submission": json.dumps({"title": "def"})
+        })
+        mocker.patch("status.DynamoManager", return_value=dynamo_manager)
+        automate_manager = mocker.Mock()
+        automate_manager.get_statuses = mocker.Mock(
+            side_effect=lambda action_ids, deadline=None: {
+                action_id: {"status": "ACTIVE", "action_id": action_id}
+                for action_id in action_ids})
+        mocker.patch("status.AutomateManager", return_value=automate_manager)
+        mocker.patch("status.get_secret")
+        os.environ["MDF_SECRETS_NAME"] = "mdf-secrets"
+        os.environ["MDF_AWS_REGION"] = "us-east-1"
+
+        result = lambda_handler(self.batch_event([
+            {"source_id": "abc", "version": "1.0"},
+            {"source_id": "def"},
+            {"source_id": "ghi", "version": "2.0"}
+        ]), None)
+
+        assert result['statusCode'] == 200
+        attributes = ["source_id", "version", "original_submission", "action_id", "flow_state",
+                      "flow_description"]
+        dynamo_manager.batch_read_status_records.assert_called_once_with(
+            [("abc", "1.0"), ("ghi", "2.0")], fields=attributes)
+        dynamo_manager.get_current_version.assert_called_once_with("def", call_site="status",
+                                                                   fields=attributes)
+        assert automate_manager.authenticate.call_count == 1
+        assert sorted(automate_manager.get_statuses.call_args[0][0]) == ["action-1", "action-2"]
+
+        statuses = json.loads(result['body'])['statuses']
+        assert [s['success'] for s in statuses] == [True, True, False]
+        assert statuses[0]['flow_status']['action_id'] == "action-1"
+        assert statuses[1]['version'] == "1.3"
+        assert statuses[1]['original_submission'] == {"title": "def"}
+
+    def test_batch_status_limit(self, mocker):
+        mocker.patch("status.DynamoManager")
+        os.environ["BATCH_STATUS_MAX_KEYS"] = "2"
+        try:
+            result = lambda_handler(self.batch_event([{"source_id": str(i)} for i in range(3)]),
+                                    None)
+        finally:
+            del os.environ["BATCH_STATUS_MAX_KEYS"]
+        assert result['statusCode'] == 400
+
+
+class TestStatus:
+    def status_event(self, **query):
+        return {
+            "requestContext": {"authorizer": {"user_id": "my-id"}},
+            "pathParameters": {"source_id": "abc"},
+            "queryStringParameters": query or None
+        }
+
+    def test_status_code_only(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.get_current_version = mocker.Mock(return_value={
+            "source_id": "abc", "version": "1.1", "action_id": "action-1",
+            "flow_state": "SUCCEEDED", "flow_description": "Done"
+        })
+        mocker.patch("status.DynamoManager", return_value=dynamo_manager)
+        automate_manager_class = mocker.patch("status.AutomateManager")
+
+        result = lambda_handler(self.status_event(fields="status_code,version"), None)
+
+        assert result['statusCode'] == 200
+        assert json.loads(result['body']) == {"status_code": "S", "version": "1.1"}
+        dynamo_manager.get_current_version.assert_called_once_with(
+            "abc", call_site="status",
+            fields=["source_id", "version", "action_id", "flow_state", "flow_description",
+                    "queued"])
+        # The cached final state is enough, so Globus is not asked
+        automate_manager_class.assert_not_called()
+
+    def test_status_code_running(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.read_status_record = mocker.Mock(return_value={
+            "source_id": "abc", "version": "1.0", "action_id": "action-1"
+        })
+        mocker.patch("status.DynamoManager", return_value=dynamo_manager)
+        automate_manager = mocker.Mock()
+        automate_manager.get_status = mocker.Mock(return_value={
+            "status": "ACTIVE", "details": {"description": "Running"}})
+        mocker.patch("status.AutomateManager", return_value=automate_manager)
+        mocker.patch("status.get_secret")
+
+        result = lambda_handler(self.status_event(version="1.0", fields="status_code"), None)
+
+        assert json.loads(result['body']) == {"status_code": "P"}
+        automate_manager.get_status.assert_called_once_with("action-1", deadline=None)
+
+    def test_unknown_field(self, mocker):
+        dynamo_manager = mocker.Mock()
+        mocker.patch("status.DynamoManager", return_value=dynamo_manager)
+
+        result = lambda_handler(self.status_event(fields="status_code,colour"), None)
+
+        assert result['statusCode'] == 400
+        assert "colour" in json.loads(result['body'])['error']
+        dynamo_manager.get_current_version.assert_not_called()
+
+    def test_etag(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.get_current_version = mocker.Mock(return_value={
+            "source_id": "abc", "version": "1.1", "action_id": "action-1",
+            "flow_state": "SUCCEEDED", "flow_description": "Done"
+        })
+        mocker.patch("status.DynamoManager", return_value=dynamo_manager)
+        automate_manager_class = mocker.patch("status.AutomateManager")
+        format_status_record = mocker.patch("status.format_status_record",
+                                            wraps=status.format_status_record)
+
+        result = lambda_handler(self.status_event(fields="status_code"), None)
+        assert result['statusCode'] == 200
+        tag = result['headers']['etag']
+        assert format_status_record.call_count == 1
+
+        event = self.status_event(fields="status_code")
+        event['headers'] = {"If-None-Match": tag}
+        result = lambda_handler(event, None)
+        assert result['statusCode'] == 304
+        assert result['body'] == ""
+        assert result['headers']['etag'] == tag
+        # Nothing is formatted, and Globus is never asked
+        assert format_status_record.call_count == 1
+        automate_manager_class.assert_not_called()
+
+        # A different fieldset is a different response
+        event = self.status_event(fields="status_code,version")
+        event['headers'] = {"If-None-Match": tag}
+        assert lambda_handler(event, None)['statusCode'] == 200
+
+    def test_etag_default_fields(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.get_current_version = mocker.Mock(return_value={
+            "source_id": "abc", "version": "1.1", "action_id": "action-1",
+            "flow_state": "SUCCEEDED", "flow_description": "Done",
+            "original_submission": json.dumps({"title": "abc"})
+        })
+        mocker.patch("status.DynamoManager", return_value=dynamo_manager)
+        automate_manager_class = mocker.patch("status.AutomateManager")
+
+        result = lambda_handler(self.status_event(), None)
+        assert result['statusCode'] == 200
+        # The finished flow's status is served from the record
+        assert json.loads(result['body'])['flow_status'] == {
+            "status": "SUCCEEDED", "details": {"description": "Done"}}
+
+        event = self.status_event()
+        event['headers'] = {"If-None-Match": result['headers']['etag']}
+        assert lambda_handler(event, None)['statusCode'] == 304
+        automate_manager_class.assert_not_called()
+
+    def test_etag_running_flow(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.get_current_version = mocker.Mock(return_value={
+            "source_id": "abc", "version": "1.0", "action_id": "action-1"
+        })
+        mocker.patch("status.DynamoManager", return_value=dynamo_manager)
+        automate_manager = mocker.Mock()
+        automate_manager.get_status = mocker.Mock(side_effect=[
+            {"status": "ACTIVE", "details": {"description": "Running"}},
+            {"status": "SUCCEEDED", "details": {"description": "Done"}}
+        ])
+        mocker.patch("status.AutomateManager", return_value=automate_manager)
+        mocker.patch("status.get_secret")
+
+        tag = lambda_handler(self.status_event(fields="status_code"), None)['headers']['etag']
+
+        # The flow has finished since, so the client's copy is stale
+        event = self.status_event(fields="status_code")
+        event['headers'] = {"if-none-match": tag}
+        result = lambda_handler(event, None)
+        assert result['statusCode'] == 200
+        assert json.loads(result['body']) == {"status_code": "S"}
+        dynamo_manager.set_flow_state.assert_called_once_with(
+            "abc", "1.0", {"status": "SUCCEEDED", "details": {"description": "Done"}})
+
+    def running_flow(self, mocker, *states):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.get_current_version = mocker.Mock(return_value={
+            "source_id": "abc", "version": "1.0", "action_id": "action-1"
+        })
+        mocker.patch("status.DynamoManager", return_value=dynamo_manager)
+        automate_manager = mocker.Mock()
+        automate_manager.get_status = mocker.Mock(side_effect=[
+            {"status": state, "details": {"description": state}} for state in states])
+        mocker.patch("status.AutomateManager", return_value=automate_manager)
+        mocker.patch("status.get_secret")
+        # A fake clock, so the test does not sleep
+        clock = [0.0]
+        mock_time = mocker.patch("status.time")
+        mock_time.monotonic = mocker.Mock(side_effect=lambda: clock[0])
+        mock_time.sleep = mocker.Mock(side_effect=lambda s: clock.__setitem__(0, clock[0] + s))
+        mocker.patch("retry.time", mock_time)
+        return automate_manager, mock_time
+
+    def test_wait_for_change(self, mocker):
+        automate_manager, mock_time = self.running_flow(
+            mocker, "ACTIVE", "ACTIVE", "ACTIVE", "SUCCEEDED")
+
+        tag = lambda_handler(self.status_event(fields="status_code"), None)['headers']['etag']
+        result = lambda_handler(self.status_event(fields="status_code", wait="20", since=tag),
+                                None)
+
+        assert result['statusCode'] == 200
+        assert json.loads(result['body']) == {"status_code": "S"}
+        # Checks are quick at first, and back off while nothing changes
+        assert [c[0][0] for c in mock_time.sleep.call_args_list] == [1.0, 2.0]
+        # One authentication serves every check
+        assert automate_manager.authenticate.call_count == 2
+
+    def test_wait_times_out(self, mocker):
+        automate_manager, mock_time = self.running_flow(mocker, *["ACTIVE"] * 10)
+
+        tag = lambda_handler(self.status_event(fields="status_code"), None)['headers']['etag']
+        event = self.status_event(fields="status_code", wait="5")
+        event['headers'] = {"If-None-Match": tag}
+        result = lambda_handler(event, None)
+
+        assert result['statusCode'] == 304
+        assert [c[0][0] for c in mock_time.sleep.call_args_list] == [1.0, 2.0]
+
+    def test_wait_bounded_by_lambda(self, mocker):
+        automate_manager, mock_time = self.running_flow(mocker, *["ACTIVE"] * 10)
+        context = mocker.Mock()
+        context.get_remaining_time_in_millis = mocker.Mock(return_value=3000)
+
+        tag = lambda_handler(self.status_event(fields="status_code"), None)['headers']['etag']
+        result = lambda_handler(self.status_event(fields="status_code", wait="60", since=tag),
+                                context)
+
+        assert result['statusCode'] == 304
+        assert [c[0][0] for c in mock_time.sleep.call_args_list] == [1.0]
+
+    def test_history(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.query_version_history = mocker.Mock(return_value={
+            "success": True,
+            "versions": [{"source_id": "abc", "version": "1.10", "previous_version": "1.9",
+                          "submission_time": "2023-10-02T00:00:00Z", "action_id": "action-2"},
+                         {"source_id": "abc", "version": "1.9", "previous_version": "1.8",
+                          "submission_time": "2023-10-01T00:00:00Z", "action_id": "action-1",
+                          "flow_state": "SUCCEEDED", "flow_description": "Done"}],
+            "next_cursor": "next-page"
+        })
+        mocker.patch("status.DynamoManager", return_value=dynamo_manager)
+        event = self.status_event(limit="2")
+        event["resource"] = "/status/{source_id}/history"
+
+        result = lambda_handler(event, None)
+
+        assert result['statusCode'] == 200
+        body = json.loads(result['body'])
+        assert [v['version'] for v in body['versions']] == ["1.10", "1.9"]
+        assert [v['final_state'] for v in body['versions']] == [None, "SUCCEEDED"]
+        assert body['next_cursor'] == "next-page"
+        dynamo_manager.query_version_history.assert_called_once_with("abc", limit=2,
+                                                                     cursor=None)
+
+        event["queryStringParameters"] = {"limit": "1000"}
+        assert lambda_handler(event, None)['statusCode'] == 400
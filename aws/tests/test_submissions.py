@@ -0,0 +1,215 @@
+import json
+import os
+
+from submissions import lambda_handler
+
+
+class TestSubmissions:
+    def status_record(self, source_id, **kwargs):
+        record = {
+            "source_id": source_id,
+            "version": "1.0",
+            "title": "Dataset " + source_id,
+            "submitter": "Bob Dobolina",
+            "submission_time": "2023-10-01T00:00:00Z",
+            "test": False,
+            "original_submission": json.dumps({"source_id": source_id})
+        }
+        record.update(kwargs)
+        return record
+
+    def test_list_submissions(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.scan_table = mocker.Mock(return_value={
+            "success": True,
+            "results": [
+                self.status_record("done", action_id="action-1", flow_state="SUCCEEDED",
+                                   flow_description="The Flow run reached a successful"
+                                                    " completion state"),
+                self.status_record("running", action_id="action-2"),
+                self.status_record("finishing", action_id="action-3"),
+                self.status_record("legacy")
+            ]
+        })
+        mocker.patch("submissions.DynamoManager", return_value=dynamo_manager)
+        automate_manager = mocker.Mock()
+        automate_manager.get_statuses = mocker.Mock(return_value={
+            "action-2": {"status": "ACTIVE", "details": {"description": "Running"}},
+            "action-3": {"status": "FAILED", "details": {"description": "Failed"}}
+        })
+        mocker.patch("submissions.AutomateManager", return_value=automate_manager)
+        mocker.patch("submissions.get_secret")
+        os.environ["MDF_SECRETS_NAME"] = "mdf-secrets"
+        os.environ["MDF_AWS_REGION"] = "us-east-1"
+
+        result = lambda_handler({
+            "requestContext": {"authorizer": {"user_id": "my-id"}},
+            "pathParameters": None,
+            "body": "{}"
+        }, None)
+
+        assert result['statusCode'] == 200
+        # Runs with a cached final state are not looked up again
+        assert sorted(automate_manager.get_statuses.call_args[0][0]) == ["action-2", "action-3"]
+        dynamo_manager.set_flow_state.assert_called_once_with(
+            "finishing", "1.0", {"status": "FAILED", "details": {"description": "Failed"}})
+
+        submissions = {sub['source_id']: sub for sub in json.loads(result['body'])['submissions']}
+        assert submissions['done']['status_code'] == "S"
+        assert submissions['running']['status_code'] == "P"
+        assert submissions['running']['active']
+        assert submissions['finishing']['status_code'] == "F"
+        assert submissions['legacy']['status_code'] == "U"
+        assert submissions['legacy']['description'] == "Submission prior to GlobusAutomate"
+
+    def test_finished_submissions_skip_globus(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.scan_table = mocker.Mock(return_value={
+            "success": True,
+            "results": [self.status_record("done", action_id="action-1",
+                                           flow_state="SUCCEEDED")]
+        })
+        mocker.patch("submissions.DynamoManager", return_value=dynamo_manager)
+        automate_manager_class = mocker.patch("submissions.AutomateManager")
+
+        result = lambda_handler({
+            "requestContext": {"authorizer": {"user_id": "my-id"}},
+            "pathParameters": None,
+            "body": "{}"
+        }, None)
+
+        assert result['statusCode'] == 200
+        automate_manager_class.assert_not_called()
+
+    def test_sparse_fields(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.scan_table = mocker.Mock(return_value={
+            "success": True,
+            "results": [{"source_id": "running", "version": "1.0", "title": "Running"}]
+        })
+        mocker.patch("submissions.DynamoManager", return_value=dynamo_manager)
+        automate_manager_class = mocker.patch("submissions.AutomateManager")
+
+        result = lambda_handler({
+            "requestContext": {"authorizer": {"user_id": "my-id"}},
+            "pathParameters": None,
+            "body": json.dumps({"fields": ["source_id", "title"]})
+        }, None)
+
+        assert result['statusCode'] == 200
+        assert dynamo_manager.scan_table.call_args[1]['fields'] == \
+            ["source_id", "version", "title"]
+        # No flow state was asked for, so Globus is not called
+        automate_manager_class.assert_not_called()
+        assert json.loads(result['body'])['submissions'] == [{"source_id": "running",
+                                                              "title": "Running"}]
+
+    def test_etag(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.scan_table = mocker.Mock(return_value={
+            "success": True,
+            "results": [self.status_record("done", action_id="action-1",
+                                           flow_state="SUCCEEDED")]
+        })
+        mocker.patch("submissions.DynamoManager", return_value=dynamo_manager)
+        event = {
+            "requestContext": {"authorizer": {"user_id": "my-id"}},
+            "pathParameters": None,
+            "body": "{}"
+        }
+
+        tag = lambda_handler(event, None)['headers']['etag']
+        result = lambda_handler(dict(event, headers={"If-None-Match": 'W/"old", ' + tag}), None)
+        assert result['statusCode'] == 304
+
+        dynamo_manager.scan_table.return_value["results"][0]["flow_description"] = "Changed"
+        result = lambda_handler(dict(event, headers={"If-None-Match": tag}), None)
+        assert result['statusCode'] == 200
+
+    def test_etag_running_flows(self, mocker):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.scan_table = mocker.Mock(return_value={
+            "success": True,
+            "results": [self.status_record("running", action_id="action-1", code="Pzzzzz")]
+        })
+        mocker.patch("submissions.DynamoManager", return_value=dynamo_manager)
+        automate_manager = mocker.Mock()
+        automate_manager.get_statuses = mocker.Mock(return_value={
+            "action-1": {"status": "ACTIVE", "details": {"description": "Running"}}})
+        mocker.patch("submissions.AutomateManager", return_value=automate_manager)
+        mocker.patch("submissions.get_secret")
+        event = {
+            "requestContext": {"authorizer": {"user_id": "my-id"}},
+            "pathParameters": None,
+            "body": json.dumps({"fields": ["source_id", "status_code"]})
+        }
+
+        tag = lambda_handler(event, None)['headers']['etag']
+        assert automate_manager.get_statuses.call_count == 1
+        assert "code" in dynamo_manager.scan_table.call_args[1]['fields']
+
+        # Unchanged, so Globus is not asked again
+        result = lambda_handler(dict(event, headers={"If-None-Match": tag}), None)
+        assert result['statusCode'] == 304
+        assert automate_manager.get_statuses.call_count == 1
+
+        # The reconciler recorded progress
+        dynamo_manager.scan_table.return_value["results"][0]["code"] = "SPzzzz"
+        result = lambda_handler(dict(event, headers={"If-None-Match": tag}), None)
+        assert result['statusCode'] == 200
+
+    def test_bad_offset(self, mocker):
+        dynamo_manager = mocker.Mock()
+        mocker.patch("submissions.DynamoManager", return_value=dynamo_manager)
+        for offset in ("x", -1, None):
+            result = lambda_handler({
+                "requestContext": {"authorizer": {"user_id": "my-id"}},
+                "pathParameters": None,
+                "body": json.dumps({"offset": offset})
+            }, None)
+            assert result['statusCode'] == 400
+            assert "offset" in json.loads(result['body'])['error']
+        dynamo_manager.scan_table.assert_not_called()
+
+    def test_stage_timings(self, mocker, capsys):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.scan_table = mocker.Mock(return_value={
+            "success": True,
+            "results": [self.status_record("running", action_id="action-2")]
+        })
+        mocker.patch("submissions.DynamoManager", return_value=dynamo_manager)
+        automate_manager = mocker.Mock()
+        automate_manager.get_statuses = mocker.Mock(return_value={
+            "action-2": {"status": "ACTIVE", "details": {"description": "Running"}}
+        })
+        mocker.patch("submissions.AutomateManager", return_value=automate_manager)
+        mocker.patch("submissions.get_secret")
+        mocker.patch.dict(os.environ, {"MDF_SECRETS_NAME": "mdf-secrets",
+                                       "MDF_AWS_REGION": "us-east-1",
+                                       "STAGE_METRICS_MODE": "emf"})
+        event = {
+            "requestContext": {"authorizer": {"user_id": "my-id"}},
+            "pathParameters": None,
+            "body": "{}"
+        }
+
+        result = lambda_handler(event, None)
+        timings = [metric.split(";")[0]
+                   for metric in result['headers']['Server-Timing'].split(", ")]
+        assert timings == ["scan_status", "get_secret", "authenticate", "flow_status",
+                           "total"]
+
+        # One metrics record per invocation, in Embedded Metric Format
+        records = [json.loads(line) for line in capsys.readouterr().out.splitlines()
+                   if line.startswith('{"scan_status"')]
+        assert len(records) == 1
+        assert records[0]['handler'] == "submissions"
+        metrics = records[0]['_aws']['CloudWatchMetrics'][0]
+        assert metrics['Dimensions'] == [["handler"]]
+        assert [metric['Name'] for metric in metrics['Metrics']] == timings
+        assert all(records[0][name] >= 0 for name in timings)
+
+        os.environ["STAGE_METRICS_MODE"] = "off"
+        result = lambda_handler(event, None)
+        assert 'Server-Timing' not in result['headers']
+        assert '_aws' not in capsys.readouterr().out
@@ -2,6 +2,8 @@ import json
 
 from pytest_bdd import scenario, given, then, parsers
 
+from job_queue import local_queue
+
 fake_uuid = "abcdefgh-1234-4321-zyxw-hgfedcba"
 
 
@@ -48,6 +50,14 @@ def test_mint_doi():
 def test_not_member_of_globus_group():
     pass
 
+@scenario('submit_dataset.feature', 'Queue a submission for the submit worker')
+def test_queued_submission():
+    pass
+
+@scenario('submit_dataset.feature', 'Attempt to submit a dataset containing NaN')
+def test_submit_nan():
+    pass
+
 @given('I have an update to another users record', target_fixture='mdf_submission')
 def mdf_other_user_datset(mdf, mdf_environment, mocker):
     mdf.set_source_name("my dataset")
@@ -66,6 +76,23 @@ def not_member_of_globus_group(mdf_environment):
     mdf_environment['authorizer']['group_info'] = "{}"
     return mdf_environment
 
+@given("the submission contains NaN", target_fixture='mdf_submission')
+def submission_contains_nan(mdf_submission):
+    mdf_submission["dc"]["titles"][0]["title"] = float("nan")
+    return mdf_submission
+
+
+@then("no dynamo record should be created")
+def no_dynamo_record(mdf_environment):
+    mdf_environment["dynamo_manager"].create_status.assert_not_called()
+
+
+@given("submissions are queued")
+def submissions_queued(monkeypatch):
+    monkeypatch.setenv("SUBMIT_MODE", "queued")
+    monkeypatch.delenv("SUBMIT_QUEUE_URL", raising=False)
+    local_queue.messages.clear()
+
 @given('I have an update for an existing dataset', target_fixture='mdf_submission')
 def mdf_other_user_datset(mdf, mdf_environment, mocker):
     mdf.set_source_name("my dataset")
@@ -244,14 +271,41 @@ def check_skip_file_transfer(mdf_environment):
     return automate_record
 
 
-@then("the previous_versions field should be empty")
-def previous_versions_field_empty(dynamo_record):
-    assert dynamo_record['previous_versions'] == []
+@then("a queued dynamo record should be created")
+def check_queued_record(mdf_environment):
+    dynamo_record = mdf_environment['dynamo_manager'].create_status.call_args[0][0]
+    assert dynamo_record['source_id'] == mdf_environment['source_id']
+    assert dynamo_record['queued']
+    assert 'action_id' not in dynamo_record
+
+
+@then("no automate flow started")
+def check_no_flow(mdf_environment):
+    mdf_environment['automate_manager'].submit.assert_not_called()
+    mdf_environment['automate_manager'].authenticate.assert_not_called()
+
+
+@then("the submission should be queued for the submit worker")
+def check_queued_job(mdf_environment):
+    records = local_queue.receive()["Records"]
+    assert len(records) == 1
+    job = json.loads(records[0]['body'])
+    assert job['source_id'] == mdf_environment['source_id']
+    assert job['version'] == "1.0"
+    assert job['submitting_user_token'] == '12sdfkj23-8j'
+    assert job['metadata']['mdf']['versioned_source_id'] == fake_uuid + "-1.0"
+
+
+@then("the previous_version field should be empty")
+def previous_version_field_empty(dynamo_record):
+    assert 'previous_version' not in dynamo_record
+    assert 'previous_versions' not in dynamo_record
 
 
-@then("the previous_versions field should be ['my dataset-1.0']")
-def previous_versions_after_update(dynamo_record):
-    assert dynamo_record['previous_versions'] == ['my dataset-1.0']
+@then(parsers.parse("the previous_version field should be {version}"))
+def previous_version_after_update(dynamo_record, version):
+    assert dynamo_record['previous_version'] == version
+    assert 'previous_versions' not in dynamo_record
 
 
 @then(
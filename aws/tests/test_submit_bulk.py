@@ -0,0 +1,204 @@
+import json
+import os
+import threading
+from copy import deepcopy
+
+from retry import CircuitBreaker, RetriesExhausted
+from submit import lambda_handler
+
+authorizer = {
+    "identities": "['me']",
+    "user_id": "my-id",
+    "principalId": "principal@foo.com",
+    "name": "Bob Dobolina",
+    "globus_dependent_token": "{'0c7ee169-cefc-4a23-81e1-dc323307c863': '12sdfkj23-8j'}",
+    "user_email": "test@foo.com",
+    "group_info": "{'123-45-6789-123': {'name': 'my-group', 'description': 'my-group-description'}}",
+}
+
+
+class TestSubmitBulk:
+    def setup_method(self):
+        os.environ["RUN_AS_SCOPE"] = "0c7ee169-cefc-4a23-81e1-dc323307c863"
+        os.environ["MONITOR_BY_GROUP"] = "urn:groups:my-group"
+        os.environ["SEARCH_INDEX_UUID"] = "098-765-4321"
+        os.environ["TEST_SEARCH_INDEX_UUID"] = "https://test-search.index"
+        os.environ["REQUIRED_GROUP_MEMBERSHIP"] = "123-45-6789-123"
+        os.environ["MDF_SECRETS_NAME"] = "mdf-secrets"
+        os.environ["MDF_AWS_REGION"] = "us-east-1"
+
+    def submit_bulk(self, mocker, submissions, launch_error=None, body=None,
+                    current_version=None, set_action_id=None):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.get_current_version = mocker.Mock(side_effect=current_version,
+                                                         return_value=None)
+        dynamo_manager.create_statuses = mocker.Mock(
+            side_effect=lambda statuses: [
+                {"success": False,
+                 "error": "ID taken already exists in status database"}
+                if status["source_id"] == "taken" else {"success": True}
+                for status in statuses])
+        dynamo_manager.set_action_id = mocker.Mock(side_effect=set_action_id,
+                                                   return_value={"success": True})
+        dynamo_manager_class = mocker.patch("submit.DynamoManager", return_value=dynamo_manager)
+        dynamo_manager_class.increment_record_version = mocker.Mock(return_value="1.0")
+
+        automate_manager = mocker.Mock()
+        automate_manager.submit = mocker.Mock(
+            side_effect=launch_error or (
+                lambda **kwargs: "action-" + kwargs["mdf_rec"]["mdf"]["source_id"]))
+        mocker.patch("submit.AutomateManager", return_value=automate_manager)
+        mocker.patch("submit.get_secret")
+        mocker.patch("submit.uuid.uuid4", side_effect=["uuid-1", "uuid-2", "uuid-3"])
+
+        result = lambda_handler({
+            "resource": "/submit/bulk",
+            "requestContext": {"authorizer": authorizer},
+            "headers": {"authorization": "Bearer 1209hkehjwerkhjre"},
+            "body": body or json.dumps({"submissions": submissions}),
+        }, None)
+        return result, dynamo_manager, automate_manager
+
+    def test_partial_failure(self, mocker, mdf):
+        mdf.update = False
+        submission = mdf.get_submission()
+        invalid = deepcopy(submission)
+        invalid["mdf"] = {"organization": "No Such Organization"}
+        taken = deepcopy(submission)
+        taken["mdf"] = {"source_name": "taken"}
+        named = deepcopy(submission)
+        named["mdf"] = {"source_name": "named"}
+
+        result, dynamo_manager, automate_manager = self.submit_bulk(
+            mocker, [submission, invalid, taken, named, deepcopy(named)])
+
+        assert result["statusCode"] == 207
+        results = json.loads(result["body"])["results"]
+        assert [res["index"] for res in results] == [0, 1, 2, 3, 4]
+        assert [res["success"] for res in results] == [True, False, False, True, False]
+        assert results[0]["source_id"] == "uuid-1"
+        assert results[1]["status_code"] == 400
+        assert "not found" in results[1]["error"]
+        assert results[2]["status_code"] == 409
+        assert results[3] == {"index": 3, "success": True, "source_id": "named",
+                              "version": "1.0"}
+        assert results[4]["status_code"] == 400
+
+        # Every accepted version is created with one call
+        dynamo_manager.create_statuses.assert_called_once()
+        statuses = dynamo_manager.create_statuses.call_args[0][0]
+        assert [status["source_id"] for status in statuses] == ["uuid-1", "taken", "named"]
+        assert all(status["queued"] for status in statuses)
+        # Only the records that were created get a flow
+        assert automate_manager.submit.call_count == 2
+        assert sorted(c[0] for c in dynamo_manager.set_action_id.call_args_list) == [
+            ("named", "1.0", "action-named"), ("uuid-1", "1.0", "action-uuid-1")]
+        # Each stage is timed once in total, however many items went through it
+        timings = [metric.split(";")[0]
+                   for metric in result["headers"]["Server-Timing"].split(", ")]
+        for name in ("authorizer", "parse", "prepare", "create_status",
+                     "get_secret", "authenticate", "run_flow", "total"):
+            assert timings.count(name) == 1
+
+    def test_items_prepared_in_parallel(self, mocker, mdf, monkeypatch):
+        monkeypatch.setenv("BULK_LAUNCH_WORKERS", "3")
+        # Each lookup waits for the others, so the items only get through if
+        # they are prepared at the same time
+        barrier = threading.Barrier(3, timeout=5)
+
+        def current_version(source_name, **kwargs):
+            barrier.wait()
+            return None
+
+        mdf.update = False
+        submissions = []
+        for source_name in ("a", "b", "c"):
+            submission = mdf.get_submission()
+            submission["mdf"] = {"source_name": source_name}
+            submissions.append(submission)
+
+        result, dynamo_manager, _ = self.submit_bulk(mocker, submissions,
+                                                     current_version=current_version)
+
+        assert result["statusCode"] == 202
+        assert dynamo_manager.get_current_version.call_count == 3
+
+    def test_launch_failure(self, mocker, mdf):
+        mdf.update = False
+        submission = mdf.get_submission()
+        result, _, _ = self.submit_bulk(mocker, [deepcopy(submission)])
+        assert result["statusCode"] == 202
+
+        result, dynamo_manager, _ = self.submit_bulk(
+            mocker, [submission], launch_error=ValueError("Flow not found"))
+        assert result["statusCode"] == 207
+        assert json.loads(result["body"])["results"][0]["status_code"] == 500
+        assert dynamo_manager.set_flow_state.call_args[0][2]["status"] == "FAILED"
+
+    def test_authentication_failure(self, mocker, mdf):
+        mdf.update = False
+        submission = mdf.get_submission()
+        mocker.patch("submit.new_automate_manager",
+                     side_effect=ValueError("Unable to read secret"))
+        result, dynamo_manager, _ = self.submit_bulk(mocker, [submission])
+        # The queued record is failed, instead of left for no one to start
+        assert result["statusCode"] == 207
+        assert json.loads(result["body"])["results"][0]["status_code"] == 500
+        assert dynamo_manager.set_flow_state.call_args[0][0] == "uuid-1"
+        assert dynamo_manager.set_flow_state.call_args[0][2]["status"] == "FAILED"
+
+    def test_action_id_not_recorded(self, mocker, mdf):
+        mdf.update = False
+        submission = mdf.get_submission()
+        result, dynamo_manager, automate_manager = self.submit_bulk(
+            mocker, [submission], set_action_id=RetriesExhausted("throttled"))
+        # The flow started, so a retry must not be invited
+        assert result["statusCode"] == 202
+        assert automate_manager.submit.call_count == 1
+        dynamo_manager.set_flow_state.assert_not_called()
+
+    def test_too_many(self, mocker, mdf, monkeypatch):
+        monkeypatch.setenv("BULK_SUBMIT_MAX_ITEMS", "2")
+        result, dynamo_manager, _ = self.submit_bulk(mocker, [mdf.get_submission()] * 3)
+        assert result["statusCode"] == 400
+        dynamo_manager.create_statuses.assert_not_called()
+
+    def test_non_finite_numbers(self, mocker, mdf):
+        body = json.dumps({"submissions": [mdf.get_submission()]})
+        # A long mantissa overflows with a two digit exponent
+        for literal in ("NaN", "-Infinity", "1e999", "9" * 250 + "e99"):
+            result, dynamo_manager, _ = self.submit_bulk(
+                mocker, None, body=body.replace('"How to make a dataset"', literal))
+            assert result["statusCode"] == 400
+            assert "NaN or Infinity" in json.loads(result["body"])["error"]
+            dynamo_manager.create_statuses.assert_not_called()
+        # Large exponents that stay finite are fine
+        result, _, _ = self.submit_bulk(
+            mocker, None, body=body.replace('"data_sources"', '"size": 1.5e100, "data_sources"'))
+        assert result["statusCode"] == 202
+
+    def test_flows_unavailable(self, mocker, mdf, monkeypatch):
+        mdf.update = False
+        submission = mdf.get_submission()
+        result, dynamo_manager, _ = self.submit_bulk(
+            mocker, [deepcopy(submission)],
+            launch_error=RetriesExhausted("Flows is down", retry_after=5))
+        assert result["statusCode"] == 207
+        assert json.loads(result["body"])["results"][0]["status_code"] == 503
+        assert dynamo_manager.set_flow_state.call_args[0][2]["status"] == "FAILED"
+
+        # With a queue, the submit worker starts the flows once Flows recovers
+        monkeypatch.setenv("SUBMIT_QUEUE_URL", "https://sqs.example/submit")
+        job_queue = mocker.Mock()
+        mocker.patch("submit.job_queue_from_env", return_value=job_queue)
+        breaker = CircuitBreaker("Globus Flows", failure_threshold=1)
+        breaker.on_failure()
+        mocker.patch("submit.flows_breaker", breaker)
+        result, dynamo_manager, automate_manager = self.submit_bulk(
+            mocker, [deepcopy(submission)])
+        assert result["statusCode"] == 202
+        assert json.loads(job_queue.send.call_args[0][0])["source_id"] == "uuid-1"
+        # An open circuit means Globus isn't called at all
+        automate_manager.authenticate.assert_not_called()
+        automate_manager.submit.assert_not_called()
+        dynamo_manager.set_flow_state.assert_not_called()
@@ -0,0 +1,136 @@
+import json
+import os
+import time
+from decimal import Decimal
+
+from globus_sdk import GlobusAPIError
+
+import submit_worker
+from job_queue import local_queue
+from organization import OrganizationException
+from retry import RetriesExhausted
+from submit_worker import lambda_handler
+
+
+def queue_job(source_id, is_test=False):
+    local_queue.send(json.dumps({
+        "source_id": source_id,
+        "version": "1.0",
+        "metadata": {"mdf": {"source_id": source_id, "version": "1.0"}},
+        "organization": "MDF Open",
+        "submitting_user_token": {"access_token": "user-token"},
+        "user_id": "my-id",
+        "user_email": "test@foo.com",
+        "search_index_uuid": "098-765-4321",
+        "data_sources": ["https://app.globus.org/file-manager?origin_id=1&origin_path=/"],
+        "is_test": is_test,
+        "update_metadata_only": False
+    }))
+
+
+def globus_error(status):
+    error = GlobusAPIError.__new__(GlobusAPIError)
+    error.http_status = status
+    error.messages = ["HTTP {}".format(status)]
+    return error
+
+
+class TestSubmitWorker:
+    def setup_method(self):
+        local_queue.messages.clear()
+        submit_worker.automate_managers.clear()
+        os.environ["MDF_SECRETS_NAME"] = "mdf-secrets"
+        os.environ["MDF_AWS_REGION"] = "us-east-1"
+        os.environ["MONITOR_BY_GROUP"] = "urn:groups:my-group"
+
+    def worker_mocks(self, mocker, launched=()):
+        dynamo_manager = mocker.Mock()
+        dynamo_manager.claim_launch = mocker.Mock(
+            side_effect=lambda source_id, version: (
+                {"action_id": "earlier-run"} if source_id in launched else None))
+        dynamo_manager.set_action_id = mocker.Mock(return_value={"success": True})
+        mocker.patch("submit_worker.DynamoManager", return_value=dynamo_manager)
+        automate_manager = mocker.Mock()
+        automate_manager_class = mocker.patch("submit_worker.AutomateManager",
+                                              return_value=automate_manager)
+        mocker.patch("submit_worker.get_secret")
+        mocker.patch("submit.Organization")
+        return dynamo_manager, automate_manager, automate_manager_class
+
+    def test_launch_batch(self, mocker):
+        dynamo_manager, automate_manager, automate_manager_class = self.worker_mocks(
+            mocker, launched=("def",))
+        automate_manager.submit = mocker.Mock(side_effect=["action-1", "action-3"])
+        for source_id in ("abc", "def", "ghi"):
+            queue_job(source_id)
+
+        result = lambda_handler(local_queue.receive(), None)
+
+        assert result == {"batchItemFailures": []}
+        # One authenticated manager serves the whole batch
+        automate_manager_class.assert_called_once()
+        automate_manager.authenticate.assert_called_once()
+        # def was already launched by an earlier delivery of its job
+        assert automate_manager.submit.call_count == 2
+        assert [c[0] for c in dynamo_manager.set_action_id.call_args_list] == [
+            ("abc", "1.0", "action-1"), ("ghi", "1.0", "action-3")]
+        assert automate_manager.submit.call_args[1]['monitor_by_id'] == [
+            "urn:globus:auth:identity:my-id", "urn:groups:my-group"]
+
+        # The next batch reuses the manager
+        queue_job("jkl")
+        automate_manager.submit = mocker.Mock(return_value="action-4")
+        lambda_handler(local_queue.receive(), None)
+        automate_manager_class.assert_called_once()
+
+    def test_failures(self, mocker):
+        dynamo_manager, automate_manager, _ = self.worker_mocks(mocker)
+        automate_manager.submit = mocker.Mock(side_effect=[
+            globus_error(503), OrganizationException("Organization not found"),
+            globus_error(403), globus_error(500), TimeoutError("Read timed out"),
+            RetriesExhausted("Giving up after 3 attempts: HTTP 429")])
+        for source_id in ("abc", "def", "ghi", "jkl", "mno", "pqr"):
+            queue_job(source_id)
+        event = local_queue.receive()
+
+        result = lambda_handler(event, None)
+
+        # Only launches that certainly didn't start a run are handed back to
+        # SQS to retry
+        assert result == {"batchItemFailures": [
+            {"itemIdentifier": event["Records"][i]["messageId"]} for i in (0, 5)]}
+        failed = [c[0] for c in dynamo_manager.set_flow_state.call_args_list]
+        assert [(source_id, flow_status["status"]) for source_id, _, flow_status in failed] \
+            == [("def", "FAILED"), ("ghi", "FAILED"), ("jkl", "FAILED"), ("mno", "FAILED")]
+        assert "Organization not found" in failed[0][2]["details"]["description"]
+        # A run may have started before these errors, so they aren't retried
+        assert "may have started" in failed[2][2]["details"]["description"]
+        assert "may have started" in failed[3][2]["details"]["description"]
+        dynamo_manager.set_action_id.assert_not_called()
+        # The retried jobs give their claims back for the next delivery
+        assert [c[0][0] for c in dynamo_manager.release_launch.call_args_list] == [
+            "abc", "pqr"]
+
+    def test_claimed_launches(self, mocker):
+        dynamo_manager, automate_manager, _ = self.worker_mocks(mocker)
+        now = time.time()
+        dynamo_manager.claim_launch = mocker.Mock(side_effect=[
+            {"launching_since": Decimal(int(now))}, {"launching_since": Decimal(int(now) - 600)},
+            {}])
+        for source_id in ("abc", "def", "ghi"):
+            queue_job(source_id)
+        event = local_queue.receive()
+
+        result = lambda_handler(event, None)
+
+        # A launch another delivery is making is left to it, and checked again
+        # on the next delivery
+        assert result == {"batchItemFailures": [
+            {"itemIdentifier": event["Records"][0]["messageId"]}]}
+        automate_manager.submit.assert_not_called()
+        dynamo_manager.release_launch.assert_not_called()
+        # A claim left by a worker that timed out may have started a run
+        failed = dynamo_manager.set_flow_state.call_args[0]
+        assert failed[0] == "def"
+        assert "may have started" in failed[2]["details"]["description"]
+        dynamo_manager.set_flow_state.assert_called_once()
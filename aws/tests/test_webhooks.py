@@ -0,0 +1,97 @@
+import hashlib
+import hmac
+import json
+import socket
+
+import pytest
+import requests
+
+from webhooks import deliver, sign, validate_url
+
+
+def resolve(mocker, hosts):
+    """Resolve host names from hosts instead of DNS. Addresses resolve to
+    themselves."""
+    def getaddrinfo(host, port, proto=0):
+        if ":" in host or host.replace(".", "").isdigit():
+            hosts[host] = [host]
+        if host not in hosts:
+            raise socket.gaierror("Name or service not known")
+        return [(socket.AF_INET6 if ":" in address else socket.AF_INET, socket.SOCK_STREAM,
+                 proto, "", (address, port)) for address in hosts[host]]
+    return mocker.patch("webhooks.socket.getaddrinfo", side_effect=getaddrinfo)
+
+
+class TestWebhooks:
+    @pytest.fixture(autouse=True)
+    def public_dns(self, mocker):
+        return resolve(mocker, {"example.com": ["93.184.216.34", "2606:2800:220:1::"]})
+
+    def test_sign(self):
+        body = json.dumps({"state": "SUCCEEDED"}).encode("utf-8")
+        expected = hmac.new(b"shh", b"1700000000." + body, hashlib.sha256).hexdigest()
+        assert sign("shh", "1700000000", body) == "sha256=" + expected
+
+    def test_validate_url(self, mocker):
+        assert validate_url("https://example.com/hook") is None
+        assert validate_url("http://example.com/hook")
+        assert validate_url("https:///hook")
+        assert validate_url(None)
+        assert validate_url("https://unknown.example.com/hook")
+        # Only public addresses
+        for address in ("169.254.169.254", "127.0.0.1", "10.0.0.5", "192.168.1.1",
+                        "100.64.0.1", "0.0.0.0", "224.0.0.1", "::1", "fd00::1",
+                        "::ffff:127.0.0.1"):
+            assert validate_url("https://{}/hook".format(
+                "[{}]".format(address) if ":" in address else address)) \
+                == "Webhook URL must resolve to a public address"
+        # Every address a host resolves to is checked
+        resolve(mocker, {"internal.example.com": ["93.184.216.34", "10.0.0.5"]})
+        assert validate_url("https://internal.example.com/hook")
+
+    def test_deliver_retries(self, mocker):
+        mocker.patch("retry.time.sleep")
+        post = mocker.patch("webhooks.requests.post", side_effect=[
+            requests.ConnectionError("refused"),
+            mocker.Mock(status_code=503),
+            mocker.Mock(status_code=204)
+        ])
+        subscription = {"url": "https://example.com/hook", "secret": "shh"}
+        event = {"event": "submission.state_changed", "state": "SUCCEEDED"}
+
+        res = deliver(subscription, event)
+
+        assert res["success"]
+        assert post.call_count == 3
+        headers = [c[1]["headers"] for c in post.call_args_list]
+        # Retries are the same delivery
+        assert len({h["X-MDF-Delivery"] for h in headers}) == 1
+        body = post.call_args[1]["data"]
+        assert json.loads(body) == event
+        assert headers[-1]["X-MDF-Signature"] == sign("shh", headers[-1]["X-MDF-Timestamp"],
+                                                      body)
+
+    def test_deliver_gives_up(self, mocker):
+        mocker.patch("retry.time.sleep")
+        post = mocker.patch("webhooks.requests.post", return_value=mocker.Mock(status_code=500))
+        res = deliver({"url": "https://example.com/hook", "secret": "shh"},
+                      {"event": "submission.state_changed"})
+        assert not res["success"]
+        assert post.call_count == 4
+
+    def test_deliver_rejected(self, mocker):
+        post = mocker.patch("webhooks.requests.post", return_value=mocker.Mock(status_code=410))
+        res = deliver({"url": "https://example.com/hook", "secret": "shh"},
+                      {"event": "submission.state_changed"})
+        assert res == {"success": False, "error": "HTTP 410"}
+        assert post.call_count == 1
+
+    def test_deliver_checks_address(self, mocker):
+        post = mocker.patch("webhooks.requests.post")
+        # Since subscribing, the host has been pointed at the metadata service
+        resolve(mocker, {"example.com": ["169.254.169.254"]})
+        res = deliver({"url": "https://example.com/hook", "secret": "shh"},
+                      {"event": "submission.state_changed"})
+        assert res == {"success": False,
+                       "error": "Webhook URL must resolve to a public address"}
+        post.assert_not_called()
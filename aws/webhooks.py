@@ -0,0 +1,139 @@
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import secrets
+import socket
+import time
+import uuid
+from urllib.parse import urlparse
+
+import requests
+
+from retry import RetriesExhausted, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+# Responses that say the receiver may accept the delivery later
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class WebhookError(Exception):
+    """A delivery failed in a way that is worth retrying."""
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def new_secret():
+    return secrets.token_hex(32)
+
+
+def is_public_address(address):
+    """Is address on the internet, rather than loopback, private, link-local
+    (such as the instance metadata service), reserved, or multicast?"""
+    address = ipaddress.ip_address(address.split("%")[0])
+    if getattr(address, "ipv4_mapped", None):
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+def validate_url(url):
+    """Webhooks are only sent to https URLs whose host resolves to public
+    addresses, so subscribers can't have MDF post to its own network.
+
+    Returns:
+    str: The reason the URL can't be used, or None if it can.
+    """
+    parsed = urlparse(url or "")
+    if parsed.scheme != "https" or not parsed.hostname:
+        return "Webhook URL must be an https URL"
+    try:
+        addresses = socket.getaddrinfo(parsed.hostname, parsed.port or 443,
+                                       proto=socket.IPPROTO_TCP)
+    except (OSError, UnicodeError, ValueError):
+        return "Webhook URL host could not be resolved"
+    if not all(is_public_address(sockaddr[0]) for *_, sockaddr in addresses):
+        return "Webhook URL must resolve to a public address"
+    return None
+
+
+def sign(secret, timestamp, body):
+    """The signature of a delivery, sent in the X-MDF-Signature header.
+
+    Receivers check it by computing the HMAC-SHA256 of "<timestamp>.<body>"
+    with their subscription's secret, and should reject stale timestamps.
+    """
+    message = "{}.".format(timestamp).encode("utf-8") + body
+    return "sha256=" + hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def is_retryable(e):
+    return isinstance(e, (WebhookError, requests.ConnectionError, requests.Timeout))
+
+
+def deliver(subscription, event, deadline=None):
+    """POST an event to a subscriber, retrying transient failures.
+
+    Arguments:
+    subscription (dict): The subscription, with its url and secret.
+    event (dict): The event to send.
+    deadline (float): time.monotonic() value after which no retry is started.
+                      Default None.
+
+    Returns:
+    dict:
+        success (bool): True if the subscriber accepted the event.
+        error (str): If success is False, why not.
+    """
+    # The host may resolve somewhere else than when the subscription was made
+    url_error = validate_url(subscription["url"])
+    if url_error:
+        return {
+            "success": False,
+            "error": url_error
+        }
+
+    body = json.dumps(event, sort_keys=True).encode("utf-8")
+    # Every attempt carries the same delivery ID, so receivers can drop repeats
+    delivery_id = str(uuid.uuid4())
+    retry_policy = RetryPolicy(max_attempts=int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", 4)),
+                               base_delay=0.5, max_delay=5.0, deadline=deadline,
+                               retryable=is_retryable, throttled=lambda e: False)
+
+    def post():
+        timestamp = str(int(time.time()))
+        response = requests.post(subscription["url"], data=body, timeout=float(
+            os.environ.get("WEBHOOK_TIMEOUT", 5)), allow_redirects=False, headers={
+                "Content-Type": "application/json",
+                "User-Agent": "MDF-Connect-Webhooks",
+                "X-MDF-Event": event["event"],
+                "X-MDF-Delivery": delivery_id,
+                "X-MDF-Timestamp": timestamp,
+                "X-MDF-Signature": sign(subscription["secret"], timestamp, body)
+            })
+        if response.status_code in RETRY_STATUS_CODES:
+            raise WebhookError("HTTP {}".format(response.status_code), response.status_code)
+        return response
+
+    def on_retry(e, attempt, delay):
+        logger.warning("Webhook to {} failed ({}), retry {} in {:.2f}s".format(
+            subscription["url"], repr(e), attempt, delay))
+
+    try:
+        response = retry_policy.call(post, on_retry=on_retry)
+    except (RetriesExhausted, requests.RequestException) as e:
+        return {
+            "success": False,
+            "error": repr(e)
+        }
+    if not 200 <= response.status_code < 300:
+        return {
+            "success": False,
+            "error": "HTTP {}".format(response.status_code)
+        }
+    return {
+        "success": True
+    }
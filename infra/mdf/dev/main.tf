@@ -32,11 +32,13 @@ module "lambdas" {
   source = "../modules/lambdas"
 
   env                       = var.env
-  env_vars                  = module.dynamodb.updated_envs
+  env_vars                  = module.queues.updated_envs
   namespace                 = var.namespace
   lambda_execution_role_arn = module.permissions.submit_lambda_invoke_arn
   ecr_repos                 = var.ecr_repos
   resource_tags             = var.resource_tags
+  status_stream_arn         = module.dynamodb.status_stream_arn
+  submit_queue_arn          = module.queues.submit_queue_arn
 
 }
 
@@ -50,12 +52,25 @@ module "dynamodb" {
   dynamodb_read_capacity    = 20
 }
 
+module "queues" {
+  source        = "../modules/queues"
+  env           = var.env
+  namespace     = var.namespace
+  env_vars      = module.dynamodb.updated_envs
+  resource_tags = var.resource_tags
+}
+
 module "permissions" {
   source          = "../modules/permissions"
   env             = var.env
   namespace       = var.namespace
   mdf_secrets_arn = var.mdf_secrets_arn
   dynamo_db_arn   = module.dynamodb.dynamodb_arn
+  subscriptions_table_arn = module.dynamodb.subscriptions_arn
+  idempotency_table_arn = module.dynamodb.idempotency_arn
+  admission_table_arn = module.dynamodb.admission_arn
+  status_stream_arn = module.dynamodb.status_stream_arn
+  submit_queue_arn = module.queues.submit_queue_arn
   legacy_table_arn = "arn:aws:dynamodb:us-east-1:557062710055:table/dev-status-0.4"
 }
 
@@ -75,4 +90,7 @@ module "api_gateway" {
 
   submissions_lambda_invoke_arn    = module.lambdas.submissions_lambda_invoke_arn
   submissions_lambda_function_name = module.lambdas.submissions_lambda_function_name
+
+  notify_lambda_invoke_arn         = module.lambdas.notify_lambda_invoke_arn
+  notify_lambda_function_name      = module.lambdas.notify_lambda_function_name
 }
@@ -37,6 +37,8 @@ variable "env_vars" {
         FLOW_ID="0c7ee169-cefc-4a23-81e1-dc323307c863"
         FLOW_SCOPE= "https://auth.globus.org/scopes/0c7ee169-cefc-4a23-81e1-dc323307c863/flow_0c7ee169_cefc_4a23_81e1_dc323307c863_user"
         REQUIRED_GROUP_MEMBERSHIP="cc192dca-3751-11e8-90c1-0a7c735d220a"
+        DYNAMO_READ_CONSISTENCY="status=eventual"
+        SUBMIT_MODE="queued"
         }
 }
 
@@ -47,6 +49,8 @@ variable "ecr_repos" {
     "submissions" = "557062710055.dkr.ecr.us-east-1.amazonaws.com/mdf-lambdas/submissions"
     "status" = "557062710055.dkr.ecr.us-east-1.amazonaws.com/mdf-lambdas/status"
     "auth" = "557062710055.dkr.ecr.us-east-1.amazonaws.com/mdf-lambdas/auth"
+    "notify" = "557062710055.dkr.ecr.us-east-1.amazonaws.com/mdf-lambdas/notify"
+    "submit_worker" = "557062710055.dkr.ecr.us-east-1.amazonaws.com/mdf-lambdas/submit_worker"
   }
 }
 
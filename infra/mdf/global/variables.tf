@@ -24,5 +24,7 @@ variable "functions" {
         "submit",
         "status",
         "submissions",
+        "notify",
+        "submit_worker",
     ]
 }
\ No newline at end of file
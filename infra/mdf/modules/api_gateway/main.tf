@@ -90,6 +90,16 @@ resource "aws_apigatewayv2_route" "submit_dataset_route" {
   target = "integrations/${aws_apigatewayv2_integration.submit_dataset_integration.id}"
 }
 
+# Many submissions at once, served by the submit function
+resource "aws_apigatewayv2_route" "submit_bulk_route" {
+  api_id    = aws_apigatewayv2_api.mdf_connect_api.id
+  route_key = "POST /submit/bulk"
+  authorizer_id = aws_apigatewayv2_authorizer.mdf_connect_authorizer.id
+  authorization_type = "CUSTOM"
+
+  target = "integrations/${aws_apigatewayv2_integration.submit_dataset_integration.id}"
+}
+
 resource "aws_lambda_permission" "submit_lambda_permission" {
   statement_id  = "AllowExecutionFromAPIGateway"
   action        = "lambda:InvokeFunction"
@@ -117,6 +127,26 @@ resource "aws_apigatewayv2_route" "status_route" {
   target = "integrations/${aws_apigatewayv2_integration.status_integration.id}"
 }
 
+# Status of many submissions at once, served by the status function
+resource "aws_apigatewayv2_route" "batch_status_route" {
+  api_id    = aws_apigatewayv2_api.mdf_connect_api.id
+  route_key = "POST /status"
+  authorizer_id = aws_apigatewayv2_authorizer.mdf_connect_authorizer.id
+  authorization_type = "CUSTOM"
+
+  target = "integrations/${aws_apigatewayv2_integration.status_integration.id}"
+}
+
+# Version history of a dataset, served by the status function
+resource "aws_apigatewayv2_route" "status_history_route" {
+  api_id    = aws_apigatewayv2_api.mdf_connect_api.id
+  route_key = "GET /status/{source_id}/history"
+  authorizer_id = aws_apigatewayv2_authorizer.mdf_connect_authorizer.id
+  authorization_type = "CUSTOM"
+
+  target = "integrations/${aws_apigatewayv2_integration.status_integration.id}"
+}
+
 resource "aws_lambda_permission" "status_lambda_permission" {
   statement_id  = "AllowExecutionFromAPIGateway"
   action        = "lambda:InvokeFunction"
@@ -152,3 +182,31 @@ resource "aws_lambda_permission" "submissions_lambda_permission" {
 
   source_arn = "${aws_apigatewayv2_api.mdf_connect_api.execution_arn}/*/*"
 }
+
+
+# Webhook subscriptions
+resource "aws_apigatewayv2_integration" "notify_integration" {
+  api_id = aws_apigatewayv2_api.mdf_connect_api.id
+
+  integration_type = "AWS_PROXY"
+  integration_uri  = var.notify_lambda_invoke_arn
+}
+
+resource "aws_apigatewayv2_route" "subscriptions_route" {
+  for_each  = toset(["GET", "POST", "DELETE"])
+  api_id    = aws_apigatewayv2_api.mdf_connect_api.id
+  route_key = "${each.key} /subscriptions"
+  authorizer_id = aws_apigatewayv2_authorizer.mdf_connect_authorizer.id
+  authorization_type = "CUSTOM"
+
+  target = "integrations/${aws_apigatewayv2_integration.notify_integration.id}"
+}
+
+resource "aws_lambda_permission" "notify_lambda_permission" {
+  statement_id  = "AllowExecutionFromAPIGateway"
+  action        = "lambda:InvokeFunction"
+  function_name = var.notify_lambda_function_name
+  principal     = "apigateway.amazonaws.com"
+
+  source_arn = "${aws_apigatewayv2_api.mdf_connect_api.execution_arn}/*/*"
+}
@@ -46,3 +46,14 @@ variable "submissions_lambda_function_name" {
 
 
 
+
+
+variable "notify_lambda_invoke_arn" {
+    description = "The invoke ARN of the Notify Lambda function"
+    type        = string
+}
+
+variable "notify_lambda_function_name" {
+    description = "The name of the Notify Lambda function"
+    type        = string
+}
@@ -6,6 +6,9 @@ resource "aws_dynamodb_table" "dynamodb-table" {
   write_capacity = var.dynamodb_write_capacity
   hash_key       = "source_id"
   range_key      = "version"
+  # Changes are streamed to the notify function, which sends them to subscribers
+  stream_enabled   = true
+  stream_view_type = "NEW_AND_OLD_IMAGES"
   attribute {
     name = "source_id"
     type = "S"
@@ -16,6 +19,48 @@ resource "aws_dynamodb_table" "dynamodb-table" {
     type = "S"
   }
 
+  # Zero-padded version, so versions sort numerically in the index
+  attribute {
+    name = "version_order"
+    type = "S"
+  }
+
+  # Set only while the reconciler still follows a record's flow run
+  attribute {
+    name = "active_run"
+    type = "S"
+  }
+
+  attribute {
+    name = "submission_time"
+    type = "S"
+  }
+
+  # A dataset's versions newest-first, with the summary fields history pages show
+  global_secondary_index {
+    name               = "version-order-index"
+    hash_key           = "source_id"
+    range_key          = "version_order"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["previous_version", "previous_versions", "submission_time",
+                          "title", "submitter", "test", "action_id", "flow_state",
+                          "flow_description"]
+    read_capacity      = var.dynamodb_read_capacity
+    write_capacity     = var.dynamodb_write_capacity
+  }
+
+  # Sparse: holds only the records with active_run, so the reconciler reads the
+  # flows in progress without scanning the table
+  global_secondary_index {
+    name               = "active-run-index"
+    hash_key           = "active_run"
+    range_key          = "submission_time"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["action_id", "flow_state", "code", "messages", "log_position"]
+    read_capacity      = var.dynamodb_read_capacity
+    write_capacity     = var.dynamodb_write_capacity
+  }
+
   # Workaround frm https://github.com/hashicorp/terraform-provider-aws/issues/10304#issuecomment-1672617928
   ttl {
     attribute_name = ""
@@ -24,3 +69,79 @@ resource "aws_dynamodb_table" "dynamodb-table" {
 
   tags = var.resource_tags
 }
+
+# Webhook subscriptions, stored under the dataset ("source:<source_id>") or the
+# user ("user:<user_id>") they follow
+resource "aws_dynamodb_table" "subscriptions-table" {
+  name           = "${var.namespace}-subscriptions-${var.env}"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "topic"
+  range_key      = "url"
+  attribute {
+    name = "topic"
+    type = "S"
+  }
+
+  attribute {
+    name = "url"
+    type = "S"
+  }
+
+  attribute {
+    name = "user_id"
+    type = "S"
+  }
+
+  # A user's subscriptions, for GET /subscriptions. Secrets are left out.
+  global_secondary_index {
+    name               = "subscription-user-index"
+    hash_key           = "user_id"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["created"]
+  }
+
+  ttl {
+    attribute_name = ""
+    enabled        = false
+  }
+
+  tags = var.resource_tags
+}
+
+# Idempotency-Key headers of recent submissions, with the hash of each request
+# and its response. Keys expire after IDEMPOTENCY_TTL seconds.
+resource "aws_dynamodb_table" "idempotency-table" {
+  name           = "${var.namespace}-idempotency-${var.env}"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "idempotency_key"
+  attribute {
+    name = "idempotency_key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires"
+    enabled        = true
+  }
+
+  tags = var.resource_tags
+}
+
+# Per-user token buckets that limit how fast submit and status are called,
+# each kept as the time it will next be full. Buckets expire once full.
+resource "aws_dynamodb_table" "admission-table" {
+  name           = "${var.namespace}-admission-${var.env}"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "bucket_key"
+  attribute {
+    name = "bucket_key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires"
+    enabled        = true
+  }
+
+  tags = var.resource_tags
+}
@@ -2,8 +2,31 @@ output "dynamodb_arn" {
   value = aws_dynamodb_table.dynamodb-table.arn
 }
 
+output "status_stream_arn" {
+  value = aws_dynamodb_table.dynamodb-table.stream_arn
+}
+
+output "subscriptions_arn" {
+  value = aws_dynamodb_table.subscriptions-table.arn
+}
+
+output "idempotency_arn" {
+  value = aws_dynamodb_table.idempotency-table.arn
+}
+
+output "admission_arn" {
+  value = aws_dynamodb_table.admission-table.arn
+}
+
 output "updated_envs" {
   value = merge(var.env_vars,
-    { DYNAMO_STATUS_TABLE = aws_dynamodb_table.dynamodb-table.name }
+    { DYNAMO_STATUS_TABLE = aws_dynamodb_table.dynamodb-table.name,
+      DYNAMO_SUBSCRIPTIONS_TABLE = aws_dynamodb_table.subscriptions-table.name,
+      DYNAMO_IDEMPOTENCY_TABLE = aws_dynamodb_table.idempotency-table.name,
+      DYNAMO_ADMISSION_TABLE = aws_dynamodb_table.admission-table.name,
+      ADMISSION_MODE = "dynamo",
+      DYNAMO_VERSION_ORDER_INDEX = "version-order-index",
+      DYNAMO_ACTIVE_RUN_INDEX = "active-run-index",
+      DYNAMO_SUBSCRIPTION_USER_INDEX = "subscription-user-index" }
   )
 }
@@ -8,6 +8,8 @@ locals {
   submit_function_name = "${var.namespace}-submit-${var.env}"
   status_function_name = "${var.namespace}-status-${var.env}"
   submissions_function_name = "${var.namespace}-submissions-${var.env}"
+  notify_function_name = "${var.namespace}-notify-${var.env}"
+  submit_worker_function_name = "${var.namespace}-submit_worker-${var.env}"
 }
 
 resource "aws_lambda_function" "mdf-connect-auth" {
@@ -96,3 +98,89 @@ resource "aws_cloudwatch_log_group" "submissions_log_group" {
   retention_in_days = 5
   tags = var.resource_tags
 }
+
+resource "aws_lambda_function" "mdf-connect-notify" {
+  function_name = local.notify_function_name
+  description   = "Send submission state changes to webhook subscribers"
+
+  image_uri     = "${var.ecr_repos["notify"]}:${var.env}"
+  package_type  = "Image"
+  architectures = ["x86_64"]
+
+  role          = var.lambda_execution_role_arn
+  timeout = 60
+  environment {
+      variables = var.env_vars
+  }
+  depends_on = [aws_cloudwatch_log_group.notify_log_group]
+  tags = var.resource_tags
+}
+
+resource "aws_cloudwatch_log_group" "notify_log_group" {
+  name              = "/aws/lambda/${local.notify_function_name}-${var.env}"
+  retention_in_days = 5
+  tags = var.resource_tags
+}
+
+# Status record changes, which notify turns into webhook deliveries
+resource "aws_lambda_event_source_mapping" "notify_status_stream" {
+  event_source_arn        = var.status_stream_arn
+  function_name           = aws_lambda_function.mdf-connect-notify.arn
+  starting_position       = "LATEST"
+  batch_size              = 25
+  maximum_retry_attempts  = 5
+  function_response_types = ["ReportBatchItemFailures"]
+}
+
+# The reconciler records the final state of flows nobody has polled
+resource "aws_cloudwatch_event_rule" "notify_reconcile" {
+  name                = "${local.notify_function_name}-reconcile"
+  schedule_expression = var.reconcile_schedule
+  tags = var.resource_tags
+}
+
+resource "aws_cloudwatch_event_target" "notify_reconcile" {
+  rule = aws_cloudwatch_event_rule.notify_reconcile.name
+  arn  = aws_lambda_function.mdf-connect-notify.arn
+}
+
+resource "aws_lambda_permission" "notify_reconcile_permission" {
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.mdf-connect-notify.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.notify_reconcile.arn
+}
+
+resource "aws_lambda_function" "mdf-connect-submit-worker" {
+  function_name = local.submit_worker_function_name
+  description   = "Start the flows of queued MDF Connect submissions"
+
+  image_uri     = "${var.ecr_repos["submit_worker"]}:${var.env}"
+  package_type  = "Image"
+  architectures = ["x86_64"]
+
+  role          = var.lambda_execution_role_arn
+  timeout = 60
+  # Bounds the launch rate, alongside FLOW_LAUNCH_RATE within each worker
+  reserved_concurrent_executions = 2
+  environment {
+      variables = var.env_vars
+  }
+  depends_on = [aws_cloudwatch_log_group.submit_worker_log_group]
+  tags = var.resource_tags
+}
+
+resource "aws_cloudwatch_log_group" "submit_worker_log_group" {
+  name              = "/aws/lambda/${local.submit_worker_function_name}-${var.env}"
+  retention_in_days = 5
+  tags = var.resource_tags
+}
+
+resource "aws_lambda_event_source_mapping" "submit_worker_queue" {
+  event_source_arn                   = var.submit_queue_arn
+  function_name                      = aws_lambda_function.mdf-connect-submit-worker.arn
+  batch_size                         = var.flow_launch_batch_size
+  maximum_batching_window_in_seconds = 1
+  function_response_types            = ["ReportBatchItemFailures"]
+}
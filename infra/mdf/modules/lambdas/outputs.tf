@@ -29,3 +29,11 @@ output "submissions_lambda_invoke_arn" {
 output "submissions_lambda_function_name" {
     value = aws_lambda_function.mdf-connect-submissions.function_name
 }
+
+output "notify_lambda_invoke_arn" {
+    value = aws_lambda_function.mdf-connect-notify.invoke_arn
+}
+
+output "notify_lambda_function_name" {
+    value = aws_lambda_function.mdf-connect-notify.function_name
+}
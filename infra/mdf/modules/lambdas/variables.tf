@@ -27,3 +27,25 @@ variable "resource_tags" {
   description = "Tags to apply to all resources."
   type = map(string)
 }
+
+variable "status_stream_arn" {
+  description = "ARN of the status table's DynamoDB stream."
+  type = string
+}
+
+variable "submit_queue_arn" {
+  description = "ARN of the queue of submissions for the submit worker."
+  type = string
+}
+
+variable "flow_launch_batch_size" {
+  description = "Queued submissions the submit worker starts flows for per invocation."
+  type = number
+  default = 10
+}
+
+variable "reconcile_schedule" {
+  description = "How often to check for flows that finished without being polled."
+  type = string
+  default = "rate(5 minutes)"
+}
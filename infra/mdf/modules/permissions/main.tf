@@ -69,18 +69,47 @@ resource "aws_iam_policy" "lambda_dynamodb_policy" {
     Statement = [
       {
         Action   = [
+          "dynamodb:BatchGetItem",
+          "dynamodb:DeleteItem",
           "dynamodb:DescribeTable",
           "dynamodb:GetItem",
           "dynamodb:PutItem",
           "dynamodb:Query",
           "dynamodb:Scan",
+          "dynamodb:UpdateItem",
         ],
         Effect   = "Allow",
         Resource = [
           var.dynamo_db_arn,
-          var.legacy_table_arn
+          "${var.dynamo_db_arn}/index/*",
+          var.legacy_table_arn,
+          var.subscriptions_table_arn,
+          "${var.subscriptions_table_arn}/index/*",
+          var.idempotency_table_arn,
+          var.admission_table_arn
         ]
       },
+      {
+        Action   = [
+          "dynamodb:DescribeStream",
+          "dynamodb:GetRecords",
+          "dynamodb:GetShardIterator",
+          "dynamodb:ListStreams",
+        ],
+        Effect   = "Allow",
+        Resource = [ var.status_stream_arn ]
+      },
+      {
+        Action   = [
+          "sqs:ChangeMessageVisibility",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes",
+          "sqs:ReceiveMessage",
+          "sqs:SendMessage",
+        ],
+        Effect   = "Allow",
+        Resource = [ var.submit_queue_arn ]
+      },
     ],
   })
 }
@@ -21,4 +21,29 @@ variable "dynamo_db_arn" {
 variable "legacy_table_arn" {
     type = string
     description = "ARN of the legacy DynamoDB table"
-}
\ No newline at end of file
+}
+
+variable "subscriptions_table_arn" {
+    type = string
+    description = "ARN of the webhook subscriptions DynamoDB table"
+}
+
+variable "idempotency_table_arn" {
+    type = string
+    description = "ARN of the submit idempotency key DynamoDB table"
+}
+
+variable "admission_table_arn" {
+    type = string
+    description = "ARN of the per-user admission token bucket DynamoDB table"
+}
+
+variable "submit_queue_arn" {
+    type = string
+    description = "ARN of the queue of submissions for the submit worker"
+}
+
+variable "status_stream_arn" {
+    type = string
+    description = "ARN of the status table's DynamoDB stream"
+}
@@ -0,0 +1,22 @@
+# Submissions waiting for the submit worker to start their flows
+resource "aws_sqs_queue" "submit_jobs" {
+  name                       = "${var.namespace}-submit-jobs-${var.env}"
+  # Longer than the worker can run, so a batch in progress isn't redelivered
+  visibility_timeout_seconds = var.visibility_timeout
+  message_retention_seconds  = 345600
+  # Jobs carry the submitting user's dependent token
+  sqs_managed_sse_enabled    = true
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.submit_jobs_dead_letter.arn
+    maxReceiveCount     = var.max_receive_count
+  })
+  tags = var.resource_tags
+}
+
+# Jobs the worker could not start after max_receive_count tries
+resource "aws_sqs_queue" "submit_jobs_dead_letter" {
+  name                      = "${var.namespace}-submit-jobs-dlq-${var.env}"
+  message_retention_seconds = 1209600
+  sqs_managed_sse_enabled   = true
+  tags = var.resource_tags
+}
@@ -0,0 +1,9 @@
+output "submit_queue_arn" {
+  value = aws_sqs_queue.submit_jobs.arn
+}
+
+output "updated_envs" {
+  value = merge(var.env_vars,
+    { SUBMIT_QUEUE_URL = aws_sqs_queue.submit_jobs.url }
+  )
+}
@@ -0,0 +1,31 @@
+variable "env" {
+  description = "The environment for the deployment. (dev, prod)"
+  type        = string
+}
+
+variable "namespace" {
+  description = "The namespace for the deployment."
+  type        = string
+}
+
+variable "env_vars" {
+  description = "Set of environment variables for the functions."
+  type = map(string)
+}
+
+variable "resource_tags" {
+  description = "Tags to apply to all resources."
+  type = map(string)
+}
+
+variable "visibility_timeout" {
+  description = "Seconds a job is hidden from other workers once received."
+  type = number
+  default = 360
+}
+
+variable "max_receive_count" {
+  description = "Deliveries of a job before it is moved to the dead letter queue."
+  type = number
+  default = 5
+}
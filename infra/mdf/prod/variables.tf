@@ -37,6 +37,8 @@ variable "env_vars" {
         FLOW_ID="4c37a999-da4b-4969-b621-58bfb243c5bc"
         FLOW_SCOPE= "https://auth.globus.org/scopes/4c37a999-da4b-4969-b621-58bfb243c5bc/flow_4c37a999_da4b_4969_b621_58bfb243c5bc_user"
         REQUIRED_GROUP_MEMBERSHIP="cc192dca-3751-11e8-90c1-0a7c735d220a"
+        DYNAMO_READ_CONSISTENCY="status=strong"
+        SUBMIT_MODE="sync"
         }
 }
 
@@ -47,6 +49,8 @@ variable "ecr_repos" {
     "submissions" = "557062710055.dkr.ecr.us-east-1.amazonaws.com/mdf-lambdas/submissions"
     "status" = "557062710055.dkr.ecr.us-east-1.amazonaws.com/mdf-lambdas/status"
     "auth" = "557062710055.dkr.ecr.us-east-1.amazonaws.com/mdf-lambdas/auth"
+    "notify" = "557062710055.dkr.ecr.us-east-1.amazonaws.com/mdf-lambdas/notify"
+    "submit_worker" = "557062710055.dkr.ecr.us-east-1.amazonaws.com/mdf-lambdas/submit_worker"
   }
 }
 
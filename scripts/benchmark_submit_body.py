@@ -0,0 +1,74 @@
+"""
+Compare the CPU time and peak memory of submit's request body handling, before
+and after it was made single-pass, on submissions with multi-MB dc blocks.
+
+Usage: python scripts/benchmark_submit_body.py [size in MB ...]
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+from copy import deepcopy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "aws"))
+from submit import parse_submission_body  # noqa: E402
+
+
+def make_body(size_mb):
+    """A submission whose dc block is about size_mb MB of JSON."""
+    creators = []
+    while len(creators) * 200 < size_mb * 1024 * 1024:
+        i = len(creators)
+        creators.append({
+            "creatorName": "Dobolina, Bob {}".format(i),
+            "familyName": "Dobolina",
+            "givenName": "Bob {}".format(i),
+            "affiliations": ["University of Illinois",
+                             "National Center for Supercomputing Applications"],
+            "score": i / 7
+        })
+    return json.dumps({
+        "dc": {
+            "titles": [{"title": "How to make a dataset"}],
+            "creators": creators
+        },
+        "data_sources": ["https://app.globus.org/file-manager?origin_id=1&origin_path=/"]
+    })
+
+
+def multi_pass(body):
+    """What submit did before: parse, copy, serialize to check for NaN, and
+    serialize the copy to store it."""
+    metadata = json.loads(body)
+    md_copy = deepcopy(metadata)
+    json.dumps(metadata, allow_nan=False)
+    return metadata, json.dumps(md_copy)
+
+
+def single_pass(body):
+    metadata, _ = parse_submission_body(body)
+    return metadata, body
+
+
+def measure(func, body, repeat=5):
+    cpu = []
+    for _ in range(repeat):
+        start = time.process_time()
+        func(body)
+        cpu.append(time.process_time() - start)
+    tracemalloc.start()
+    func(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(cpu), peak
+
+
+if __name__ == "__main__":
+    for size_mb in [float(arg) for arg in sys.argv[1:]] or [1, 4, 16]:
+        body = make_body(size_mb)
+        print("{:.1f} MB body".format(len(body) / 1024 / 1024))
+        for func in (multi_pass, single_pass):
+            cpu, peak = measure(func, body)
+            print("    {:<12} cpu {:8.1f} ms    peak {:8.1f} MB".format(
+                func.__name__, cpu * 1000, peak / 1024 / 1024))
@@ -1,20 +1,21 @@
 import json
 import re
 from decimal import Decimal
-from time import sleep
 
 import boto3
 from boto3.dynamodb.conditions import Key
-from botocore.exceptions import ClientError
 
-RETRY_EXCEPTIONS = ('ProvisionedThroughputExceededException',
-                    'ThrottlingException')
+from aws.dynamo_manager import DynamoManager
+from aws.retry import RetryPolicy, TokenBucket
 
 dynamodb = boto3.resource('dynamodb')
 table = dynamodb.Table('prod-status-alpha-1')
 dest_table = dynamodb.Table('dev-status-0.4')
 print(table)
 scan_kwargs = {}
+# Slow down to whatever rate the destination table can sustain
+retry_policy = RetryPolicy(max_attempts=10, max_delay=30,
+                           rate_limiter=TokenBucket(max_rate=50))
 
 done = False
 start_key = None
@@ -43,22 +44,13 @@ while not done:
             print(item['source_id'], f"[{version}] ({source_name})")
             new_rec = item.copy()
             new_rec['version'] = version
+            new_rec['version_order'] = DynamoManager.version_order(version)
             original_submission = json.loads(item['original_submission'])
             new_rec['source_id'] = original_submission.get('source_name', source_name)
 
-            retries = 0
-            success = False
-            while not success:
-                try:
-                    dest_table.put_item(Item=new_rec)
-                    retries = 0
-                    success = True
-                except ClientError as err:
-                    if err.response['Error']['Code'] not in RETRY_EXCEPTIONS:
-                        raise
-                    print('WHOA, too fast, slow it down retries={}'.format(retries))
-                    sleep(2 ** retries)
-                    retries += 1  # TODO max limit
+            retry_policy.call(dest_table.put_item, Item=new_rec,
+                              on_retry=lambda e, attempt, delay: print(
+                                  'WHOA, too fast, slow it down retries={}'.format(attempt)))
 
     start_key = response.get('LastEvaluatedKey', None)
     done = start_key is None